@@ -0,0 +1,326 @@
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from hnservice.db_service import ITEM_SCHEMAS, DBWriter, mark_items_changed
+from hnservice.models import SyncState
+from news.lookups import filter_in
+from news.models import Base, Comment, FeedEntry, Poll, PollOption, Story
+from news.search import SearchIndex
+from news.snippets import make_excerpt, make_snippet, sanitize_html
+
+# Initialize logging
+import logging
+file_logger = logging.getLogger(__name__)
+
+
+class ItemIngestor():
+    """
+    Creates the items posted to the API. Items are checked against the
+    same schemas the DBWriter projects HN items on, get an id from the
+    local range reserved above HN_LOCAL_ID_START, so they can never
+    collide with HN items, and are written by the DBWriter in batches of
+    batch_size, one transaction each. Their text is stored sanitized, with
+    only the markup HackNews allows. Items are posted by the requesting
+    user: an item naming anyone else as its author is rejected, so no one
+    can post as a HackNews user.
+
+    Methods
+    -------
+    ingest(items: list, author: str)
+        Validate and write the items, returning the status of each
+    validate(item: dict, author: str)
+        Get the errors of an item, by key
+    """
+
+    # Keys of the schemas that are derived or assigned by the server
+    SERVER_KEYS = {'id', 'source', 'snippet', 'excerpt', 'content_type', 'object_id',
+                   'comments'}
+
+    # Keys of the schemas that are named differently in the API
+    MODEL_KEYS = {PollOption: {'parent'}}
+
+    # Keys an item must have, per model, besides its type and author
+    REQUIRED_KEYS = {Comment: ('parent',), PollOption: ('poll',)}
+
+    # Item ids lists
+    ID_LISTS = ('kids', 'parts')
+
+    # What the item of a reference key can be
+    REFERENCES = {'parent': (Story, Poll, Comment), 'poll': (Poll,)}
+
+    def __init__(self, writer: DBWriter = None, batch_size: int = None) -> None:
+        self.writer = writer or DBWriter(projection=False, source=Base.LOCAL)
+        self.batch_size = batch_size or getattr(settings, 'HN_API_INGEST_BATCH_SIZE', 500)
+        self.local_start = getattr(settings, 'HN_LOCAL_ID_START', 1000000000)
+        self.__fields = {
+            model: {field.name: field for field in model._meta.concrete_fields
+                    if not field.is_relation}
+            for model in DBWriter.ITEM_MODELS.values()
+        }
+
+    def ingest(self, items: list, author: str) -> list:
+        """ Validate and write the items
+
+        Parameters
+        ----------
+        items : list
+            The posted items, without ids
+        author : str
+            The username of the user posting the items
+
+        Returns
+        -------
+        list
+            The status of every item, in order: {'status': 'created',
+            'id': int}, or {'status': 'rejected' or 'failed', 'errors': dict}
+        """
+        statuses = [None] * len(items)
+        valid = []
+
+        for index, item in enumerate(items):
+            errors = self.validate(item, author)
+            if errors:
+                statuses[index] = {'status': 'rejected', 'errors': errors}
+            else:
+                valid.append(index)
+
+        for index, errors in self.__check_references(items, valid).items():
+            statuses[index] = {'status': 'rejected', 'errors': errors}
+        valid = [index for index in valid if statuses[index] is None]
+
+        for offset in range(0, len(valid), self.batch_size):
+            batch = valid[offset:offset + self.batch_size]
+            self.__write_batch(items, batch, statuses, author)
+
+        return statuses
+
+    def validate(self, item, author: str) -> dict:
+        """ Check an item against its model's schema and fields, and
+        that its author, if it names one, is the posting user
+
+        Returns
+        -------
+        {str: str}
+            The error of every invalid key, empty if the item is valid
+        """
+        if not isinstance(item, dict):
+            return {'item': "Expected an object"}
+
+        model = DBWriter.ITEM_MODELS.get(item.get('type'))
+        if model is None:
+            return {'type': f"Expected one of {', '.join(DBWriter.ITEM_MODELS)}"}
+
+        accepted = ITEM_SCHEMAS[model] - self.SERVER_KEYS - self.MODEL_KEYS.get(model, set())
+        errors = {key: "Not a field of this type" for key in item.keys() - accepted}
+        if 'id' in item:
+            errors['id'] = "Ids are assigned by the server"
+
+        if item.get('by', author) != author:
+            errors['by'] = f"Items are posted as {author}"
+
+        for key in self.REQUIRED_KEYS.get(model, ()):
+            if key not in item:
+                errors[key] = "This field is required"
+
+        self.check_values(model, item, errors)
+
+        return errors
+
+    def check_values(self, model, item: dict, errors: dict):
+        """ Add the error of every key whose value does not fit its field """
+        for key, value in item.items():
+            if key in errors or key in ('by', 'type'):
+                continue
+
+            if key in self.ID_LISTS or key in self.REFERENCES:
+                ids = value if key in self.ID_LISTS else [value]
+                if not isinstance(ids, list) or not all(
+                        isinstance(item_id, int) and item_id > 0 for item_id in ids):
+                    errors[key] = "Expected item ids"
+                continue
+
+            field = self.__fields[model].get(key)
+            if field is not None:
+                try:
+                    field.clean(value, None)
+                except ValidationError as error:
+                    errors[key] = ' '.join(error.messages)
+
+    def __check_references(self, items: list, indexes: list) -> dict:
+        """ Look up the items referred to by parent and poll keys, with one
+        query per model and chunk of ids
+
+        Returns
+        -------
+        {int: dict}
+            The errors of the items referring to missing items, by index
+        """
+        errors = {}
+
+        for key, models in self.REFERENCES.items():
+            referenced = {items[index][key] for index in indexes if key in items[index]}
+            found = set()
+            for model in models:
+                for chunk in filter_in(model.objects, 'id', referenced - found):
+                    found.update(chunk.values_list('id', flat=True))
+
+            names = ' or '.join(model._meta.model_name for model in models)
+            for index in indexes:
+                if key in items[index] and items[index][key] not in found:
+                    errors[index] = {key: f"No {names} {items[index][key]}"}
+
+        return errors
+
+    def __write_batch(self, items: list, batch: list, statuses: list, author: str):
+        """ Give the batch's items local ids and write them in one
+        transaction """
+        with transaction.atomic():
+            allocated = SyncState.advance(SyncState.LOCAL_IDS, len(batch))
+        first_id = self.local_start + allocated - len(batch)
+
+        now = int(time.time())
+        records = []
+        for item_id, index in enumerate(batch, first_id):
+            record = {'time': now, **items[index], 'id': item_id, 'by': author}
+            if record.get('text'):
+                record['text'] = sanitize_html(record['text'])
+            records.append(record)
+
+        stats = self.writer.write_items_to_db(records)
+
+        # Every reference was checked, nothing is expected to wait for
+        # its parent
+        deferred = self.writer.drop_orphans(record['id'] for record in records)
+
+        written = self.__written(records) if stats['skipped'] else None
+
+        failed = []
+        for index, record in zip(batch, records):
+            if record['id'] in deferred or (written is not None and record['id'] not in written):
+                failed.append(record['id'])
+                statuses[index] = {'status': 'failed',
+                                   'errors': {'item': "The item could not be written"}}
+            else:
+                statuses[index] = {'status': 'created', 'id': record['id']}
+
+        if failed:
+            file_logger.error(f"Could not write posted items {failed}: {stats}")
+
+    def __written(self, records: list) -> set:
+        """ Look up which of the records were stored, with one query per
+        model and chunk of ids, once a batch had items skipped """
+        ids_by_model = {}
+        for record in records:
+            ids_by_model.setdefault(DBWriter.ITEM_MODELS[record['type']], []).append(record['id'])
+
+        written = set()
+        for model, ids in ids_by_model.items():
+            stored = model.objects.filter(source=Base.LOCAL)
+            for chunk in filter_in(stored, 'id', ids):
+                written.update(chunk.values_list('id', flat=True))
+
+        return written
+
+
+class LocalItemEditor():
+    """
+    Changes and deletes local items. The source is part of the WHERE
+    clause of the one UPDATE that applies the change, so an item from
+    HackNews is never read, checked and then written. Changed text is
+    stored sanitized, like the text of posted items.
+
+    Methods
+    -------
+    update(item_type: str, item_id: int, changes: dict)
+        Change the editable fields of a local item
+    delete(item_type: str, item_id: int)
+        Delete a local item
+    """
+
+    # Fields that can be changed after an item was created
+    EDITABLE_KEYS = {'title', 'text', 'url', 'score', 'descendants', 'dead'}
+
+    def __init__(self) -> None:
+        self.ingestor = ItemIngestor()
+        self.search_index = SearchIndex()
+
+    def validate(self, item_type: str, changes) -> dict:
+        """ Check the changes of an item of the type
+
+        Returns
+        -------
+        {str: str}
+            The error of every invalid key, empty if the changes are valid
+        """
+        if not isinstance(changes, dict) or not changes:
+            return {'item': "Expected an object of changes"}
+
+        model = DBWriter.ITEM_MODELS[item_type]
+        editable = self.EDITABLE_KEYS & ITEM_SCHEMAS[model]
+        errors = {key: "Cannot be changed" for key in changes.keys() - editable}
+        self.ingestor.check_values(model, changes, errors)
+
+        return errors
+
+    def update(self, item_type: str, item_id: int, changes: dict) -> bool:
+        """ Apply validated changes to a local item, its feed entry and its
+        search document
+
+        Returns
+        -------
+        bool
+            Whether a local item was changed
+        """
+        model = DBWriter.ITEM_MODELS[item_type]
+        fields = dict(changes)
+        if 'text' in fields:
+            fields['text'] = sanitize_html(fields['text'])
+            fields['snippet'] = make_snippet(fields['text'])
+            fields['excerpt'] = make_excerpt(fields['text'])
+
+        with transaction.atomic():
+            if not model.objects.filter(pk=item_id, source=Base.LOCAL).update(**fields):
+                return False
+
+            feed_fields = {key: fields[key] for key in ('score', 'title', 'snippet', 'excerpt')
+                           if key in fields}
+            if feed_fields:
+                FeedEntry.objects.filter(pk=item_id).update(**feed_fields)
+
+            if 'title' in fields or 'text' in fields:
+                document = model.objects.filter(pk=item_id).values(
+                    *(key for key in ('title', 'text') if key in ITEM_SCHEMAS[model])).get()
+                self.search_index.update([(item_id, item_type, document.get('title'),
+                                           document['text'])])
+
+            mark_items_changed()
+
+        return True
+
+    def delete(self, item_type: str, item_id: int) -> bool:
+        """ Delete a local item the way HackNews does: the row is kept with
+        `deleted` set and its content blanked, so its replies stay in
+        their thread, and it leaves the feed and the search index
+
+        Returns
+        -------
+        bool
+            Whether a local item was deleted
+        """
+        model = DBWriter.ITEM_MODELS[item_type]
+        blanked = {key: '' for key in ('title', 'text', 'url', 'snippet', 'excerpt')
+                   if key in ITEM_SCHEMAS[model]}
+
+        with transaction.atomic():
+            if not model.objects.filter(pk=item_id, source=Base.LOCAL, deleted=False).update(
+                    deleted=True, **blanked):
+                return False
+
+            FeedEntry.objects.filter(pk=item_id).delete()
+            self.search_index.remove([item_id])
+            mark_items_changed()
+
+        return True
@@ -0,0 +1,90 @@
+import json
+
+from news.models import Base, Comment, FeedEntry, Job, Poll, PollOption, Story
+
+
+class ItemSerializer():
+    """
+    Turns stored rows back into the items of the HackNews API, restricted
+    to the requested fields. Rows are read with values() and only the
+    columns behind the requested fields are selected.
+
+    Methods
+    -------
+    columns(model: Model)
+        The (field, column) pairs of the requested fields the model has
+    to_representation(row: dict, columns: list)
+        The item of a row read with those columns
+    """
+
+    ITEM_MODELS = {
+        Base.COMMENT: Comment,
+        Base.JOB: Job,
+        Base.POLL: Poll,
+        Base.POLLOPT: PollOption,
+        Base.STORY: Story,
+    }
+
+    # Every field of an item, in the API's order
+    FIELDS = ('id', 'type', 'by', 'time', 'title', 'text', 'url', 'score',
+              'descendants', 'parent', 'poll', 'parts', 'kids', 'dead', 'deleted',
+              'source')
+
+    # Fields the feed table can answer on its own
+    FEED_FIELDS = ('id', 'type', 'by', 'time', 'title', 'score')
+
+    # Fields stored under another column name, per model
+    RENAMED = {
+        Comment: {'parent': 'object_id'},
+        PollOption: {'poll': 'parent_id'},
+    }
+
+    # Id lists stored as JSON text
+    ID_LISTS = ('kids', 'parts')
+
+    def __init__(self, fields=None) -> None:
+        self.fields = tuple(fields or self.FIELDS)
+
+    @classmethod
+    def parse_fields(cls, fields: str):
+        """ Read a comma separated ?fields= list
+
+        Returns
+        -------
+        (tuple, list)
+            The known fields, in the API's order, and the unknown ones
+        """
+        requested = {name.strip() for name in (fields or '').split(',') if name.strip()}
+
+        return (tuple(name for name in cls.FIELDS if name in requested) or cls.FIELDS,
+                sorted(requested - set(cls.FIELDS)))
+
+    @property
+    def needs_items(self) -> bool:
+        """ Whether the item tables have to be read, or the feed is enough """
+        return not set(self.fields) <= set(self.FEED_FIELDS)
+
+    def columns(self, model) -> list:
+        renamed = self.RENAMED.get(model, {})
+        names = {field.attname for field in model._meta.concrete_fields}
+        names |= {field.name for field in model._meta.concrete_fields}
+
+        columns = []
+        for field in self.fields:
+            column = renamed.get(field, field)
+            if field == 'by' and model is not FeedEntry:
+                column = 'by_id'
+            if column in names:
+                columns.append((field, column))
+
+        return columns
+
+    def to_representation(self, row: dict, columns: list) -> dict:
+        item = {}
+        for field, column in columns:
+            value = row[column]
+            if field in self.ID_LISTS:
+                value = json.loads(value) if value else []
+            item[field] = value
+
+        return item
@@ -0,0 +1,329 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls.base import reverse
+
+from api.ingest import ItemIngestor
+from hnservice.db_service import DBWriter
+from hnservice.sync import SyncEngine
+from news.models import Base, Comment, FeedEntry, PollOption, Story, User
+from news.search import SearchIndex
+
+
+class ItemListViewTests(TestCase):
+
+    def setUp(self) -> None:
+        User.objects.create(id="pg", created=1160418092, karma=155111)
+        self.writer = DBWriter()
+        self.writer.write_items_to_db([
+            {"id": 1, "by": "pg", "type": "story", "time": 100, "score": 10,
+             "title": "Rust in production", "url": "https://example.com", "kids": [2]},
+            {"id": 2, "by": "dang", "type": "comment", "time": 200, "parent": 1,
+             "text": "Nice <i>post</i>"},
+            {"id": 3, "by": "pg", "type": "job", "time": 300, "score": 1,
+             "title": "Hiring", "text": "Write Rust with us"},
+            {"id": 4, "by": "pg", "type": "poll", "time": 400, "score": 50,
+             "title": "Tabs or spaces", "parts": [5]},
+            {"id": 5, "by": "pg", "type": "pollopt", "time": 400, "poll": 4,
+             "text": "Tabs"},
+        ])
+
+    def get_items(self, **params):
+        response = self.client.get(reverse('api_items'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, **params):
+        return [item["id"] for item in self.get_items(**params)["items"]]
+
+    def test_items_are_listed_newest_first_in_api_format(self):
+        items = self.get_items()["items"]
+
+        self.assertEqual([item["id"] for item in items], [5, 4, 3, 2, 1])
+        self.assertEqual(items[0]["poll"], 4)
+        self.assertEqual(items[1]["parts"], [5])
+        self.assertEqual(items[3]["parent"], 1)
+        self.assertEqual(items[4]["kids"], [2])
+        self.assertEqual(items[4]["url"], "https://example.com")
+        self.assertNotIn("url", items[3])
+
+    def test_filters(self):
+        self.assertEqual(self.ids(type="story"), [1])
+        self.assertEqual(self.ids(by="dang"), [2])
+        self.assertEqual(self.ids(time_after=200, time_before=300), [3, 2])
+        self.assertEqual(self.ids(score_min=5), [4, 1])
+        self.assertEqual(self.ids(score_min=5, score_max=20), [1])
+        self.assertEqual(sorted(self.ids(text="rust")), [1, 3])
+
+    def test_invalid_filters_are_rejected(self):
+        for params in ({"type": "video"}, {"score_min": "high"}, {"fields": "id,secret"},
+                       {"limit": 0}):
+            response = self.client.get(reverse('api_items'), params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_cursor_pagination(self):
+        page = self.get_items(limit=2)
+        self.assertEqual([item["id"] for item in page["items"]], [5, 4])
+        self.assertIsNone(page["previous"])
+
+        page = self.client.get(page["next"]).json()
+        self.assertEqual([item["id"] for item in page["items"]], [3, 2])
+
+        page = self.client.get(page["previous"]).json()
+        self.assertEqual([item["id"] for item in page["items"]], [5, 4])
+
+    def test_sparse_fields_are_served_from_the_feed(self):
+        with CaptureQueriesContext(connection) as queries:
+            items = self.get_items(fields="id,title,score")["items"]
+
+        self.assertEqual(items[1], {"id": 4, "title": "Tabs or spaces", "score": 50})
+        self.assertFalse(any('"news_story"' in query["sql"]
+                             for query in queries.captured_queries))
+
+    def test_detail(self):
+        response = self.client.get(reverse('api_item_detail', kwargs={"pk": 2}))
+
+        self.assertEqual(response.json()["text"], "Nice <i>post</i>")
+        self.assertEqual(
+            self.client.get(reverse('api_item_detail', kwargs={"pk": 99})).status_code, 404)
+
+
+class ConditionalRequestTests(TestCase):
+
+    def setUp(self) -> None:
+        self.writer = DBWriter()
+        self.writer.write_items_to_db([
+            {"id": 1, "by": "pg", "type": "story", "title": "First", "score": 1}])
+
+    def test_unchanged_items_are_not_modified(self):
+        response = self.client.get(reverse('api_items'))
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api_items'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1)
+
+    def test_a_written_batch_changes_the_etag(self):
+        etag = self.client.get(reverse('api_items'))["ETag"]
+
+        self.writer.write_items_to_db([
+            {"id": 1, "by": "pg", "type": "story", "title": "First", "score": 2}])
+        response = self.client.get(reverse('api_items'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["items"][0]["score"], 2)
+
+    def test_etag_depends_on_the_query(self):
+        etag = self.client.get(reverse('api_items'))["ETag"]
+
+        response = self.client.get(reverse('api_items'), {"type": "job"},
+                                   HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+
+class ItemBulkCreateViewTests(TestCase):
+
+    def setUp(self) -> None:
+        DBWriter().write_items_to_db([
+            {"id": 1, "by": "pg", "type": "story", "title": "First", "score": 1},
+            {"id": 2, "by": "pg", "type": "poll", "title": "Poll"}])
+        self.client.force_login(get_user_model().objects.create_user("jl"))
+
+    def post(self, body, content_type="application/json"):
+        return self.client.post(reverse('api_items_bulk'), body, content_type=content_type)
+
+    def test_json_array_gets_local_ids_and_statuses(self):
+        response = self.post(json.dumps([
+            {"type": "story", "by": "jl", "title": "Local story"},
+            {"type": "comment", "by": "jl", "parent": 1, "text": "A reply"},
+            {"type": "story", "by": "jl", "id": 5},
+            {"type": "pollopt", "by": "jl", "poll": 1, "text": "Not a poll"},
+            {"type": "pollopt", "by": "jl", "poll": 2, "text": "Yes"},
+            {"type": "video", "by": "jl"},
+            {"type": "story", "by": "jl", "url": "not a url", "color": "red"},
+        ]))
+
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body["created"], body["rejected"]), (3, 4))
+        statuses = [item["status"] for item in body["items"]]
+        self.assertEqual(statuses, ["created", "created", "rejected", "rejected",
+                                    "created", "rejected", "rejected"])
+        self.assertIn("id", body["items"][2]["errors"])
+        self.assertIn("poll", body["items"][3]["errors"])
+        self.assertEqual(set(body["items"][6]["errors"]), {"url", "color"})
+
+        story_id, comment_id = body["items"][0]["id"], body["items"][1]["id"]
+        self.assertGreaterEqual(story_id, settings.HN_LOCAL_ID_START)
+        self.assertEqual(comment_id, story_id + 1)
+        self.assertEqual(Comment.objects.get(id=comment_id).object_id, 1)
+        self.assertEqual(PollOption.objects.get(id=body["items"][4]["id"]).parent_id, 2)
+        self.assertTrue(FeedEntry.objects.filter(id=story_id).exists())
+        self.assertIsNotNone(Story.objects.get(id=story_id).time)
+
+    def test_ndjson_is_written_in_batches(self):
+        lines = "\n".join(json.dumps({"type": "story", "by": "jl", "title": f"Story {index}"})
+                          for index in range(1200))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(lines + "\n", content_type="application/x-ndjson")
+
+        self.assertEqual(response.json()["created"], 1200)
+        ids = [item["id"] for item in response.json()["items"]]
+        self.assertEqual(len(set(ids)), 1200)
+        self.assertEqual(Story.objects.filter(id__gte=settings.HN_LOCAL_ID_START).count(), 1200)
+        # Three batches of 500 items, not a query per item
+        self.assertLess(len(queries), 120)
+
+    def test_invalid_bodies_are_rejected(self):
+        self.assertEqual(self.post(json.dumps({"type": "story"})).status_code, 400)
+        self.assertEqual(self.post('{"type": "story"}\nnot json',
+                                   content_type="application/x-ndjson").status_code, 400)
+        self.assertEqual(self.post(json.dumps([{"type": "story", "by": "pg"}])).status_code, 400)
+
+    def test_anonymous_users_cannot_create_items(self):
+        self.client.logout()
+
+        response = self.post(json.dumps([{"type": "story", "by": "jl", "title": "Spam"}]))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Story.objects.filter(title="Spam").exists())
+
+    def test_text_is_stored_sanitized(self):
+        response = self.post(json.dumps([{"type": "story", "by": "jl", "title": "Local",
+                                          "text": "<i>Hi</i><script>alert(1)</script>"
+                                                  "<img src=x onerror=alert(1)>"}]))
+
+        story = Story.objects.get(id=response.json()["items"][0]["id"])
+        self.assertEqual(story.text, "<i>Hi</i>")
+
+    def test_items_are_posted_as_the_user(self):
+        response = self.post(json.dumps([
+            {"type": "story", "title": "Mine"},
+            {"type": "story", "by": "pg", "title": "Impersonated"},
+        ]))
+
+        statuses = response.json()["items"]
+        self.assertEqual([item["status"] for item in statuses], ["created", "rejected"])
+        self.assertIn("by", statuses[1]["errors"])
+        self.assertEqual(Story.objects.get(id=statuses[0]["id"]).by_id, "jl")
+        self.assertFalse(Story.objects.filter(title="Impersonated").exists())
+
+    def test_sync_watermark_ignores_local_items(self):
+        self.post(json.dumps([{"type": "story", "by": "jl", "title": "Local"}]))
+
+        self.assertEqual(SyncEngine(initial_items=10).get_watermark(100), 90)
+
+
+class LocalItemEditTests(TestCase):
+
+    def setUp(self) -> None:
+        DBWriter().write_items_to_db([
+            {"id": 1, "by": "pg", "type": "story", "title": "From HN", "score": 1}])
+        self.client.force_login(get_user_model().objects.create_user("jl"))
+        response = self.client.post(reverse('api_items_bulk'), json.dumps(
+            [{"type": "story", "by": "jl", "title": "Local story", "text": "Local text"}]),
+            content_type="application/json")
+        self.local_id = response.json()["items"][0]["id"]
+
+    def url(self, pk):
+        return reverse('api_item_detail', kwargs={"pk": pk})
+
+    def patch(self, pk, changes):
+        return self.client.patch(self.url(pk), json.dumps(changes),
+                                 content_type="application/json")
+
+    def test_local_item_can_be_changed(self):
+        response = self.patch(self.local_id, {"title": "Renamed", "text": "New <i>text</i>"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], "Renamed")
+        self.assertEqual(response.json()["source"], "local")
+        self.assertEqual(FeedEntry.objects.get(id=self.local_id).snippet, "New <i>text</i>")
+        self.assertEqual(SearchIndex().search("renamed"), [self.local_id])
+
+    def test_anonymous_users_cannot_change_or_delete(self):
+        self.client.logout()
+
+        self.assertEqual(self.patch(self.local_id, {"title": "Defaced"}).status_code, 403)
+        self.assertEqual(self.client.delete(self.url(self.local_id)).status_code, 403)
+        self.assertEqual(self.client.get(self.url(self.local_id)).status_code, 200)
+        self.assertEqual(Story.objects.get(id=self.local_id).title, "Local story")
+
+    def test_changed_text_is_stored_sanitized(self):
+        self.patch(self.local_id, {"text": "<b>Bold</b><script>alert(1)</script>"})
+
+        self.assertEqual(Story.objects.get(id=self.local_id).text, "<b>Bold</b>")
+
+    def test_hn_item_cannot_be_changed_or_deleted(self):
+        self.assertEqual(self.patch(1, {"title": "Hijacked"}).status_code, 403)
+        self.assertEqual(self.client.delete(self.url(1)).status_code, 403)
+        self.assertEqual(Story.objects.get(id=1).title, "From HN")
+
+    def test_change_is_one_guarded_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.patch(1, {"score": 5})
+
+        updates = [query["sql"] for query in queries.captured_queries
+                   if query["sql"].startswith('UPDATE "news_story"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"news_story"."source" = \'local\'', updates[0])
+        self.assertFalse(any(query["sql"].startswith('SELECT') and '"news_story"' in query["sql"]
+                             for query in queries.captured_queries))
+
+    def test_invalid_changes_are_rejected(self):
+        self.assertEqual(self.patch(self.local_id, {"by": "someone"}).status_code, 400)
+        self.assertEqual(self.patch(self.local_id, {"score": "many"}).status_code, 400)
+        self.assertEqual(self.patch(99, {"score": 1}).status_code, 404)
+
+    def test_local_item_can_be_deleted(self):
+        response = self.client.delete(self.url(self.local_id))
+
+        self.assertEqual(response.status_code, 204)
+        story = Story.objects.get(id=self.local_id)
+        self.assertTrue(story.deleted)
+        self.assertEqual(story.title, "")
+        self.assertEqual(self.client.get(self.url(self.local_id)).status_code, 404)
+        self.assertEqual(SearchIndex().search("local"), [])
+
+    def test_hn_sync_never_overwrites_local_items(self):
+        stats = DBWriter().write_items_to_db([
+            {"id": self.local_id, "by": "pg", "type": "story", "title": "Overwritten"}])
+
+        self.assertEqual(stats["skipped"], 1)
+        self.assertEqual(Story.objects.get(id=self.local_id).title, "Local story")
+        self.assertEqual(FeedEntry.objects.get(id=self.local_id).title, "Local story")
+
+
+class ItemIngestorTests(TestCase):
+
+    class DroppingWriter(DBWriter):
+        """ Skips the items titled "Broken" as if they could not be written """
+
+        def write_items_to_db(self, news_items, raise_errors=False):
+            news_items = list(news_items)
+            kept = [item for item in news_items if item.get("title") != "Broken"]
+            stats = super().write_items_to_db(kept, raise_errors)
+            stats['skipped'] += len(news_items) - len(kept)
+            return stats
+
+    def test_skipped_items_fail_alone(self):
+        ingestor = ItemIngestor(writer=self.DroppingWriter(projection=False, source=Base.LOCAL))
+
+        statuses = ingestor.ingest([
+            {"type": "story", "title": "Fine"},
+            {"type": "story", "title": "Broken"},
+            {"type": "story", "title": "Also fine"},
+        ], "jl")
+
+        self.assertEqual([item["status"] for item in statuses], ["created", "failed", "created"])
+        self.assertTrue(Story.objects.filter(id=statuses[2]["id"], title="Also fine").exists())
@@ -0,0 +1,8 @@
+from django.urls import path
+from .views import ItemBulkCreateView, ItemDetailView, ItemListView
+
+urlpatterns = [
+    path('items/', ItemListView.as_view(), name='api_items'),
+    path('items/<int:pk>', ItemDetailView.as_view(), name='api_item_detail'),
+    path('items/bulk', ItemBulkCreateView.as_view(), name='api_items_bulk'),
+]
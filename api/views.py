@@ -0,0 +1,256 @@
+import hashlib
+
+from django.conf import settings
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from rest_framework import status
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework.views import APIView
+
+from hnservice.models import SyncState
+from news.models import FeedEntry
+from news.pagination import paginate_by_key
+from news.search import SearchIndex
+from .ingest import ItemIngestor, LocalItemEditor
+from .parsers import NDJSONParser
+from .serializers import ItemSerializer
+
+
+def get_items_state(request):
+    """ The version of the stored items, read once per request """
+    if not hasattr(request, 'items_state'):
+        request.items_state = SyncState.objects.filter(name=SyncState.ITEMS).first()
+
+    return request.items_state
+
+
+def items_etag(request, *args, **kwargs) -> str:
+    """ Changes with every batch written and with the query itself """
+    state = get_items_state(request)
+    digest = hashlib.md5(request.get_full_path().encode()).hexdigest()[:12]
+
+    return f"{state.value if state else 0}-{digest}"
+
+
+def items_last_modified(request, *args, **kwargs):
+    state = get_items_state(request)
+    return state.updated if state else None
+
+
+# Clients polling with If-None-Match or If-Modified-Since get a 304
+# without the items being read
+conditional = method_decorator(
+    condition(etag_func=items_etag, last_modified_func=items_last_modified),
+    name='get')
+
+
+class ItemsView(APIView):
+    """ Reads pages of items and serializes them with only the requested
+    ?fields=. Items are paged and filtered on the feed table, the other
+    item tables are only read for fields the feed does not have, with one
+    query per type on the page.
+    """
+
+    # The version, the page and one query per item type
+    query_budget = 8
+
+    def get_serializer(self) -> ItemSerializer:
+        fields, unknown = ItemSerializer.parse_fields(self.request.query_params.get('fields'))
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+
+        return ItemSerializer(fields)
+
+    def serialize(self, entries: list, serializer: ItemSerializer) -> list:
+        """ Serialize feed entries, reading the item tables if needed """
+        if not serializer.needs_items:
+            columns = serializer.columns(FeedEntry)
+            return [serializer.to_representation(entry.__dict__, columns)
+                    for entry in entries]
+
+        ids_by_type = {}
+        for entry in entries:
+            ids_by_type.setdefault(entry.type, []).append(entry.id)
+
+        items = {}
+        for item_type, ids in ids_by_type.items():
+            model = ItemSerializer.ITEM_MODELS[item_type]
+            columns = serializer.columns(model)
+            rows = model.objects.filter(id__in=ids).values(
+                'id', *{column for field, column in columns})
+            items.update((row['id'], serializer.to_representation(row, columns))
+                         for row in rows)
+
+        return [items[entry.id] for entry in entries if entry.id in items]
+
+
+@conditional
+class ItemListView(ItemsView):
+    """
+    Lists items newest first
+
+    Filters
+    -------
+    type : str
+        Only items of this type
+    by : str
+        Only items of this author
+    time_after, time_before : int
+        Only items posted in this range of Unix times, inclusive
+    score_min, score_max : int
+        Only items scored in this range, inclusive
+    text : str
+        Only items whose title or text match every word, among the
+        HN_API_TEXT_MATCHES most relevant ones
+
+    Pages are seeked with the ?before= and ?after= cursors of the `next`
+    and `previous` links, and hold ?limit= items.
+    """
+
+    RANGE_FILTERS = {
+        'time_after': 'time__gte',
+        'time_before': 'time__lte',
+        'score_min': 'score__gte',
+        'score_max': 'score__lte',
+    }
+
+    def get(self, request):
+        serializer = self.get_serializer()
+        params = request.query_params
+        entries = FeedEntry.objects.only('id', 'type', *serializer.FEED_FIELDS)
+
+        item_type = params.get('type')
+        if item_type:
+            if item_type not in ItemSerializer.ITEM_MODELS:
+                raise ValidationError({'type': f"Expected one of {', '.join(ItemSerializer.ITEM_MODELS)}"})
+            entries = entries.filter(type=item_type)
+
+        if params.get('by'):
+            entries = entries.filter(by=params['by'])
+
+        for param, lookup in self.RANGE_FILTERS.items():
+            if params.get(param):
+                entries = entries.filter(**{lookup: self.get_int(param)})
+
+        if params.get('text'):
+            entries = entries.filter(id__in=SearchIndex().search(
+                params['text'], item_type or None,
+                limit=getattr(settings, 'HN_API_TEXT_MATCHES', 500)))
+
+        page = paginate_by_key(entries, self.get_page_size(),
+                               before=params.get('before'), after=params.get('after'))
+
+        return Response({
+            'items': self.serialize(page.object_list, serializer),
+            'next': self.get_link('before', page.next_cursor) if page.has_next else None,
+            'previous': self.get_link('after', page.previous_cursor) if page.has_previous else None,
+        })
+
+    def get_int(self, param: str) -> int:
+        try:
+            return int(self.request.query_params[param])
+        except ValueError:
+            raise ValidationError({param: "Expected an integer"})
+
+    def get_page_size(self) -> int:
+        if not self.request.query_params.get('limit'):
+            return getattr(settings, 'HN_API_PAGE_SIZE', 20)
+
+        limit = self.get_int('limit')
+        if limit < 1:
+            raise ValidationError({'limit': "Expected a positive integer"})
+
+        return min(limit, getattr(settings, 'HN_API_MAX_PAGE_SIZE', 100))
+
+    def get_link(self, cursor: str, value: int) -> str:
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'before' if cursor == 'after' else 'after')
+
+        return replace_query_param(url, cursor, value)
+
+
+@conditional
+class ItemDetailView(ItemsView):
+    """ Shows a single item. Items created through the API can also be
+    changed with PATCH and deleted with DELETE by authenticated users,
+    items from HackNews cannot.
+    """
+
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    # The session and its user, the type lookup, the guarded UPDATE and
+    # what it is mirrored to
+    query_budget = 14
+
+    def get(self, request, pk):
+        serializer = self.get_serializer()
+        entry = FeedEntry.objects.only('id', 'type', *serializer.FEED_FIELDS).filter(pk=pk).first()
+
+        items = self.serialize([entry], serializer) if entry else []
+        if not items:
+            raise NotFound(f"No item {pk}")
+
+        return Response(items[0])
+
+    def patch(self, request, pk):
+        item_type = self.get_item_type(pk)
+        editor = LocalItemEditor()
+
+        errors = editor.validate(item_type, request.data)
+        if errors:
+            raise ValidationError(errors)
+
+        if not editor.update(item_type, pk, request.data):
+            raise PermissionDenied("Only items created through the API can be changed")
+
+        serializer = ItemSerializer()
+        return Response(self.serialize([FeedEntry(id=pk, type=item_type)], serializer)[0])
+
+    def delete(self, request, pk):
+        item_type = self.get_item_type(pk)
+
+        if not LocalItemEditor().delete(item_type, pk):
+            raise PermissionDenied("Only items created through the API can be deleted")
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def get_item_type(self, pk: int) -> str:
+        item_type = FeedEntry.objects.filter(pk=pk).values_list('type', flat=True).first()
+        if item_type is None:
+            raise NotFound(f"No item {pk}")
+
+        return item_type
+
+
+class ItemBulkCreateView(APIView):
+    """ Creates items from a JSON array or from NDJSON, one item per line,
+    and answers with the status of every item in order. Valid items are
+    created even if others are rejected. Only authenticated users can
+    create items.
+    """
+
+    parser_classes = [JSONParser, NDJSONParser]
+    permission_classes = [IsAuthenticated]
+
+    # Grows with the number of batches posted
+    query_budget = None
+
+    def post(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'items': "Expected a JSON array or NDJSON"})
+
+        max_items = getattr(settings, 'HN_API_INGEST_MAX_ITEMS', 10000)
+        if len(items) > max_items:
+            raise ValidationError({'items': f"Expected at most {max_items} items"})
+
+        statuses = ItemIngestor().ingest(items, request.user.get_username())
+        created = sum(1 for item_status in statuses if item_status['status'] == 'created')
+
+        return Response(
+            {'created': created, 'rejected': len(statuses) - created, 'items': statuses},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,10 +43,12 @@ INSTALLED_APPS = [
     'news.apps.NewsConfig',
     'accounts.apps.AccountsConfig',
     'hnservice.apps.HnserviceConfig',
+    'api.apps.ApiConfig',
 
     # 3rd party apps
     'debug_toolbar',
     'background_task',
+    'rest_framework',
 ]
 
 # AUTH_USER_MODEL = 'accounts.User'
@@ -59,6 +62,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'news.middleware.QueryBudgetMiddleware',
 ]
 
 INTERNAL_IPS = ('127.0.0.1',)
@@ -83,6 +87,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
+# Gives the tests caches of their own
+TEST_RUNNER = 'config.test_runner.TestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -164,4 +171,116 @@ LOGGING = {
             'propagate': True,
         },
     },
-}
\ No newline at end of file
+}
+
+# Hacker News sync
+# Number of items fetched concurrently per batch when catching up to maxitem
+HN_SYNC_BATCH_SIZE = 100
+# How far back from maxitem the very first sync starts
+HN_SYNC_INITIAL_ITEMS = 100
+# A missing item is skipped after this many runs waited for it, or at once
+# if it is this many ids below maxitem
+HN_SYNC_MISSING_RETRIES = 5
+HN_SYNC_MISSING_MARGIN = 1000
+# Connection pool and concurrency window of hnservice.api_service.HNFetcher
+HN_FETCHER = {
+    'CONCURRENCY': 50,
+    'LIMIT': 100,
+    'LIMIT_PER_HOST': 50,
+    'KEEPALIVE_TIMEOUT': 60,
+    'DNS_CACHE_TTL': 300,
+    'TIMEOUT': 30,
+}
+# Drop item keys the models have no field for instead of rejecting the item
+HN_DB_WRITER_PROJECTION = True
+# Number of user profiles fetched at once to complete new authors
+HN_PROFILE_CONCURRENCY = 5
+# Seconds fetched profiles may wait before they are written
+HN_PROFILE_FLUSH_INTERVAL = 30
+# Comments kept for a retry while their parent has not been synced yet
+HN_ORPHAN_LIMIT = 10000
+# Limits of the comment thread backfill
+HN_CRAWL_MAX_DEPTH = 10
+HN_CRAWL_MAX_ITEMS = 5000
+# Seconds between the runs of the sync worker's jobs, see
+# `python manage.py sync_worker`
+HN_SYNC_FEED_INTERVAL = 300
+HN_SYNC_CATCHUP_INTERVAL = 60
+HN_SYNC_SCORE_INTERVAL = 300
+HN_SYNC_UPDATES_INTERVAL = 30
+# Seconds a worker holds a job before another process can take it over
+HN_SYNC_LEASE_DURATION = 90
+# Refresh tiers of stories, polls and jobs as (age below, seconds between
+# refreshes), see hnservice.refresh.ScoreRefresher. Older items are frozen.
+HN_SCORE_REFRESH_TIERS = ((2 * 3600, 300), (86400, 3600))
+# Points an hour gained between two refreshes from which an item is
+# refreshed like the first tier
+HN_SCORE_REFRESH_HOT_VELOCITY = 20
+# Items refreshed at most per run, the fastest tiers first
+HN_SCORE_REFRESH_MAX_ITEMS = 500
+# Seconds the feed rank snapshots are kept, the latest one is always kept
+HN_FEED_RANK_RETENTION = 86400
+
+
+# Pages
+# Levels of replies loaded on a detail page
+HN_THREAD_MAX_DEPTH = 20
+# Queries a request may run unless its view sets query_budget, checked in
+# debug runs, and always by config.test_runner.TestRunner
+HN_QUERY_BUDGET = 30
+HN_QUERY_BUDGET_CHECK = DEBUG
+
+# API
+# Items per page of /api/items/, by default and at most
+HN_API_PAGE_SIZE = 20
+HN_API_MAX_PAGE_SIZE = 100
+# Best matches of a ?text= filter that are paged through
+HN_API_TEXT_MATCHES = 500
+# Items created through the API get ids from here on, far above HN's
+HN_LOCAL_ID_START = 1000000000
+# Items accepted per POST to /api/items/bulk, and written per transaction
+HN_API_INGEST_MAX_ITEMS = 10000
+HN_API_INGEST_BATCH_SIZE = 500
+REST_FRAMEWORK = {
+    # Items are read by anyone, only users can write them
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'rest_framework.permissions.IsAuthenticatedOrReadOnly',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+
+# Caches
+# LocMemCache is per process and evicts the least recently used entries
+# beyond MAX_ENTRIES. The sync worker invalidates the searches, pages and
+# fragments in its own process, so they are cached in files every process
+# shares.
+HN_CACHE_DIR = Path(os.environ.get('HN_CACHE_DIR', BASE_DIR / 'cache'))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search': {
+        'BACKEND': 'news.cache.LRUFileBasedCache',
+        'LOCATION': HN_CACHE_DIR / 'search',
+        'TIMEOUT': 600,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    'fragments': {
+        'BACKEND': 'news.cache.LRUFileBasedCache',
+        'LOCATION': HN_CACHE_DIR / 'fragments',
+        'TIMEOUT': 600,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+SEARCH_CACHE_ALIAS = 'search'
+# Rendered list pages and their per-item fragments
+FRAGMENT_CACHE_ALIAS = 'fragments'
+FRAGMENT_CACHE_TIMEOUT = 86400
@@ -0,0 +1,33 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with caches of their own, in a temporary directory
+    removed after the run, so tests neither read nor wipe the caches of
+    the development server and nothing is carried over between runs. The
+    query budgets of the views are checked whatever DEBUG is.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+
+        self.cache_dir = tempfile.mkdtemp(prefix='hn-test-cache-')
+        caches = {alias: {**config, 'LOCATION': os.path.join(self.cache_dir, alias)}
+                  if 'LOCATION' in config else config
+                  for alias, config in settings.CACHES.items()}
+
+        self.test_settings = override_settings(CACHES=caches, HN_QUERY_BUDGET_CHECK=True)
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+        super().teardown_test_environment(**kwargs)
@@ -17,15 +17,10 @@ import debug_toolbar
 from django.contrib import admin
 from django.urls import path, include
 
-import hnservice.tasks
-
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('news.urls')),
+    path('api/', include('api.urls')),
     path('__debug__/', include(debug_toolbar.urls)),
 ]
-
-
-# Start task to download news items
-hnservice.tasks.start_task()
@@ -2,97 +2,244 @@ from typing import Tuple
 import aiohttp
 import asyncio
 
+from django.conf import settings
+
 # Initialize logging
 import logging
 file_logger = logging.getLogger(__name__)
 
 baseUrl = "https://hacker-news.firebaseio.com/v0"
 
+# Given by the fetcher in place of an item whose request failed, so it can
+# be told apart from an item the API answered with null
+FETCH_FAILED = object()
+
+
+class HNFetcher():
+    """
+    Queries the HackNews API through one long-lived, pooled client session.
+    At most `concurrency` requests are in flight at any time, however many
+    items are requested, so large backfills neither exhaust sockets nor
+    repeat the TCP/TLS handshake for every request.
+    Settings are read from HN_FETCHER and can be overridden per instance.
+
+    Methods
+    -------
+    query(url: str)
+        Query an endpoint within the concurrency window
+    get_item(item_id: int)
+        Get the details of a single item
+    get_items(item_ids: Iterable[int])
+        Get the details of many items concurrently
+    get_max_item_id()
+        Get the id of the most recent item
+    get_user(user_id: str)
+        Get the profile of a user
+    get_updates()
+        Get the recently changed items and profiles
+    close()
+        Close the session and its pooled connections
+    """
 
-async def get_latest_story() -> Tuple:
-    """ Get the most recent news item 
+    DEFAULTS = {
+        'CONCURRENCY': 50,          # Requests in flight at once
+        'LIMIT': 100,               # Pooled connections in total
+        'LIMIT_PER_HOST': 50,       # Pooled connections to the API host
+        'KEEPALIVE_TIMEOUT': 60,    # Seconds an idle connection is kept
+        'DNS_CACHE_TTL': 300,       # Seconds a resolved address is cached
+        'TIMEOUT': 30,              # Seconds allowed for a single request
+    }
+
+    def __init__(self, **options) -> None:
+        config = {**self.DEFAULTS, **getattr(settings, 'HN_FETCHER', {})}
+        config.update({key.upper(): value for key, value in options.items()})
+
+        self.config = config
+        self.__session = None
+        self.__semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """ The shared session, created on first use inside the running
+        event loop """
+        if self.__session is None or self.__session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.config['LIMIT'],
+                limit_per_host=self.config['LIMIT_PER_HOST'],
+                keepalive_timeout=self.config['KEEPALIVE_TIMEOUT'],
+                ttl_dns_cache=self.config['DNS_CACHE_TTL'],
+                use_dns_cache=True)
+            self.__session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.config['TIMEOUT']))
+            self.__semaphore = asyncio.Semaphore(self.config['CONCURRENCY'])
+
+        return self.__session
+
+    async def close(self):
+        if self.__session is not None and not self.__session.closed:
+            await self.__session.close()
+        self.__session = None
+
+    async def query(self, url: str, failed=None):
+        """ Query an endpoint once a slot in the concurrency window is free.
+        Network errors and timeouts are logged and give `failed`, like an
+        unsuccessful response.
+
+        Returns
+        -------
+        Any
+            The json-parsed response data
+        """
+        session = self.session
+
+        async with self.__semaphore:
+            try:
+                return await query_endpoint(session, url, failed)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                file_logger.error(f"{url} - {error!r}")
+                return failed
+
+    async def get_item(self, item_id: int, failed=None):
+        return await self.query(f"{baseUrl}/item/{item_id}.json", failed)
+
+    async def get_items(self, item_ids, failed=None) -> list:
+        """ Get many items concurrently, bounded by the concurrency window
+
+        Parameters
+        ----------
+        item_ids : Iterable[int]
+            The ids of the items to fetch
+        failed : Any
+            What a failed request gives, e.g. FETCH_FAILED to tell it
+            apart from an item that is null
+
+        Returns
+        -------
+        list
+            The json-parsed items, in the same order as item_ids. Failed
+            requests are `failed`, None by default.
+        """
+        return await asyncio.gather(
+            *(self.get_item(item_id, failed) for item_id in item_ids))
+
+    async def get_max_item_id(self):
+        return await self.query(f"{baseUrl}/maxitem.json")
+
+    async def get_user(self, user_id: str):
+        return await self.query(f"{baseUrl}/user/{user_id}.json")
+
+    async def get_updates(self):
+        return await self.query(f"{baseUrl}/updates.json")
+
+
+async def get_latest_story(fetcher: HNFetcher = None) -> Tuple:
+    """ Get the most recent news item
 
     Returns
     -------
     item : dict
         The result which is a dictionary converted from a json object.
     """
-    url = f"{baseUrl}/maxitem.json"
+    if fetcher is None:
+        async with HNFetcher() as fetcher:
+            return await get_latest_story(fetcher)
 
-    async with aiohttp.ClientSession() as session:
-        response = await query_endpoint(session, url)
+    item = None
+    response = await fetcher.get_max_item_id()
 
-        if response:
-            item = await get_item_details(session, response)
+    if response:
+        item = await fetcher.get_item(response)
 
     return item
 
 
-async def get_all_latest_stories() -> Tuple:
+FEEDS = ('topstories',      # Get the top stories.
+         'askstories',      # Get the latest Ask HN Stories.
+         'showstories',     # Get the latest Show HN Stories.
+         'jobstories',      # Get the latest Job Stories.
+         )
+
+
+async def get_feed_ids(fetcher: HNFetcher) -> dict:
+    """ Get the ordered ids of every feed concurrently
+
+    Returns
+    -------
+    {feed: [int]}
+        The ids listed by each feed, in the feed's order. A feed whose
+        request failed has no ids.
+    """
+    id_lists = await asyncio.gather(
+        *(fetcher.query(f"{baseUrl}/{feed}.json") for feed in FEEDS))
+
+    return {feed: ids or [] for feed, ids in zip(FEEDS, id_lists)}
+
+
+async def get_all_latest_stories(fetcher: HNFetcher = None) -> dict:
     """ Get the latest HN Stories. Use the different endpoints to get the
     news items' ids. After that, get the items full objects using another
     helper coroutine.
 
     Returns
     -------
-    ids_list : Tuple
-        The result containing a list of ids representing the show stories    
+    {feed: [dict]}
+        The items of every feed, in the feed's order
     """
-    file_logger.info("*" * 30 + "Get all latest stories" + "*" * 30)
-    urls = (f"{baseUrl}/topstories.json",       # Get the top stories.
-            # Get the latest Ask HN Stories.
-            f"{baseUrl}/askstories.json",
-            # Get the latest Show HN Stories.
-            f"{baseUrl}/showstories.json",
-            f"{baseUrl}/jobstories.json",       # Get the latest Job Stories.
-            )
-    tasks = []
+    if fetcher is None:
+        async with HNFetcher() as fetcher:
+            return await get_all_latest_stories(fetcher)
 
-    async with aiohttp.ClientSession() as session:
-        for url in urls:
-            tasks.append(asyncio.ensure_future(query_endpoint(session, url)))
+    file_logger.info("*" * 30 + "Get all latest stories" + "*" * 30)
 
-        # Proceed to get every single news item
-        id_list = await asyncio.gather(*tasks)
+    feed_ids = await get_feed_ids(fetcher)
 
-        all_news_items = await get_items_by_id(session, id_list)
+    # Proceed to get every single news item
+    all_news_items = await get_items_by_id(fetcher, feed_ids)
 
     return all_news_items
 
 
-async def get_items_by_id(session: aiohttp.ClientSession, news_sources: list):
-    """ Get the item using its unique id, an integer value.
-    The item can be a Story, Comment, Job, Ask HNs or Poll. The function creates
-    Futures from the list and gathers their results after asynchronous execution.
+async def get_items_by_id(fetcher: HNFetcher, news_sources: dict) -> dict:
+    """ Get the items of several feeds using their unique ids.
+    The item can be a Story, Comment, Job, Ask HNs or Poll. Ids listed by
+    more than one feed, e.g. a Show HN on the front page, are fetched only
+    once: the union of all ids goes through the fetcher in one concurrent
+    pipeline and the results are then regrouped per feed.
 
     Parameters
     ----------
-    session : aiohttp.ClientSession
-        The client session object to use http requests
+    fetcher : HNFetcher
+        The fetcher whose pooled session is used for the http requests
 
-    news_sources : Tuple
-        The list of lists of ids of news items to fetch.
+    news_sources : {feed: [int]}
+        The ids of news items to fetch, per feed.
 
     Returns
     -------
-    news_items : Any item
-        The responses from the server after executing the created futures.
+    news_items : {feed: [dict]}
+        The items of every feed, in the order of its ids. Items that
+        could not be fetched are left out.
     """
 
-    tasks = [[]] * len(news_sources)
-    news_items = [[]] * len(news_sources)
-
     file_logger.info("*" * 30 + "Get items by id" + "*" * 30)
 
-    for idx, news_source in enumerate(news_sources):
-        for item_id in news_source:
-            url = f"{baseUrl}/item/{item_id}.json"
-            tasks[idx].append(asyncio.ensure_future(
-                query_endpoint(session=session, url=url)))
+    unique_ids = list(dict.fromkeys(
+        item_id for ids in news_sources.values() for item_id in ids))
+    items = dict(zip(unique_ids, await fetcher.get_items(unique_ids)))
 
-        news_items[idx] = await asyncio.gather(*tasks[idx])
+    file_logger.info(
+        f"Fetched {len(unique_ids)} unique items for "
+        f"{sum(len(ids) for ids in news_sources.values())} feed entries")
 
-    return news_items
+    return {feed: [items[item_id] for item_id in ids if items[item_id]]
+            for feed, ids in news_sources.items()}
 
 
 async def get_item_details(session: aiohttp.ClientSession, item):
@@ -109,7 +256,7 @@ async def get_item_details(session: aiohttp.ClientSession, item):
     return response
 
 
-async def query_endpoint(session: aiohttp.ClientSession, url: str):
+async def query_endpoint(session: aiohttp.ClientSession, url: str, failed=None):
     """ Try to get a news_item from an API endpoint, url. This operation
     is asynchronous, to take advantage of concurrency.
 
@@ -119,6 +266,8 @@ async def query_endpoint(session: aiohttp.ClientSession, url: str):
         The session object is used to query the endpoint.
     url : str
         This parameter holds the endpoint to be queried.
+    failed : Any
+        Returned for an unsuccessful response
 
     Returns
     -------
@@ -132,7 +281,7 @@ async def query_endpoint(session: aiohttp.ClientSession, url: str):
             return await response.json()
         else:
             file_logger.error(f"{url} - {response.status}")
-            return None
+            return failed
 
 
 # if __name__ == '__main__':
@@ -0,0 +1,106 @@
+# Breadth-first backfill of the comment threads under stories and polls
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+# Initialize logging
+import logging
+file_logger = logging.getLogger(__name__)
+
+from .api_service import HNFetcher
+from .db_service import DBchecker, DBWriter
+
+
+class ThreadCrawler():
+    """
+    Walks the kids (and the parts of polls) of a set of items level by
+    level. Every level is fetched concurrently with the bounded fetcher
+    and written as one batch before the next level starts, so replies
+    always find their parent stored. A thread therefore takes one round
+    trip per level of depth rather than one per comment.
+    Comments already stored are not fetched again, the crawl continues
+    with the kids stored for them.
+
+    Methods
+    -------
+    crawl(root_ids: Iterable[int], fetcher: HNFetcher)
+        Fetch the root items, then crawl their threads
+    crawl_from(roots: Iterable[dict], fetcher: HNFetcher)
+        Crawl the threads of items that were already fetched and written
+    """
+
+    def __init__(self, writer: DBWriter = None, checker: DBchecker = None,
+                 max_depth: int = None, max_items: int = None) -> None:
+        self.writer = writer or DBWriter()
+        self.checker = checker or DBchecker()
+        self.max_depth = max_depth or getattr(settings, 'HN_CRAWL_MAX_DEPTH', 10)
+        self.max_items = max_items or getattr(settings, 'HN_CRAWL_MAX_ITEMS', 5000)
+
+    async def crawl(self, root_ids, fetcher: HNFetcher) -> dict:
+        """ Fetch and write the root items, then crawl their threads
+
+        Returns
+        -------
+        {'levels': int, 'fetched': int}
+            How deep the crawl went and how many items it fetched
+        """
+        roots = [item for item in await fetcher.get_items(root_ids) if item]
+        await sync_to_async(self.writer.write_items_to_db)(roots)
+
+        stats = await self.crawl_from(roots, fetcher)
+        stats['fetched'] += len(roots)
+
+        return stats
+
+    async def crawl_from(self, roots, fetcher: HNFetcher) -> dict:
+        """ Crawl the threads below the given items, at most max_depth
+        levels deep and max_items items in total
+
+        Parameters
+        ----------
+        roots : Iterable[dict]
+            The stories and polls as returned by the API
+        fetcher : HNFetcher
+            The fetcher to query the API with
+
+        Returns
+        -------
+        {'levels': int, 'fetched': int}
+            How deep the crawl went and how many items it fetched
+        """
+        stats = {'levels': 0, 'fetched': 0}
+        level_ids = self.__children(roots)
+        seen = set(level_ids)
+
+        while level_ids and stats['levels'] < self.max_depth:
+            stored_kids = await sync_to_async(self.checker.get_stored_kids)(level_ids)
+            missing = [item_id for item_id in level_ids if item_id not in stored_kids]
+
+            budget = self.max_items - stats['fetched']
+            if len(missing) > budget:
+                file_logger.warning(
+                    f"Crawl budget of {self.max_items} items reached, "
+                    f"leaving {len(missing) - budget} items of level {stats['levels'] + 1}")
+                missing = missing[:budget]
+
+            items = [item for item in await fetcher.get_items(missing) if item]
+            await sync_to_async(self.writer.write_items_to_db)(items)
+            stats['fetched'] += len(items)
+            stats['levels'] += 1
+
+            next_ids = self.__children(items)
+            for kids in stored_kids.values():
+                next_ids.extend(kids)
+
+            level_ids = [item_id for item_id in next_ids if item_id not in seen]
+            seen.update(level_ids)
+
+            if stats['fetched'] >= self.max_items:
+                break
+
+        file_logger.info(f"Crawled {stats['fetched']} items in {stats['levels']} levels")
+
+        return stats
+
+    def __children(self, items) -> list:
+        return [child_id for item in items
+                for child_id in (item.get("kids") or []) + (item.get("parts") or [])]
@@ -1,14 +1,60 @@
-from django.core.exceptions import FieldDoesNotExist
-from django.db import models, IntegrityError, DatabaseError
-from news.models import Comment, Job, Poll, PollOption, Story
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction, DatabaseError, IntegrityError
+from news.models import (
+    Base, Comment, FeedEntry, FeedRank, ItemEdge, Job, Poll, PollOption, Story, User
+)
+
+from collections import Counter, defaultdict, deque
+from news.cache import PageCache
+from news.lookups import BATCH_SIZE, chunks, filter_in
+from news.search import SearchIndex
+from news.snippets import make_excerpt, make_snippet
+from .models import OrphanComment, SyncState
 
 import functools
+import json
+import time
 
 # Initialize logging
 import logging
 file_logger = logging.getLogger(__name__)
 
 
+# API keys that are stored under another name, e.g. the "poll" of a poll
+# option is its parent
+ITEM_KEY_ALIASES = {
+    PollOption: {'poll'},
+}
+
+
+def build_item_schema(item_model: models.Model) -> frozenset:
+    """ Collect the keys an API item may have to fit the model: the
+    names of its fields and the aliases of renamed keys
+
+    Returns
+    -------
+    frozenset
+        The accepted keys
+    """
+    names = {field.name for field in item_model._meta.get_fields()
+             if field.concrete or not field.auto_created}
+
+    return frozenset(names | ITEM_KEY_ALIASES.get(item_model, set()))
+
+
+# Built once, validating an item is then a set difference
+ITEM_SCHEMAS = {item_model: build_item_schema(item_model)
+                for item_model in (Comment, Job, Poll, PollOption, Story)}
+
+
+def mark_items_changed():
+    """ Advance the version of the stored items, e.g. for the API's
+    ETags. It is the generation of the cached searches and pages too, so
+    they are dropped as the current transaction commits. """
+    SyncState.advance(SyncState.ITEMS)
+
+
 class DBchecker():
     """
     Used by the HN Service to check if the tables are populated
@@ -17,6 +63,9 @@ class DBchecker():
     -------
     is_tables_populated()
         Checks each model (Story, Job, Poll, Comment) for any recoreds.
+
+    get_stored_kids(item_ids: Iterable[int])
+        Looks up which of the comments are stored, and their kids
     """
 
     def is_tables_populated(self):
@@ -41,6 +90,25 @@ class DBchecker():
         return functools.reduce(
             lambda prop1, prop2: prop1 or prop2, db_states.values())
 
+    def get_stored_kids(self, item_ids) -> dict:
+        """ Look up which of the comments are already stored, with one
+        query per chunk of ids
+
+        Returns
+        -------
+        {int: [int]}
+            The ids of the kids of every stored comment
+        """
+        stored_kids = {}
+
+        for stored in filter_in(Comment.objects, 'id', item_ids):
+            stored_kids.update({item_id: [] for item_id in stored.values_list('id', flat=True)})
+
+        for stored_ids in chunks(stored_kids):
+            stored_kids.update(ItemEdge.children_of(stored_ids, Base.COMMENT))
+
+        return stored_kids
+
 
 class DBWriter():
     """
@@ -49,91 +117,608 @@ class DBWriter():
 
     Methods
     -------
+    write_items_to_db(news_items: Iterable[dict])
+        Group a batch of items by type and upsert every group with a
+    bulk insert of the new rows and a bulk update of the existing ones,
+    all in one transaction
+
     write_item_to_db(news_item: dict)
-        Check the type of item: job, story, comment, poll, pollopt
-    and delegate to the relevant function, which writes to the 
-    proper database table
-
-    __create_entry(news_item: dict, dataset: model.QuerySet)
-        Commits the contents of the new_item dictionary object to
-    its appropriate table. We have Job, Story, Comment, Poll & 
-    Poll Option models. 
-    Example: __create_entry(news_item, self.__job) writes the news_item to
-    the Job table
+        Upsert a single item, a batch of one
+
+    write_profiles_to_db(profiles: Iterable[dict])
+        Upsert full user profiles over their stubs
+
+    delete_items(news_items: Iterable[dict])
+        Mark stored items as deleted and blank their content
+
+    write_feed_ranks(feed_ids: dict)
+        Snapshot the order of the feeds and prune the expired snapshots
+
+    drop_orphans(item_ids: Iterable[int])
+        Stop waiting for the parent of deferred comments
+
+    pop_new_users()
+        Hand over the usernames stubbed since the last call, whose full
+    profiles still have to be fetched
+
+    Attributes
+    ----------
+    projection : bool
+        Whether keys the model has no field for are dropped from an item
+    (and counted in dropped_keys) or the whole item is rejected
+    dropped_keys : Counter
+        How often each (type, key) pair was dropped or caused a rejection
+    new_users : set
+        Usernames inserted as stubs since pop_new_users() was last called
+    source : str
+        The source of the items written. Stored items of another source
+    are never overwritten, so the HN sync cannot touch local items.
     """
 
-    def __init__(self) -> None:
-        self.__comment = Comment.objects.all()
-        self.__job = Job.objects.all()
-        self.__poll = Poll.objects.all()
-        self.__poll_options = PollOption.objects.all()
-        self.__story = Story.objects.all()
+    ITEM_MODELS = {
+        Base.COMMENT: Comment,
+        Base.JOB: Job,
+        Base.POLL: Poll,
+        Base.POLLOPT: PollOption,
+        Base.STORY: Story,
+    }
+
+    # Fields HackNews changes after an item was published, and the ones
+    # derived from them
+    MUTABLE_FIELDS = ('score', 'descendants', 'kids', 'title', 'text',
+                      'snippet', 'excerpt', 'dead')
+
+    # Content blanked when an item is deleted
+    DELETED_FIELDS = ('title', 'text', 'url', 'snippet', 'excerpt')
+
+    # Id lists of an item and the type of the children they refer to
+    CHILD_LISTS = (('kids', Base.COMMENT), ('parts', Base.POLLOPT))
+
+    # Item types a comment can reply to
+    PARENT_MODELS = (Story, Poll, Comment)
+
+    # Profile fields of a User
+    USER_FIELDS = ('delay', 'created', 'karma', 'about', 'submitted')
+
+    def __init__(self, projection: bool = None, source: str = Base.HN) -> None:
+        if projection is None:
+            projection = getattr(settings, 'HN_DB_WRITER_PROJECTION', True)
+
+        self.projection = projection
+        self.source = source
+        self.dropped_keys = Counter()
+        self.new_users = set()
+        self.orphan_limit = getattr(settings, 'HN_ORPHAN_LIMIT', 10000)
+        self.__content_types = {}
+        self.search_index = SearchIndex()
+
+    def write_items_to_db(self, news_items, raise_errors: bool = False) -> dict:
+        """ Upsert a batch of items. Items are grouped by type, the ids
+        already stored are looked up once per group, new rows are inserted
+        with bulk_create() and existing ones get their mutable fields
+        refreshed with bulk_update(). The whole batch is one transaction.
+
+        Parameters
+        ----------
+        news_items : Iterable[dict]
+            The items as returned by the API
+        raise_errors : bool
+            Raise the DatabaseError of a batch that could not be written,
+            instead of counting its items as skipped
+
+        Returns
+        -------
+        {'created': int, 'updated': int, 'skipped': int, 'deferred': int}
+            How many items were inserted, updated, could not be written or
+            are comments waiting for their parent
+        """
+        stats = {'created': 0, 'updated': 0, 'skipped': 0, 'deferred': 0}
+        rows = {item_model: {} for item_model in self.ITEM_MODELS.values()}
+
+        for news_item in news_items:
+            item_model = self.ITEM_MODELS.get(news_item.get("type"))
+            fields = None
+
+            if item_model is not None:
+                news_item = self.__project(item_model, news_item)
+
+            if item_model is not None and news_item is not None:
+                fields = self.__to_fields(item_model, news_item)
+
+            if fields is None:
+                stats['skipped'] += 1
+                continue
+
+            # A later copy of the same item in the batch wins
+            rows[item_model][fields['id']] = fields
+
+        orphans, retried = self.__link_comments(rows)
+        stats['deferred'] = len(orphans)
+
+        authors = {fields['by_id'] for fields_by_id in rows.values()
+                   for fields in fields_by_id.values()}
+
+        try:
+            with transaction.atomic():
+                new_users = self.__resolve_users(authors)
+
+                for item_model, fields_by_id in rows.items():
+                    if fields_by_id:
+                        created, updated, protected = self.__upsert(item_model, fields_by_id)
+                        stats['created'] += created
+                        stats['updated'] += updated
+                        stats['skipped'] += protected
+
+                self.__write_edges(rows)
+                self.__write_feed(rows)
+                self.search_index.update(
+                    (item_id, fields['type'], fields.get('title'), fields.get('text'))
+                    for fields_by_id in rows.values()
+                    for item_id, fields in fields_by_id.items())
+                self.__save_orphans(orphans, retried)
+
+                # An empty batch, e.g. a poll of the updates without
+                # changes, keeps the ETags and the cached pages
+                if stats['created'] or stats['updated']:
+                    mark_items_changed()
+
+        except DatabaseError as db_error:
+            file_logger.exception(f"Could not write the batch:\n\t{db_error}")
+            if raise_errors:
+                raise
+            stats['skipped'] += stats['created'] + stats['updated']
+            stats['created'] = stats['updated'] = 0
+            new_users = set()
+
+        self.new_users |= new_users
+
+        file_logger.info(f"Wrote a batch of items: {stats}")
+        if self.dropped_keys:
+            file_logger.debug(f"Unknown keys so far: {dict(self.dropped_keys)}")
+
+        return stats
 
     def write_item_to_db(self, news_item: dict):
         """ Check the type of item: job, story, comment, poll, pollopt
-        and delegate to the relevant function, which writes to the 
-        proper database table
+        and write it to the proper database table
 
         Parameters
         ----------
         news_item : dict
             The record to write to the database table
         """
+        return self.write_items_to_db([news_item])
 
-        if news_item["type"] == 'job' and self.__has_same_structure(Job, news_item):
-            self.__create_entry(news_item, self.__job)
+    def write_profiles_to_db(self, profiles) -> int:
+        """ Replace user stubs with the full profiles from the API
 
-        elif news_item["type"] == 'comment' and self.__has_same_structure(Comment, news_item):
-            self.__create_entry(news_item, self.__comment)
+        Parameters
+        ----------
+        profiles : Iterable[dict]
+            The users as returned by the /user endpoint
 
-        elif news_item["type"] == 'poll' and self.__has_same_structure(Poll, news_item):
-            self.__create_entry(news_item, self.__poll)
+        Returns
+        -------
+        int
+            The number of profiles written
+        """
+        users = {}
+        for profile in profiles:
+            fields = {key: profile[key] for key in self.USER_FIELDS if key in profile}
+            if isinstance(fields.get('submitted'), list):
+                fields['submitted'] = json.dumps(fields['submitted'])
+            users[profile['id']] = User(
+                id=profile['id'], **{'created': 0, 'karma': 0, **fields})
 
-        elif news_item["type"] == 'pollopt' and self.__has_same_structure(PollOption, news_item):
-            self.__create_entry(news_item, self.__poll_options)
+        with transaction.atomic():
+            existing = self.__existing_ids(User, list(users))
+            User.objects.bulk_create(
+                [user for user_id, user in users.items() if user_id not in existing],
+                batch_size=BATCH_SIZE, ignore_conflicts=True)
+            User.objects.bulk_update(
+                [user for user_id, user in users.items() if user_id in existing],
+                self.USER_FIELDS,
+                batch_size=BATCH_SIZE)
 
-        elif news_item["type"] == 'story' and self.__has_same_structure(Story, news_item):
-            self.__create_entry(news_item, self.__story)
+        return len(users)
 
-    def __create_entry(self, news_item: dict, dataset: models.QuerySet):
-        """ Tries to insert an entry into its relevant model. Uses 
-        get_or_create() to check if it already exists or not. IntegrityError
-        or DatabaseError are captured and handled in an edge-case
+    def delete_items(self, news_items) -> int:
+        """ Apply the deletions HackNews reports: deleted items come
+        without an author or content, so instead of being upserted the
+        stored rows get `deleted` set and their content blanked, with one
+        UPDATE per type. Replies stay in their thread, the items leave the
+        feed and the search index.
 
         Parameters
         ----------
-        news_item : dict
-            The dictionary object containing the entry to search or create
-        dataset : models.QuerySet
-            This QuerySet provides the lookup method get_or_create().
+        news_items : Iterable[dict]
+            The deleted items as returned by the API
+
+        Returns
+        -------
+        int
+            The number of stored items deleted
         """
+        ids_by_model = defaultdict(list)
+        for news_item in news_items:
+            item_model = self.ITEM_MODELS.get(news_item.get("type"))
+            if item_model is not None:
+                ids_by_model[item_model].append(news_item["id"])
 
-        try:
-            dataset.get_or_create(**news_item)
+        deleted = []
+        with transaction.atomic():
+            for item_model, ids in ids_by_model.items():
+                blanked = {field: '' for field in self.DELETED_FIELDS
+                           if field in ITEM_SCHEMAS[item_model]}
+                # Items of another source or deleted already are left as
+                # they are
+                stored = item_model.objects.filter(source=self.source, deleted=False)
+                for chunk in filter_in(stored, 'pk', ids):
+                    batch = list(chunk.values_list('pk', flat=True))
+                    if batch:
+                        item_model.objects.filter(pk__in=batch).update(
+                            deleted=True, **blanked)
+                        deleted.extend(batch)
+
+            if deleted:
+                for entries in filter_in(FeedEntry.objects, 'pk', deleted):
+                    entries.delete()
+                self.search_index.remove(deleted)
+                mark_items_changed()
+
+        file_logger.info(f"Deleted {len(deleted)} items")
+
+        return len(deleted)
+
+    def write_feed_ranks(self, feed_ids: dict, taken_at: int = None) -> int:
+        """ Store the order of every feed as a snapshot, with one bulk
+        insert for all feeds, and drop the snapshots of these feeds older
+        than HN_FEED_RANK_RETENTION seconds. Feeds without ids, e.g.
+        whose request failed, keep their last snapshot.
+
+        Parameters
+        ----------
+        feed_ids : {feed: [int]}
+            The ids listed by each feed, in the feed's order
+        taken_at : int
+            The Unix time of the snapshot, now by default
 
+        Returns
+        -------
+        int
+            The number of ranks stored
+        """
+        taken_at = taken_at or int(time.time())
+        retention = getattr(settings, 'HN_FEED_RANK_RETENTION', 86400)
+
+        ranks = [FeedRank(feed=feed, taken_at=taken_at, rank=rank, item_id=item_id)
+                 for feed, ids in feed_ids.items()
+                 for rank, item_id in enumerate(ids, 1)]
+        feeds = {rank.feed for rank in ranks}
+
+        with transaction.atomic():
+            FeedRank.objects.bulk_create(ranks, batch_size=BATCH_SIZE)
+            FeedRank.objects.filter(
+                feed__in=feeds, taken_at__lt=taken_at - retention).delete()
+
+            # The ranked pages change with every snapshot
+            PageCache().invalidate()
+
+        return len(ranks)
+
+    def pop_new_users(self) -> set:
+        new_users, self.new_users = self.new_users, set()
+        return new_users
+
+    def drop_orphans(self, item_ids) -> set:
+        """ Forget deferred comments, e.g. ones whose parent will never
+        arrive
+
+        Returns
+        -------
+        set
+            The ids that were waiting for their parent
+        """
+        item_ids = list(item_ids)
+        dropped = self.__existing_ids(OrphanComment, item_ids)
+        self.__delete_orphans(list(dropped))
+
+        return dropped
+
+    def __link_comments(self, rows: dict):
+        """ Link the batch's comments to their parents. The type of every
+        parent is taken from the batch itself or found with one id__in
+        query per parent model, so a whole thread is linked in a few
+        queries. Comments whose parent is unknown are taken out of the
+        batch, stored as OrphanComment and retried with the batch that
+        writes their parent.
+
+        Parameters
+        ----------
+        rows : {model: {int: dict}}
+            The batch's model fields by id, per model. Linked comments get
+            their content type, orphans are removed.
+
+        Returns
+        -------
+        ({int: dict}, set)
+            The comments deferred, and the ids of the stored orphans
+            retried with the batch
+        """
+        comments = rows[Comment]
+
+        # Retry the stored orphans replying to an item of the batch, and
+        # the replies waiting for those in turn
+        retried = set()
+        written = [item_id for parent_model in self.PARENT_MODELS
+                   for item_id in rows[parent_model]]
+        while written:
+            waiting = self.__waiting_for(written)
+            retried |= waiting.keys()
+            written = [comment_id for comment_id in waiting if comment_id not in comments]
+            for comment_id in written:
+                comments[comment_id] = waiting[comment_id]
+        orphans = {}
+
+        unresolved = {fields['object_id'] for fields in comments.values()}
+        parent_types = {}
+        for parent_model in self.PARENT_MODELS:
+            found = unresolved & rows[parent_model].keys() - comments.keys()
+            found |= self.__existing_ids(parent_model, list(unresolved - found))
+            parent_types.update(dict.fromkeys(found, parent_model))
+            unresolved -= found
+
+        # Replies to comments of this batch are linked once their parent is
+        replies = defaultdict(list)
+        for comment_id, fields in comments.items():
+            replies[fields['object_id']].append(comment_id)
+
+        linked = deque(parent_types)
+        while linked:
+            parent_id = linked.popleft()
+            for comment_id in replies.pop(parent_id, []):
+                comments[comment_id]['content_type_id'] = self.__content_type_id(
+                    parent_types[parent_id])
+                parent_types[comment_id] = Comment
+                linked.append(comment_id)
+
+        for comment_ids in replies.values():
+            for comment_id in comment_ids:
+                orphans[comment_id] = comments.pop(comment_id)
+
+        return orphans, retried
+
+    def __waiting_for(self, parent_ids: list) -> dict:
+        """ The stored orphans of this writer's source replying to any of
+        the parents, found through the index on their parent id """
+        waiting = {}
+        stored = OrphanComment.objects.filter(source=self.source)
+        for orphans in filter_in(stored, 'parent', parent_ids):
+            waiting.update(
+                (comment_id, json.loads(fields))
+                for comment_id, fields in orphans.values_list('id', 'fields'))
+
+        return waiting
+
+    def __save_orphans(self, orphans: dict, retried: set):
+        """ Within the batch's transaction, forget the retried orphans that
+        were linked, store the batch's orphans and drop the oldest ones
+        beyond orphan_limit """
+        self.__delete_orphans(list(retried | orphans.keys()))
+        if not orphans:
+            return
+
+        OrphanComment.objects.bulk_create(
+            [OrphanComment(id=comment_id, parent=fields['object_id'],
+                           source=self.source, fields=json.dumps(fields))
+             for comment_id, fields in orphans.items()],
+            batch_size=BATCH_SIZE)
+
+        stored = OrphanComment.objects.filter(source=self.source)
+        excess = stored.count() - self.orphan_limit
+        if excess > 0:
+            dropped = list(stored.order_by('updated', 'id').values_list(
+                'id', flat=True)[:excess])
+            self.__delete_orphans(dropped)
+            for comment_id in dropped:
+                file_logger.warning(f"Dropping comment {comment_id}, its parent never arrived")
+
+    def __delete_orphans(self, comment_ids: list):
+        for orphans in filter_in(OrphanComment.objects, 'pk', comment_ids):
+            orphans.delete()
+
+    def __write_edges(self, rows: dict):
+        """ Replace the adjacency rows of the written items with their
+        current kids and parts, one delete and one insert per chunk """
+        edges = []
+        for fields_by_id in rows.values():
+            for item_id, fields in fields_by_id.items():
+                for key, child_type in self.CHILD_LISTS:
+                    edges.extend(
+                        ItemEdge(parent_id=item_id, child_id=child_id,
+                                 position=position, child_type=child_type)
+                        for position, child_id in enumerate(json.loads(fields.get(key) or '[]')))
+
+        parent_ids = [item_id for fields_by_id in rows.values() for item_id in fields_by_id]
+        for stale in filter_in(ItemEdge.objects, 'parent_id', parent_ids):
+            stale.delete()
+
+        ItemEdge.objects.bulk_create(
+            edges, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    def __write_feed(self, rows: dict):
+        """ Upsert the feed entries of the written items """
+        entries = {}
+        for fields_by_id in rows.values():
+            for item_id, fields in fields_by_id.items():
+                entries[item_id] = {
+                    'id': item_id,
+                    'type': fields['type'],
+                    'by': fields['by_id'],
+                    'time': fields.get('time'),
+                    'score': fields.get('score'),
+                    'title': fields.get('title') or '',
+                    'snippet': fields['snippet'],
+                    'excerpt': fields['excerpt'],
+                }
+
+        self.__upsert(FeedEntry, entries, ['score', 'title', 'snippet', 'excerpt'])
+
+    def __content_type_id(self, model: models.Model) -> int:
+        if model not in self.__content_types:
+            self.__content_types[model] = ContentType.objects.get_for_model(model).id
+
+        return self.__content_types[model]
+
+    def __resolve_users(self, usernames: set) -> set:
+        """ Make sure every author has a User row: the existing ones are
+        looked up with one id__in query per chunk and the missing ones are
+        bulk-inserted as stubs, to be completed from their profiles later
+
+        Returns
+        -------
+        set
+            The usernames inserted as stubs
+        """
+        missing = set(usernames) - self.__existing_ids(User, list(usernames))
+
+        User.objects.bulk_create(
+            [User(id=username, created=0, karma=0) for username in missing],
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+        return missing
+
+    def __existing_ids(self, model: models.Model, ids: list) -> set:
+        """ Look up which of the ids are stored, in chunks of BATCH_SIZE """
+        existing = set()
+        for stored in filter_in(model.objects, 'pk', ids):
+            existing.update(stored.values_list('pk', flat=True))
+
+        return existing
+
+    def __stored_sources(self, item_model: models.Model, ids: list) -> dict:
+        """ Look up the source of the stored items, in chunks of BATCH_SIZE """
+        sources = {}
+        for stored in filter_in(item_model.objects, 'pk', ids):
+            sources.update(stored.values_list('pk', 'source'))
+
+        return sources
+
+    def __upsert(self, item_model: models.Model, fields_by_id: dict,
+                 update_fields: list = None):
+        """ Insert the new rows of one model and update the stored ones.
+        Items get their mutable fields updated, unless update_fields
+        names others. Stored items of another source are left as they
+        are and removed from fields_by_id.
+
+        Returns
+        -------
+        (int, int, int)
+            The number of created, updated and protected rows
+        """
+        protected = 0
+
+        if item_model in ITEM_SCHEMAS:
+            sources = self.__stored_sources(item_model, list(fields_by_id))
+            for item_id, source in sources.items():
+                if source != self.source:
+                    del fields_by_id[item_id]
+                    protected += 1
+            existing = set(sources)
+        else:
+            existing = self.__existing_ids(item_model, list(fields_by_id))
+
+        new_rows = [item_model(**fields) for item_id, fields in fields_by_id.items()
+                    if item_id not in existing]
+        stored_rows = [item_model(**fields) for item_id, fields in fields_by_id.items()
+                       if item_id in existing]
+
+        # Without ignore_conflicts every new row is really inserted, so the
+        # created count holds. Should another writer have stored some of
+        # them since the lookup, the rows are sorted again and those get
+        # updated instead of silently skipped.
+        try:
+            with transaction.atomic():
+                item_model.objects.bulk_create(new_rows, batch_size=BATCH_SIZE)
         except IntegrityError:
-            file_logger.exception(
-                f"Could not create entry {news_item.id}. Entry already exists")
+            if not self.__existing_ids(item_model, [row.pk for row in new_rows]):
+                raise
+            created, updated, raced = self.__upsert(item_model, fields_by_id, update_fields)
+            return created, updated, protected + raced
 
-        except DatabaseError as db_error:
-            file_logger.exception(f"Other error:\n\t{db_error}")
+        if update_fields is None:
+            update_fields = [field for field in self.MUTABLE_FIELDS
+                             if field in ITEM_SCHEMAS[item_model]]
+        if stored_rows and update_fields:
+            item_model.objects.bulk_update(
+                stored_rows, update_fields, batch_size=BATCH_SIZE)
+
+        if protected:
+            file_logger.warning(
+                f"Kept {protected} {item_model._meta.verbose_name} rows that are not from {self.source}")
 
-    def __has_same_structure(self, item_model: models.Model, item_dict: dict):
-        """ Check if the dictionary objects keys are also in the 
-        model's fields' list
+        return len(new_rows), len(stored_rows), protected
+
+    def __to_fields(self, item_model: models.Model, news_item: dict):
+        """ Map an API item onto the model's columns: the author and the
+        poll of a poll option are foreign keys, id lists are stored as
+        text and the text's snippet and excerpt are rendered once here
+        rather than on every list page.
+
+        Returns
+        -------
+        dict
+            The keyword arguments of the model, or None if the item
+            cannot be stored
+        """
+        fields = dict(news_item)
+
+        if "by" not in fields:
+            file_logger.info(f"Skipping {fields['id']}, it has no author")
+            return None
+        fields["by_id"] = fields.pop("by")
+
+        for key in ("kids", "parts"):
+            if isinstance(fields.get(key), list):
+                fields[key] = json.dumps(fields[key])
+
+        fields["source"] = self.source
+        fields["snippet"] = make_snippet(fields.get("text"))
+        fields["excerpt"] = make_excerpt(fields.get("text"))
+
+        if item_model is PollOption:
+            fields["parent_id"] = fields.pop("poll", None)
+
+        if item_model is Comment:
+            # Linked to its Story, Poll or Comment by __link_comments()
+            fields["object_id"] = fields.pop("parent", None)
+            if fields["object_id"] is None:
+                file_logger.info(f"Skipping comment {fields['id']}, it has no parent")
+                return None
+
+        return fields
+
+    def __project(self, item_model: models.Model, item_dict: dict):
+        """ Check the dictionary object's keys against the model's
+        precomputed schema. In projection mode unknown keys are dropped,
+        otherwise the item is rejected.
 
         Return
         ------
-        bool
-            Whether both structures are compatible
+        dict
+            The item restricted to the model's keys, or None if rejected
         """
+        schema = ITEM_SCHEMAS[item_model]
+        unknown = item_dict.keys() - schema
+
+        if not unknown:
+            return item_dict
+
+        self.dropped_keys.update((item_dict["type"], key) for key in unknown)
 
-        for key in item_dict:
-            try:
-                item_model._meta.get_field(key)
-            except FieldDoesNotExist:
-                file_logger.exception(
-                    f"{item_dict['id']}'s {key} is not a field in {item_model._meta.label}")
-                return False
+        if not self.projection:
+            file_logger.warning(
+                f"{item_dict['id']}'s {sorted(unknown)} are not fields in {item_model._meta.label}")
+            return None
 
-        return True
+        return {key: value for key, value in item_dict.items() if key in schema}
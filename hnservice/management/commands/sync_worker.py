@@ -0,0 +1,32 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hnservice.worker import SyncWorker, get_default_jobs
+
+
+class Command(BaseCommand):
+    help = "Keep the news tables in sync with HackNews until interrupted"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Run every job a single time and exit")
+        parser.add_argument(
+            '--jobs', nargs='+', metavar='JOB',
+            help="Only run these jobs: " + ', '.join(job.name for job in get_default_jobs()))
+
+    def handle(self, *args, **options):
+        jobs = get_default_jobs()
+        if options['jobs']:
+            unknown = set(options['jobs']) - {job.name for job in jobs}
+            if unknown:
+                raise CommandError(f"Unknown jobs: {', '.join(sorted(unknown))}")
+            jobs = [job for job in jobs if job.name in options['jobs']]
+
+        worker = SyncWorker(jobs=jobs)
+        asyncio.run(self.run(worker, options['once']))
+
+    async def run(self, worker: SyncWorker, once: bool):
+        worker.handle_signals()
+        await worker.run(once=once)
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hnservice', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncLease',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('holder', models.CharField(max_length=100)),
+                ('expires', models.DateTimeField()),
+            ],
+        ),
+    ]
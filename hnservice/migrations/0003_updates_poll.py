@@ -0,0 +1,21 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hnservice', '0002_sync_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpdatesPoll',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('ids', models.TextField(default='[]')),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
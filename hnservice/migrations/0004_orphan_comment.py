@@ -0,0 +1,23 @@
+# Generated by Django 3.2.8 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hnservice', '0003_updates_poll'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrphanComment',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('parent', models.PositiveIntegerField(db_index=True)),
+                ('source', models.CharField(db_index=True, max_length=5)),
+                ('fields', models.TextField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.8 on 2026-10-18 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hnservice', '0004_orphan_comment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreSample',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('score', models.IntegerField(default=0)),
+                ('time', models.PositiveIntegerField(db_index=True)),
+                ('velocity', models.FloatField(default=0)),
+            ],
+        ),
+    ]
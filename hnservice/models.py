@@ -1,3 +1,141 @@
-from django.db import models
+from datetime import timedelta
 
-# Create your models here.
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+
+class SyncState(models.Model):
+    """ Persists a named progress marker of the HN sync, e.g. the id of
+    the last item fetched from maxitem (the high-water mark), the
+    number of batches written so far (the version of the stored items) or
+    the number of ids handed out to items created through the API. The
+    item the sync is waiting for and how many runs it waited are kept too.
+    """
+
+    MAXITEM = 'maxitem'
+    ITEMS = 'items'
+    LOCAL_IDS = 'local_ids'
+    MISSING = 'missing'
+    MISSING_RUNS = 'missing_runs'
+
+    name = models.CharField(primary_key=True, max_length=50)
+    value = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.value}"
+
+    @staticmethod
+    def advance(name: str, step: int = 1) -> int:
+        """ Add steps to a marker with an UPDATE, which also locks its row
+        until the transaction ends
+
+        Returns
+        -------
+        int
+            The value of the marker after the steps
+        """
+        advanced = SyncState.objects.filter(name=name).update(
+            value=F('value') + step, updated=timezone.now())
+
+        if not advanced:
+            state, created = SyncState.objects.get_or_create(
+                name=name, defaults={'value': step})
+            if created:
+                return state.value
+            return SyncState.advance(name, step)
+
+        return SyncState.objects.values_list('value', flat=True).get(name=name)
+
+
+class SyncLease(models.Model):
+    """ A lock on a sync job shared by every process through the DB. The
+    holder owns the job until the lease expires and has to renew it
+    before then, so a crashed holder is replaced after one lease period
+    at most """
+
+    name = models.CharField(primary_key=True, max_length=50)
+    holder = models.CharField(max_length=100)
+    expires = models.DateTimeField()
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.holder} until {self.expires}"
+
+    @staticmethod
+    def acquire(name: str, holder: str, duration: float) -> bool:
+        """ Take or renew the lease, unless another holder's lease is still
+        running. The check and the write are one UPDATE, so two processes
+        can never both get the lease.
+
+        Returns
+        -------
+        bool
+            Whether the holder has the lease for the next duration seconds
+        """
+        now = timezone.now()
+        expires = now + timedelta(seconds=duration)
+
+        acquired = SyncLease.objects.filter(
+            Q(holder=holder) | Q(expires__lte=now), name=name,
+        ).update(holder=holder, expires=expires)
+
+        if not acquired:
+            try:
+                with transaction.atomic():
+                    SyncLease.objects.create(name=name, holder=holder, expires=expires)
+            except IntegrityError:
+                # The lease exists and is held by someone else
+                return False
+
+        return True
+
+    @staticmethod
+    def release(name: str, holder: str) -> bool:
+        """ Give the lease up early, if the holder still has it """
+        return bool(SyncLease.objects.filter(name=name, holder=holder).update(
+            expires=timezone.now()))
+
+
+class UpdatesPoll(models.Model):
+    """ The ids of items, or the usernames, listed by the last poll of
+    /updates.json, which the next poll is compared with """
+
+    ITEMS = 'items'
+    PROFILES = 'profiles'
+
+    name = models.CharField(primary_key=True, max_length=50)
+    ids = models.TextField(default='[]')
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.name} polled at {self.updated}"
+
+
+class OrphanComment(models.Model):
+    """ A comment whose parent is not stored yet, kept as the fields the
+    DBWriter will write once the parent arrives. Stored with the batch
+    that deferred it, so the comment survives a restart of the writer. """
+
+    id = models.PositiveIntegerField(primary_key=True)
+    parent = models.PositiveIntegerField(db_index=True)
+    source = models.CharField(max_length=5, db_index=True)
+    fields = models.TextField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"Comment {self.id} waiting for {self.parent}"
+
+
+class ScoreSample(models.Model):
+    """ The score of a recent item at its last refresh, and how fast it
+    rose since the refresh before, in points an hour. The next refresh
+    measures the item's velocity against it. """
+
+    id = models.PositiveIntegerField(primary_key=True)
+    score = models.IntegerField(default=0)
+    time = models.PositiveIntegerField(db_index=True)
+    velocity = models.FloatField(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.id}: {self.score} at {self.time}"
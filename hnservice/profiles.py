@@ -0,0 +1,110 @@
+# Background completion of the User stubs DBWriter creates for new authors
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+# Initialize logging
+import logging
+file_logger = logging.getLogger(__name__)
+
+from .api_service import HNFetcher
+from .db_service import DBWriter
+
+
+class ProfileQueue():
+    """
+    Fetches the full profiles of users from /user/{id}.json in the
+    background. A fixed number of workers consume the queue, which caps
+    the profile requests independently of the item fetches, and fetched
+    profiles are written in batches of flush_size, or at the latest
+    flush_interval seconds after they were fetched, so a long-lived queue
+    never holds completed profiles for long.
+
+    Methods
+    -------
+    enqueue(user_ids: Iterable[str])
+        Queue users whose profiles should be fetched
+    start()
+        Start the workers in the running event loop
+    join()
+        Wait until every queued profile is fetched and written
+    stop()
+        Cancel the workers and write what was fetched so far
+    """
+
+    def __init__(self, fetcher: HNFetcher, writer: DBWriter = None,
+                 concurrency: int = None, flush_size: int = 100,
+                 flush_interval: float = None) -> None:
+        self.fetcher = fetcher
+        self.writer = writer or DBWriter()
+        self.concurrency = concurrency or getattr(
+            settings, 'HN_PROFILE_CONCURRENCY', 5)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval or getattr(
+            settings, 'HN_PROFILE_FLUSH_INTERVAL', 30)
+        self.__queue = None
+        self.__workers = []
+        self.__profiles = []
+        self.__queued = set()
+
+    def enqueue(self, user_ids):
+        if self.__queue is None:
+            self.__queue = asyncio.Queue()
+
+        for user_id in user_ids:
+            if user_id not in self.__queued:
+                self.__queued.add(user_id)
+                self.__queue.put_nowait(user_id)
+
+    def start(self):
+        if self.__queue is None:
+            self.__queue = asyncio.Queue()
+
+        if not self.__workers:
+            self.__workers = [asyncio.ensure_future(self.__work())
+                              for _ in range(self.concurrency)]
+            self.__workers.append(asyncio.ensure_future(self.__flush_periodically()))
+
+    async def join(self):
+        if self.__queue is not None:
+            await self.__queue.join()
+        await self.flush()
+
+    async def stop(self):
+        for worker in self.__workers:
+            worker.cancel()
+        await asyncio.gather(*self.__workers, return_exceptions=True)
+        self.__workers = []
+        await self.flush()
+
+    async def flush(self):
+        """ Write the profiles fetched so far in one batch """
+        profiles, self.__profiles = self.__profiles, []
+
+        if profiles:
+            await sync_to_async(self.writer.write_profiles_to_db)(profiles)
+            file_logger.info(f"Completed {len(profiles)} user profiles")
+
+    async def __flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                file_logger.exception("Could not write the fetched user profiles")
+
+    async def __work(self):
+        while True:
+            user_id = await self.__queue.get()
+            try:
+                profile = await self.fetcher.get_user(user_id)
+                if profile:
+                    self.__profiles.append(profile)
+                if len(self.__profiles) >= self.flush_size:
+                    await self.flush()
+            except Exception:
+                file_logger.exception(f"Could not complete the profile of {user_id}")
+            finally:
+                self.__queued.discard(user_id)
+                self.__queue.task_done()
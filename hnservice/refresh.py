@@ -0,0 +1,149 @@
+# Refresh of the scores, comment counts and kids of recent items, which
+# change on HackNews long after the items were first synced
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+# Initialize logging
+import logging
+file_logger = logging.getLogger(__name__)
+
+from news.lookups import BATCH_SIZE
+from news.models import Base, FeedEntry
+from .api_service import HNFetcher
+from .db_service import DBWriter
+from .models import ScoreSample
+
+
+class ScoreRefresher():
+    """
+    Fetches the stories, polls and jobs that are due for a refresh again
+    and writes them with the DBWriter's bulk upsert. How often an item is
+    due depends on its tier, the first of tiers its age fits in:
+
+        ((2 * 3600, 300), (86400, 3600))
+
+    refreshes items younger than two hours every 5 minutes and items
+    younger than a day every hour. Older items are frozen. Items that
+    rose by at least hot_velocity points an hour between their last two
+    refreshes, kept as ScoreSample, are refreshed like the youngest tier
+    until they slow down.
+
+    Runs are slots of `interval` seconds and an item every n slots is due
+    in the slots where (id + slot) % n == 0, so the refreshes of a tier
+    are spread evenly over its interval without storing when each item
+    was fetched. A run refreshes at most max_items items, the fastest
+    tiers first.
+
+    Methods
+    -------
+    run(fetcher: HNFetcher)
+        Refresh the items due now and return how many were written
+    get_due_ids(now: int)
+        The ids of the items due in the slot of a Unix time
+    record_scores(items: list, now: int)
+        Sample the scores of refreshed items and their velocity
+    """
+
+    TYPES = (Base.STORY, Base.POLL, Base.JOB)
+
+    def __init__(self, writer: DBWriter = None, tiers=None, interval: int = None,
+                 hot_velocity: float = None, max_items: int = None) -> None:
+        self.writer = writer or DBWriter()
+        self.tiers = sorted(tiers or getattr(
+            settings, 'HN_SCORE_REFRESH_TIERS', ((2 * 3600, 300), (86400, 3600))))
+        self.interval = interval or getattr(settings, 'HN_SYNC_SCORE_INTERVAL', 300)
+        self.hot_velocity = hot_velocity or getattr(
+            settings, 'HN_SCORE_REFRESH_HOT_VELOCITY', 20)
+        self.max_items = max_items or getattr(settings, 'HN_SCORE_REFRESH_MAX_ITEMS', 500)
+
+    async def run(self, fetcher: HNFetcher) -> int:
+        """ Refresh the items due now
+
+        Returns
+        -------
+        int
+            The number of items written
+        """
+        now = int(time.time())
+        item_ids = await sync_to_async(self.get_due_ids)(now)
+        items = [item for item in await fetcher.get_items(item_ids) if item]
+        await sync_to_async(self.writer.write_items_to_db)(items)
+        await sync_to_async(self.record_scores)(items, now)
+
+        file_logger.info(f"Refreshed {len(items)} of {len(item_ids)} items due")
+
+        return len(items)
+
+    def get_due_ids(self, now: int) -> list:
+        """ Read the items of the tiers, with one query per type on the
+        (type, time) index, and keep those due in the slot of now
+
+        Returns
+        -------
+        list
+            At most max_items ids, the fastest tiers first, newest first
+        """
+        oldest = now - self.tiers[-1][0]
+        local_start = getattr(settings, 'HN_LOCAL_ID_START', 1000000000)
+        slot = now // self.interval
+        velocities = dict(ScoreSample.objects.filter(
+            velocity__gte=self.hot_velocity).values_list('id', 'velocity'))
+
+        due = []
+        for item_type in self.TYPES:
+            rows = FeedEntry.objects.filter(
+                type=item_type, time__gte=oldest, id__lt=local_start,
+            ).values_list('id', 'time')
+
+            for item_id, posted in rows:
+                period = self.get_period(now - posted, velocities.get(item_id, 0))
+                if period and (item_id + slot) % period == 0:
+                    due.append((period, -item_id))
+
+        due.sort()
+
+        return [-item_id for period, item_id in due[:self.max_items]]
+
+    def get_period(self, age: int, velocity: float) -> int:
+        """ Every how many slots an item of this age, rising by velocity
+        points an hour, is due
+
+        Returns
+        -------
+        int
+            The number of slots, or 0 if the item is frozen
+        """
+        for max_age, refresh_interval in self.tiers:
+            if age < max_age:
+                if velocity >= self.hot_velocity:
+                    refresh_interval = self.tiers[0][1]
+                return max(refresh_interval // self.interval, 1)
+
+        return 0
+
+    def record_scores(self, items: list, now: int):
+        """ Store the score of the refreshed items and how fast it changed
+        since their previous refresh. An item's first sample has no
+        velocity yet. Samples older than the last tier are dropped, their
+        items are frozen. """
+        samples = ScoreSample.objects.in_bulk([item['id'] for item in items])
+
+        new_samples = []
+        for item in items:
+            score = item.get('score') or 0
+            sample = samples.get(item['id'])
+            if sample is None:
+                new_samples.append(ScoreSample(id=item['id'], score=score, time=now))
+                continue
+
+            hours = max(now - sample.time, self.interval) / 3600
+            sample.velocity = (score - sample.score) / hours
+            sample.score, sample.time = score, now
+
+        ScoreSample.objects.bulk_create(
+            new_samples, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        ScoreSample.objects.bulk_update(
+            samples.values(), ['score', 'time', 'velocity'], batch_size=BATCH_SIZE)
+        ScoreSample.objects.filter(time__lt=now - self.tiers[-1][0]).delete()
@@ -0,0 +1,226 @@
+# Incremental sync of new items: everything between the persisted
+# high-water mark and the current maxitem is fetched in bounded batches
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Max
+
+# Initialize logging
+import logging
+file_logger = logging.getLogger(__name__)
+
+from news.models import Comment, Job, Poll, PollOption, Story
+from .api_service import FETCH_FAILED, HNFetcher
+from .db_service import DBWriter
+from .models import SyncState
+from .profiles import ProfileQueue
+
+
+class SyncReport():
+    """
+    The outcome of a single sync run
+
+    Attributes
+    ----------
+    start_id : int
+        The first item id requested in this run
+    end_id : int
+        The last item id the watermark was advanced to
+    fetched : int
+        The number of items received from the API
+    elapsed : float
+        The duration of the run in seconds
+    """
+
+    def __init__(self, start_id: int = 0) -> None:
+        self.start_id = start_id
+        self.end_id = start_id - 1
+        self.fetched = 0
+        self.elapsed = 0.0
+
+    @property
+    def items_per_second(self) -> float:
+        return self.fetched / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        return (f"Synced items {self.start_id}..{self.end_id}: "
+                f"{self.fetched} items in {self.elapsed:.2f}s "
+                f"({self.items_per_second:.1f} items/s)")
+
+
+class SyncEngine():
+    """
+    Fetches every item from the stored watermark + 1 up to the current
+    maxitem, in batches of batch_size concurrent requests, and writes
+    them with the DBWriter. Authors new to the DB are stored as stubs and
+    their profiles are completed by a ProfileQueue. The watermark is only
+    advanced past ids that were received and stored, so a run interrupted
+    by downtime, a failed request or a failed write resumes where it
+    stopped without refetching stored items.
+    An id the API answers with null that is still missing after
+    max_retries runs, or that is more than missing_margin ids below
+    maxitem, is skipped and logged, so a single null item cannot hold the
+    sync back for good. A failed request is always retried.
+
+    Methods
+    -------
+    run(fetcher: HNFetcher = None, profiles: ProfileQueue = None)
+        Catch up from the watermark to maxitem and return a SyncReport
+    """
+
+    def __init__(self, writer: DBWriter = None, batch_size: int = None,
+                 initial_items: int = None, max_retries: int = None,
+                 missing_margin: int = None) -> None:
+        self.writer = writer or DBWriter()
+        self.batch_size = batch_size or getattr(
+            settings, 'HN_SYNC_BATCH_SIZE', 100)
+        self.initial_items = initial_items or getattr(
+            settings, 'HN_SYNC_INITIAL_ITEMS', 100)
+        self.max_retries = max_retries or getattr(
+            settings, 'HN_SYNC_MISSING_RETRIES', 5)
+        self.missing_margin = missing_margin or getattr(
+            settings, 'HN_SYNC_MISSING_MARGIN', 1000)
+
+    async def run(self, fetcher: HNFetcher = None,
+                  profiles: ProfileQueue = None) -> SyncReport:
+        """ Catch up from the watermark to the current maxitem
+
+        Parameters
+        ----------
+        fetcher : HNFetcher
+            The fetcher to query the API with. A new one is opened and
+            closed if none is given.
+        profiles : ProfileQueue
+            The queue new authors are handed to. If none is given, one is
+            started for this run and drained before returning.
+
+        Returns
+        -------
+        SyncReport
+            The range synced and the achieved throughput
+        """
+        if fetcher is None:
+            async with HNFetcher() as fetcher:
+                return await self.run(fetcher, profiles)
+
+        if profiles is None:
+            profiles = ProfileQueue(fetcher, writer=self.writer)
+            profiles.start()
+            try:
+                return await self.run(fetcher, profiles)
+            finally:
+                await profiles.join()
+                await profiles.stop()
+
+        started = time.monotonic()
+        max_item = await fetcher.get_max_item_id()
+        watermark = await sync_to_async(self.get_watermark)(max_item)
+        report = SyncReport(watermark + 1)
+
+        if max_item is None:
+            file_logger.error("Could not get maxitem, skipping the sync")
+            return report
+
+        for batch_start in range(watermark + 1, max_item + 1, self.batch_size):
+            batch_ids = range(batch_start,
+                              min(batch_start + self.batch_size, max_item + 1))
+            items = await fetcher.get_items(batch_ids, failed=FETCH_FAILED)
+
+            # Only write up to the first failed request or missing item
+            # that is still waited for, the rest is retried on the next run
+            received = []
+            last_id = None
+            waiting = False
+            for item_id, item in zip(batch_ids, items):
+                if item is FETCH_FAILED:
+                    file_logger.warning(f"Could not fetch item {item_id}, retrying it next run")
+                    waiting = True
+                    break
+                if item is None and not await sync_to_async(self.skip_missing)(
+                        item_id, max_item):
+                    waiting = True
+                    break
+                if item is not None:
+                    received.append(item)
+                last_id = item_id
+
+            await sync_to_async(self.write_batch)(received, last_id)
+            profiles.enqueue(self.writer.pop_new_users())
+            report.fetched += len(received)
+            if last_id is not None:
+                report.end_id = last_id
+
+            if waiting:
+                break
+
+        report.elapsed = time.monotonic() - started
+        file_logger.info(str(report))
+
+        return report
+
+    def get_watermark(self, max_item: int = None) -> int:
+        """ Read the persisted watermark. On the first run it is seeded
+        with the newest stored item, but never older than initial_items
+        before maxitem.
+
+        Returns
+        -------
+        int
+            The id of the last synced item
+        """
+        state = SyncState.objects.filter(name=SyncState.MAXITEM).first()
+        if state is not None:
+            return state.value
+
+        # Items created through the API have ids above the HN range
+        local_start = getattr(settings, 'HN_LOCAL_ID_START', 1000000000)
+        stored = [model.objects.filter(id__lt=local_start).aggregate(
+                      newest=Max('id'))['newest'] or 0
+                  for model in (Comment, Job, Poll, PollOption, Story)]
+        floor = max((max_item or 0) - self.initial_items, 0)
+
+        return max(stored + [floor])
+
+    def write_batch(self, items: list, last_id: int = None):
+        """ Write the received items as one batch and advance the
+        watermark to last_id, by default the last item. A batch that
+        could not be stored raises and leaves the watermark as it is. """
+        self.writer.write_items_to_db(items, raise_errors=True)
+
+        if last_id is None and items:
+            last_id = items[-1]["id"]
+        if last_id is not None:
+            SyncState.objects.update_or_create(
+                name=SyncState.MAXITEM, defaults={'value': last_id})
+
+    def skip_missing(self, item_id: int, max_item: int) -> bool:
+        """ Count another run waiting for a missing item and decide
+        whether to give up on it
+
+        Returns
+        -------
+        bool
+            Whether the sync should go on without the item
+        """
+        if item_id <= max_item - self.missing_margin:
+            file_logger.warning(
+                f"Skipping item {item_id}, it is missing {max_item - item_id} ids below maxitem")
+            return True
+
+        missing = SyncState.objects.filter(name=SyncState.MISSING).first()
+        if missing is None or missing.value != item_id:
+            SyncState.objects.update_or_create(
+                name=SyncState.MISSING, defaults={'value': item_id})
+            SyncState.objects.update_or_create(
+                name=SyncState.MISSING_RUNS, defaults={'value': 1})
+            runs = 1
+        else:
+            runs = SyncState.advance(SyncState.MISSING_RUNS)
+
+        if runs > self.max_retries:
+            file_logger.warning(f"Skipping item {item_id}, it was missing in {runs - 1} runs")
+            return True
+
+        file_logger.warning(f"Item {item_id} is not available yet, run {runs}")
+        return False
@@ -1,62 +1,77 @@
-# This script is used to run api calls to the Hacker News service
-# It gets the latest news
-import requests
-
-# Scheduler's modules
-import asyncio
-from background_task import background, tasks
-from background_task.models import Task
-from datetime import datetime, timedelta
-import pytz
+# The periodic jobs of the sync worker. Every job reuses the worker's
+# fetcher, writer and profile queue instead of opening its own.
+from asgiref.sync import sync_to_async
 
 # Initialize logging
 import logging
 file_logger = logging.getLogger(__name__)
 
-from .db_service import DBchecker, DBWriter
-from .api_service import get_all_latest_stories, get_latest_story
-
+from .api_service import HNFetcher, get_feed_ids, get_items_by_id
+from .crawler import ThreadCrawler
+from .db_service import DBWriter
+from .profiles import ProfileQueue
+from .refresh import ScoreRefresher
+from .sync import SyncEngine
+from .updates import UpdateConsumer
 
-baseUrl = "https://hacker-news.firebaseio.com/v0"
-checker = DBchecker()
-writer = DBWriter()
 
+async def refresh_feeds(fetcher: HNFetcher, writer: DBWriter, profiles: ProfileQueue) -> dict:
+    """ Write the items of the feeds and backfill their comment threads.
+    The feed items get their score, title and kids refreshed and the
+    order of every feed is snapshotted.
 
-@background(schedule=60)
-def get_latest_news():
-    """ Get the latest news or populate the news tables first. This 
-    function is scheduled to run every 5 minutes.
+    Returns
+    -------
+    {'levels': int, 'fetched': int}
+        How deep the thread crawl went and how many items were fetched
     """
+    feed_ids = await get_feed_ids(fetcher)
+    latest_stories = await get_items_by_id(fetcher, feed_ids)
 
-    # Get most recent news if tables are populated
-    # Check if db tables are populated
-    if checker.is_tables_populated():
-        response = asyncio.run(get_latest_story())
-        file_logger.info(response)
+    # Feeds overlap, write every item once
+    unique_items = list({news_item["id"]: news_item
+                         for news_source in latest_stories.values()
+                         for news_item in news_source}.values())
+    await sync_to_async(writer.write_items_to_db)(unique_items)
+    await sync_to_async(writer.write_feed_ranks)(feed_ids)
 
-        # if response:
-        #     writer.write_item_to_db(response)
+    stats = await ThreadCrawler(writer=writer).crawl_from(unique_items, fetcher)
+    stats['fetched'] += len(unique_items)
+    profiles.enqueue(writer.pop_new_users())
 
-    # Otherwise, get and process latest 100 records
-    else:
-        latest_stories = asyncio.run(get_all_latest_stories())
+    return stats
 
 
-def start_task():
-    """ Schedule the background function, get_latest_news
-    Make sure to run only one scheduled function
+async def catch_up(fetcher: HNFetcher, writer: DBWriter, profiles: ProfileQueue):
+    """ Fetch every item published since the last run
+
+    Returns
+    -------
+    SyncReport
+        The range synced and the achieved throughput
     """
+    return await SyncEngine(writer=writer).run(fetcher, profiles)
 
-    TASK_DURATION = 300
 
-    tasks = Task.objects.filter(verbose_name="Get Latest News")
-    if len(tasks) == 0:
+async def refresh_scores(fetcher: HNFetcher, writer: DBWriter, profiles: ProfileQueue) -> int:
+    """ Fetch the recent stories, polls and jobs due for a refresh of
+    their score, comment count and kids
 
-        # Schedule to stop after 1 hour
-        stop = datetime.utcnow().replace(tzinfo=pytz.utc) + \
-            timedelta(hours=1, minutes=0, seconds=0)
+    Returns
+    -------
+    int
+        The number of items refreshed
+    """
+    return await ScoreRefresher(writer=writer).run(fetcher)
 
-        # No task running with this name, call background tasks every 5 minutes
-        get_latest_news(schedule=timedelta(seconds=60), repeat=TASK_DURATION,
-                                repeat_until=stop, verbose_name="Get Latest News")
-        file_logger.debug(f"Scheduling the background task for every {TASK_DURATION/60} minutes")
+
+async def consume_updates(fetcher: HNFetcher, writer: DBWriter, profiles: ProfileQueue) -> dict:
+    """ Fetch the items and profiles changed since the last poll of
+    /updates.json
+
+    Returns
+    -------
+    {'items': int, 'deleted': int, 'profiles': int}
+        How many items were written or deleted and profiles queued
+    """
+    return await UpdateConsumer(writer=writer).run(fetcher, profiles)
@@ -1,30 +1,125 @@
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
 from aiohttp import web
-from hnservice.api_service import get_news_item, get_top_stories
-from django.test import TestCase
-from django.db import IntegrityError
+from asgiref.sync import async_to_sync, sync_to_async
+import asyncio
+import time
+from datetime import timedelta
+from unittest import mock
+from hnservice.api_service import HNFetcher, get_all_latest_stories, query_endpoint
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import DatabaseError, IntegrityError, connection
+from django.utils import timezone
 
-from .db_service import DBchecker
-from news.models import Comment, Job
+from .db_service import DBchecker, DBWriter
+from .models import OrphanComment, ScoreSample, SyncLease, SyncState, UpdatesPoll
+from .crawler import ThreadCrawler
+from .profiles import ProfileQueue
+from .refresh import ScoreRefresher
+from .sync import SyncEngine
+from .updates import UpdateConsumer
+from .worker import PeriodicJob, SyncWorker
+from news.cache import PageCache, SearchCache
+from news.models import Comment, FeedEntry, FeedRank, ItemEdge, Job, Poll, PollOption, Story, User
 
 # Create your tests here.
 
 
 class TestAsyncService(AioHTTPTestCase):
+    """ Queries a local stand-in of the HackNews API """
 
     async def get_application(self):
-        return web.Application()
+        async def maxitem(request):
+            return web.json_response(8265435)
+
+        async def feed(request):
+            return web.json_response([8265435] if request.match_info['feed'] == "topstories" else [])
+
+        async def item(request):
+            return web.json_response({"id": int(request.match_info['item_id']), "type": "story"})
+
+        app = web.Application()
+        app.router.add_get("/maxitem.json", maxitem)
+        app.router.add_get("/item/{item_id}.json", item)
+        app.router.add_get("/{feed}.json", feed)
+        return app
 
     @unittest_run_loop
     async def test_get_news_item_returns_item(self):
-        url = "https://hacker-news.firebaseio.com/v0/maxitem.json"
-        response = await get_news_item(self.client, url)
-        assert response is not None
+        url = str(self.server.make_url("/maxitem.json"))
+        response = await query_endpoint(self.client.session, url)
+        self.assertEqual(response, 8265435)
 
     @unittest_run_loop
     async def test_get_latest_news_gets_top_stories(self):
-        responses = await get_top_stories()
-        assert responses is not None
+        base_url = str(self.server.make_url("")).rstrip("/")
+
+        with mock.patch("hnservice.api_service.baseUrl", base_url):
+            responses = await get_all_latest_stories()
+
+        self.assertEqual(responses["topstories"], [{"id": 8265435, "type": "story"}])
+        self.assertEqual(responses["askstories"], [])
+
+
+class TestHNFetcher(AioHTTPTestCase):
+
+    async def get_application(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.item_requests = []
+        feeds = {"topstories": [1, 2, 3], "askstories": [2, 4],
+                 "showstories": [3, 5], "jobstories": [6]}
+
+        async def feed(request):
+            return web.json_response(feeds[request.match_info['feed']])
+
+        async def item(request):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(0.01)
+            self.in_flight -= 1
+            item_id = int(request.match_info['item_id'])
+            self.item_requests.append(item_id)
+            return web.json_response({"id": item_id, "type": "story"})
+
+        app = web.Application()
+        app.router.add_get("/item/{item_id}.json", item)
+        app.router.add_get("/{feed}.json", feed)
+        return app
+
+    async def test_get_items_respects_concurrency_window(self):
+        base_url = str(self.server.make_url("")).rstrip("/")
+
+        with mock.patch("hnservice.api_service.baseUrl", base_url):
+            async with HNFetcher(concurrency=4) as fetcher:
+                items = await fetcher.get_items(range(1, 21))
+
+        self.assertEqual([item["id"] for item in items], list(range(1, 21)))
+        self.assertLessEqual(self.max_in_flight, 4)
+
+    async def test_fetcher_reuses_one_session(self):
+        base_url = str(self.server.make_url("")).rstrip("/")
+
+        with mock.patch("hnservice.api_service.baseUrl", base_url):
+            async with HNFetcher() as fetcher:
+                session = fetcher.session
+                await fetcher.get_items([1, 2])
+                await fetcher.get_item(3)
+                self.assertIs(fetcher.session, session)
+
+            self.assertTrue(session.closed)
+
+    async def test_feeds_are_fetched_once_and_grouped(self):
+        base_url = str(self.server.make_url("")).rstrip("/")
+
+        with mock.patch("hnservice.api_service.baseUrl", base_url):
+            feeds = await get_all_latest_stories()
+
+        self.assertEqual(sorted(self.item_requests), [1, 2, 3, 4, 5, 6])
+        self.assertEqual([item["id"] for item in feeds["topstories"]], [1, 2, 3])
+        self.assertEqual([item["id"] for item in feeds["askstories"]], [2, 4])
+        self.assertEqual([item["id"] for item in feeds["showstories"]], [3, 5])
+        self.assertEqual([item["id"] for item in feeds["jobstories"]], [6])
 
 
 class TestDBCheckerService(TestCase):
@@ -78,3 +173,780 @@ class TestDBWriterService(TestCase):
             Comment.objects.create(**another_comment)
 
         self.assertIn("UNIQUE constraint failed", str(error.exception))
+
+
+class FakeWriter():
+    """ Records the items the sync engine hands over for writing """
+
+    def __init__(self) -> None:
+        self.items = []
+
+    def write_items_to_db(self, news_items, raise_errors=False):
+        self.items.extend(news_items)
+
+    def pop_new_users(self):
+        return set()
+
+
+class FakeFetcher():
+    """ Serves story items for any id instead of querying the API """
+
+    def __init__(self, max_item: int = None, missing=(), failing=()) -> None:
+        self.max_item = max_item
+        self.missing = missing
+        self.failing = failing
+        self.requested = []
+        self.users_requested = []
+
+    async def get_max_item_id(self):
+        return self.max_item
+
+    async def get_items(self, item_ids, failed=None):
+        self.requested.extend(item_ids)
+        return [failed if item_id in self.failing else
+                None if item_id in self.missing else {"id": item_id, "type": "story", "by": "pg"}
+                for item_id in item_ids]
+
+    async def get_user(self, user_id):
+        self.users_requested.append(user_id)
+        return {"id": user_id, "created": 1173923446, "karma": 2937,
+                "about": "This is a test", "submitted": [8265435]}
+
+
+class TestSyncEngine(TestCase):
+
+    def setUp(self) -> None:
+        self.writer = FakeWriter()
+        self.engine = SyncEngine(writer=self.writer, batch_size=3,
+                                 initial_items=5)
+
+    def run_engine(self, max_item, missing=(), failing=()):
+        fetcher = FakeFetcher(max_item, missing, failing)
+        return async_to_sync(self.engine.run)(fetcher)
+
+    def test_first_run_starts_initial_items_before_maxitem(self):
+        report = self.run_engine(max_item=20)
+
+        self.assertEqual([item["id"] for item in self.writer.items],
+                         list(range(16, 21)))
+        self.assertEqual(report.fetched, 5)
+        self.assertEqual(SyncState.objects.get(name=SyncState.MAXITEM).value, 20)
+
+    def test_catches_up_from_watermark(self):
+        SyncState.objects.create(name=SyncState.MAXITEM, value=10)
+
+        self.run_engine(max_item=30)
+
+        self.assertEqual([item["id"] for item in self.writer.items],
+                         list(range(11, 31)))
+
+    def test_stops_at_missing_item_and_resumes(self):
+        SyncState.objects.create(name=SyncState.MAXITEM, value=10)
+
+        report = self.run_engine(max_item=20, missing={15})
+        self.assertEqual(report.end_id, 14)
+        self.assertEqual(SyncState.objects.get(name=SyncState.MAXITEM).value, 14)
+
+        self.writer.items.clear()
+        self.run_engine(max_item=20)
+        self.assertEqual([item["id"] for item in self.writer.items],
+                         list(range(15, 21)))
+
+    def test_missing_item_is_skipped_after_retries(self):
+        SyncState.objects.create(name=SyncState.MAXITEM, value=10)
+        self.engine.max_retries = 2
+
+        for _ in range(2):
+            self.assertEqual(self.run_engine(max_item=20, missing={15}).end_id, 14)
+
+        self.writer.items.clear()
+        report = self.run_engine(max_item=20, missing={15})
+
+        self.assertEqual(report.end_id, 20)
+        self.assertEqual([item["id"] for item in self.writer.items], list(range(16, 21)))
+        self.assertEqual(SyncState.objects.get(name=SyncState.MAXITEM).value, 20)
+
+    def test_missing_item_far_below_maxitem_is_skipped_at_once(self):
+        SyncState.objects.create(name=SyncState.MAXITEM, value=10)
+        self.engine.missing_margin = 5
+
+        report = self.run_engine(max_item=20, missing={12, 18})
+
+        self.assertEqual(report.end_id, 17)
+        self.assertNotIn(12, [item["id"] for item in self.writer.items])
+
+    def test_failed_request_is_retried_however_far_below_maxitem(self):
+        SyncState.objects.create(name=SyncState.MAXITEM, value=10)
+        self.engine.missing_margin = 5
+        self.engine.max_retries = 1
+
+        for _ in range(3):
+            self.assertEqual(self.run_engine(max_item=20, failing={12}).end_id, 11)
+
+        self.assertFalse(SyncState.objects.filter(name=SyncState.MISSING).exists())
+        self.run_engine(max_item=20)
+        self.assertIn(12, [item["id"] for item in self.writer.items])
+
+    def test_watermark_stays_when_the_batch_is_not_stored(self):
+        SyncState.objects.create(name=SyncState.MAXITEM, value=10)
+        User.objects.create(id="pg", created=1160418092, karma=155111)
+        engine = SyncEngine(writer=DBWriter(), batch_size=10)
+        fetcher = FakeFetcher(20)
+
+        with mock.patch.object(DBWriter, '_DBWriter__upsert',
+                               side_effect=DatabaseError("disk full")):
+            with self.assertRaises(DatabaseError):
+                async_to_sync(engine.run)(fetcher)
+
+        self.assertEqual(SyncState.objects.get(name=SyncState.MAXITEM).value, 10)
+
+
+class TestDBWriterBulkUpsert(TestCase):
+
+    def setUp(self) -> None:
+        User.objects.create(id="pg", created=1160418092, karma=155111)
+        self.writer = DBWriter()
+
+    def story(self, item_id, **fields):
+        return {"id": item_id, "by": "pg", "time": 1175714200, "type": "story",
+                "title": f"Story {item_id}", "score": 1, "kids": [], **fields}
+
+    def test_rows_stored_by_another_writer_are_updated_not_counted(self):
+        self.writer.write_items_to_db([self.story(1)])
+        writer = DBWriter()
+        stored_sources = writer._DBWriter__stored_sources
+        lookups = []
+
+        def stale_lookup(model, ids):
+            # The first lookup misses the row another writer just stored
+            lookups.append(model)
+            return {} if len(lookups) == 1 else stored_sources(model, ids)
+
+        with mock.patch.object(writer, '_DBWriter__stored_sources', stale_lookup):
+            stats = writer.write_items_to_db([self.story(1, score=9), self.story(2)])
+
+        self.assertEqual((stats["created"], stats["updated"]), (1, 1))
+        self.assertEqual(Story.objects.get(id=1).score, 9)
+        self.assertEqual(Story.objects.count(), 2)
+
+    def test_batch_is_written_in_a_few_statements(self):
+        stories = [self.story(item_id) for item_id in range(1, 201)]
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.writer.write_items_to_db(stories)
+
+        self.assertEqual(stats["created"], 200)
+        self.assertEqual(Story.objects.count(), 200)
+        # One id lookup and SQLite-sized INSERT batches (999 parameters
+        # over 14 columns), not one per item
+        story_queries = [query for query in queries.captured_queries
+                         if '"news_story"' in query["sql"]]
+        self.assertLessEqual(len(story_queries), 5)
+        # Plus a savepoint around the inserts of every model
+        self.assertLessEqual(len(queries), 24)
+
+    def test_existing_items_are_updated(self):
+        self.writer.write_items_to_db([self.story(1, score=5)])
+
+        stats = self.writer.write_items_to_db(
+            [self.story(1, score=42, descendants=3, kids=[7, 8])])
+
+        self.assertEqual(stats, {"created": 0, "updated": 1, "skipped": 0,
+                                 "deferred": 0})
+        story = Story.objects.get(id=1)
+        self.assertEqual(story.score, 42)
+        self.assertEqual(story.descendants, 3)
+        self.assertEqual(story.kids, "[7, 8]")
+
+    def test_items_are_grouped_by_type(self):
+        self.writer.write_items_to_db([
+            self.story(1),
+            {"id": 2, "by": "pg", "type": "poll", "title": "Poll", "parts": [3]},
+            {"id": 3, "by": "pg", "type": "pollopt", "poll": 2, "text": "Yes"},
+            {"id": 4, "by": "pg", "type": "job", "title": "Job"},
+        ])
+
+        self.assertEqual(Story.objects.count(), 1)
+        self.assertEqual(Poll.objects.get(id=2).parts, "[3]")
+        self.assertEqual(PollOption.objects.get(id=3).parent_id, 2)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_committed_batch_invalidates_search_cache(self):
+        generation = SearchCache().generation()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.writer.write_items_to_db([self.story(1)])
+
+        self.assertEqual(SearchCache().generation(), generation + 1)
+
+    def test_snippets_are_stored_with_the_item(self):
+        text = "Some <i>words</i><p>" + " ".join(["more"] * 30) + "<script>x()</script>"
+        self.writer.write_items_to_db([self.story(1, text=text)])
+
+        story = Story.objects.get(id=1)
+        self.assertTrue(story.snippet.startswith("Some <i>words</i><p>more"))
+        self.assertTrue(story.snippet.endswith("…</p>"))
+        self.assertNotIn("script", story.snippet)
+        self.assertTrue(story.excerpt.startswith("Some words more more"))
+        self.assertEqual(FeedEntry.objects.get(id=1).snippet, story.snippet)
+
+        self.writer.write_items_to_db([self.story(1, text="Edited")])
+
+        self.assertEqual(Story.objects.get(id=1).snippet, "Edited")
+        self.assertEqual(FeedEntry.objects.get(id=1).excerpt, "Edited")
+
+    def test_empty_batches_keep_the_items_version(self):
+        self.writer.write_items_to_db([self.story(1)])
+        version = SyncState.objects.get(name=SyncState.ITEMS).value
+
+        for _ in range(3):
+            self.writer.write_items_to_db([])
+        self.writer.write_items_to_db([{"id": 2, "type": "story"}])
+
+        self.assertEqual(SyncState.objects.get(name=SyncState.ITEMS).value, version)
+        self.assertEqual(SearchCache().generation(), version)
+
+    def test_committed_batch_invalidates_page_cache(self):
+        generation = PageCache().generation()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.writer.write_items_to_db([self.story(1)])
+
+        self.assertEqual(PageCache().generation(), generation + 1)
+
+    def test_kids_and_parts_are_stored_as_edges(self):
+        self.writer.write_items_to_db([
+            self.story(1, kids=[9, 8]),
+            {"id": 2, "by": "pg", "type": "poll", "title": "Poll", "parts": [3, 4]},
+        ])
+
+        self.assertEqual(ItemEdge.children_of([1, 2]), {1: [9, 8], 2: [3, 4]})
+        self.assertEqual(ItemEdge.children_of([2], "pollopt"), {2: [3, 4]})
+
+        self.writer.write_items_to_db([self.story(1, kids=[7, 9, 8])])
+
+        self.assertEqual(ItemEdge.children_of([1]), {1: [7, 9, 8]})
+
+    def test_unknown_keys_are_dropped_and_counted(self):
+        job = {"id": 5, "by": "pg", "type": "job", "title": "Job", "descendants": 0}
+
+        stats = self.writer.write_items_to_db([job])
+
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(self.writer.dropped_keys[("job", "descendants")], 1)
+
+    def test_unknown_keys_reject_item_without_projection(self):
+        writer = DBWriter(projection=False)
+        job = {"id": 5, "by": "pg", "type": "job", "title": "Job", "descendants": 0}
+
+        stats = writer.write_items_to_db([job])
+
+        self.assertEqual(stats["skipped"], 1)
+        self.assertFalse(Job.objects.exists())
+
+
+class TestAuthorResolution(TestCase):
+
+    def setUp(self) -> None:
+        User.objects.create(id="pg", created=1160418092, karma=155111)
+        self.writer = DBWriter()
+
+    def test_missing_authors_are_stubbed_in_one_batch(self):
+        stories = [{"id": item_id, "by": author, "type": "story", "title": "Story"}
+                   for item_id, author in enumerate(["pg", "jl", "dang", "jl"], 1)]
+
+        with CaptureQueriesContext(connection) as queries:
+            self.writer.write_items_to_db(stories)
+
+        user_queries = [query for query in queries.captured_queries
+                        if '"news_user"' in query["sql"]]
+        self.assertEqual(len(user_queries), 2)
+        self.assertEqual(Story.objects.count(), 4)
+        self.assertEqual(User.objects.get(id="jl").karma, 0)
+        self.assertEqual(self.writer.pop_new_users(), {"jl", "dang"})
+        self.assertEqual(self.writer.pop_new_users(), set())
+
+    def test_profile_queue_completes_stubs(self):
+        self.writer.write_items_to_db(
+            [{"id": 1, "by": "jl", "type": "story", "title": "Story"}])
+        fetcher = FakeFetcher()
+
+        async def complete_profiles():
+            profiles = ProfileQueue(fetcher, writer=self.writer, concurrency=2)
+            profiles.start()
+            profiles.enqueue(self.writer.pop_new_users())
+            await profiles.join()
+            await profiles.stop()
+
+        async_to_sync(complete_profiles)()
+
+        self.assertEqual(fetcher.users_requested, ["jl"])
+        user = User.objects.get(id="jl")
+        self.assertEqual(user.karma, 2937)
+        self.assertEqual(user.submitted, "[8265435]")
+
+    def test_fetched_profiles_are_written_while_the_queue_runs(self):
+        written = []
+
+        async def fetch_one_profile():
+            profiles = ProfileQueue(FakeFetcher(), writer=self.writer, flush_interval=0.05)
+            profiles.start()
+            profiles.enqueue(["jl"])
+            await asyncio.sleep(0.3)
+            flushed = list(written)
+            await profiles.stop()
+            return flushed
+
+        with mock.patch.object(self.writer, 'write_profiles_to_db',
+                               side_effect=lambda batch: written.extend(
+                                   profile["id"] for profile in batch)):
+            flushed = async_to_sync(fetch_one_profile)()
+
+        self.assertEqual(flushed, ["jl"])
+
+
+class TestCommentLinking(TestCase):
+
+    def setUp(self) -> None:
+        User.objects.create(id="pg", created=1160418092, karma=155111)
+        self.writer = DBWriter()
+        self.writer.write_items_to_db(
+            [{"id": 1, "by": "pg", "type": "story", "title": "Story"}])
+
+    def comment(self, item_id, parent):
+        return {"id": item_id, "by": "pg", "type": "comment",
+                "parent": parent, "text": f"Comment {item_id}"}
+
+    def test_thread_in_one_batch_is_linked(self):
+        thread = [self.comment(4, 3), self.comment(3, 2), self.comment(2, 1)]
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.writer.write_items_to_db(thread)
+
+        self.assertEqual(stats["created"], 3)
+        # One parent lookup per parent table, not one per level
+        comment_queries = [query for query in queries.captured_queries
+                           if '"news_comment"' in query["sql"]]
+        self.assertLessEqual(len(comment_queries), 3)
+        self.assertEqual(Story.objects.get(id=1).comments.get().id, 2)
+        self.assertEqual(Comment.objects.get(id=2).comments.get().id, 3)
+        self.assertEqual(Comment.objects.get(id=3).comments.get().id, 4)
+
+    def test_orphans_wait_for_their_parent(self):
+        stats = self.writer.write_items_to_db([self.comment(6, 5)])
+
+        self.assertEqual(stats["deferred"], 1)
+        self.assertFalse(Comment.objects.filter(id=6).exists())
+
+        stats = self.writer.write_items_to_db([self.comment(5, 1)])
+
+        self.assertEqual(stats["created"], 2)
+        self.assertFalse(OrphanComment.objects.exists())
+        self.assertEqual(Comment.objects.get(id=6).parent.id, 5)
+
+    def test_orphans_survive_a_restart(self):
+        self.writer.write_items_to_db([self.comment(6, 5)])
+        self.assertTrue(OrphanComment.objects.filter(id=6, parent=5).exists())
+
+        stats = DBWriter().write_items_to_db([self.comment(5, 1)])
+
+        self.assertEqual(stats["created"], 2)
+        self.assertEqual(Comment.objects.get(id=6).parent.id, 5)
+        self.assertFalse(OrphanComment.objects.exists())
+
+    def test_only_orphans_of_the_batch_are_retried(self):
+        self.writer.write_items_to_db(
+            [self.comment(item_id, item_id + 1000) for item_id in range(100, 600)])
+        self.writer.write_items_to_db([self.comment(6, 5), self.comment(7, 6)])
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.writer.write_items_to_db([self.comment(5, 1)])
+
+        self.assertEqual(stats["created"], 3)
+        self.assertEqual(Comment.objects.get(id=7).parent.id, 6)
+        self.assertEqual(OrphanComment.objects.count(), 500)
+        self.assertLessEqual(len(queries), 30)
+
+    def test_orphans_beyond_the_limit_are_dropped_oldest_first(self):
+        self.writer.orphan_limit = 2
+
+        for item_id in (6, 7, 8):
+            self.writer.write_items_to_db([self.comment(item_id, 5)])
+
+        self.assertEqual(sorted(OrphanComment.objects.values_list('id', flat=True)), [7, 8])
+
+    def test_orphans_are_kept_when_their_batch_fails(self):
+        self.writer.write_items_to_db([self.comment(6, 5)])
+
+        with mock.patch.object(self.writer.search_index, 'update',
+                               side_effect=DatabaseError("disk full")):
+            stats = self.writer.write_items_to_db([self.comment(5, 1)])
+
+        self.assertEqual(stats["skipped"], 2)
+        self.assertEqual(list(OrphanComment.objects.values_list('id', flat=True)), [6])
+
+        self.writer.write_items_to_db([self.comment(5, 1)])
+        self.assertEqual(Comment.objects.get(id=6).parent.id, 5)
+        self.assertFalse(OrphanComment.objects.exists())
+
+
+class ThreadFetcher():
+    """ Serves the items of a fixed thread instead of querying the API """
+
+    def __init__(self, items: list) -> None:
+        self.items = {item["id"]: item for item in items}
+        self.requested = []
+
+    async def get_items(self, item_ids):
+        self.requested.extend(item_ids)
+        return [self.items.get(item_id) for item_id in item_ids]
+
+
+class TestThreadCrawler(TestCase):
+
+    def setUp(self) -> None:
+        User.objects.create(id="pg", created=1160418092, karma=155111)
+        self.writer = DBWriter()
+        self.story = {"id": 1, "by": "pg", "type": "story", "title": "Story",
+                      "kids": [2, 3]}
+        self.fetcher = ThreadFetcher([
+            self.story,
+            self.comment(2, 1, kids=[4]),
+            self.comment(3, 1),
+            self.comment(4, 2, kids=[5]),
+            self.comment(5, 4),
+        ])
+
+    def comment(self, item_id, parent, kids=()):
+        return {"id": item_id, "by": "pg", "type": "comment", "parent": parent,
+                "text": f"Comment {item_id}", "kids": list(kids)}
+
+    def test_thread_is_crawled_level_by_level(self):
+        crawler = ThreadCrawler(writer=self.writer)
+
+        stats = async_to_sync(crawler.crawl)([1], self.fetcher)
+
+        self.assertEqual(stats, {"levels": 3, "fetched": 5})
+        self.assertEqual(Comment.objects.count(), 4)
+        self.assertEqual(Comment.objects.get(id=5).parent.id, 4)
+
+    def test_crawl_stops_at_max_depth(self):
+        crawler = ThreadCrawler(writer=self.writer, max_depth=2)
+
+        async_to_sync(crawler.crawl)([1], self.fetcher)
+
+        self.assertEqual(sorted(Comment.objects.values_list("id", flat=True)), [2, 3, 4])
+
+    def test_stored_comments_are_not_fetched_again(self):
+        self.writer.write_items_to_db([self.story, self.comment(2, 1, kids=[4])])
+        crawler = ThreadCrawler(writer=self.writer)
+
+        async_to_sync(crawler.crawl_from)([self.story], self.fetcher)
+
+        self.assertNotIn(2, self.fetcher.requested)
+        self.assertEqual(Comment.objects.count(), 4)
+
+
+class TestSyncWorker(TestCase):
+
+    def setUp(self) -> None:
+        self.fetcher = FakeFetcher(max_item=10)
+        self.writer = FakeWriter()
+        self.runs = []
+
+    def job(self, name, fails=False):
+        async def run(fetcher, writer, profiles):
+            self.runs.append((name, fetcher, writer))
+            if fails:
+                raise ValueError(name)
+
+        return PeriodicJob(name, 60, run)
+
+    def test_jobs_share_the_fetcher_and_writer(self):
+        worker = SyncWorker(jobs=[self.job("feeds"), self.job("scores")],
+                            writer=self.writer, fetcher=self.fetcher)
+
+        async_to_sync(worker.run)(once=True)
+
+        self.assertEqual(self.runs, [("feeds", self.fetcher, self.writer),
+                                     ("scores", self.fetcher, self.writer)])
+
+    def test_failing_job_does_not_stop_the_others(self):
+        worker = SyncWorker(jobs=[self.job("feeds", fails=True), self.job("scores")],
+                            writer=self.writer, fetcher=self.fetcher)
+
+        async_to_sync(worker.run)(once=True)
+
+        self.assertEqual([run[0] for run in self.runs], ["feeds", "scores"])
+
+    def test_jobs_repeat_until_stopped(self):
+        worker = SyncWorker(jobs=[PeriodicJob("fast", 0, None)],
+                            writer=self.writer, fetcher=self.fetcher)
+
+        async def run(fetcher, writer, profiles):
+            self.runs.append("fast")
+            if len(self.runs) == 3:
+                worker.stop()
+            await asyncio.sleep(0)
+
+        worker.jobs[0].run = run
+        async_to_sync(worker.run)()
+
+        self.assertEqual(self.runs, ["fast"] * 3)
+
+
+class TestScoreRefresher(TestCase):
+
+    def setUp(self) -> None:
+        self.now = 1000 * 300
+        self.refresher = ScoreRefresher(interval=300, hot_velocity=20, max_items=100,
+                                        tiers=((2 * 3600, 300), (86400, 3600)))
+
+    def write(self, item_id, age, score=1, item_type="story"):
+        DBWriter().write_items_to_db([{"id": item_id, "by": "pg", "type": item_type,
+                                       "title": "Title", "score": score,
+                                       "time": self.now - age}])
+
+    def test_young_items_are_due_every_run(self):
+        self.write(1, age=600)
+        self.write(2, age=3 * 86400)
+        self.write(3, age=600, item_type="comment")
+
+        for slot in range(3):
+            self.assertEqual(self.refresher.get_due_ids(self.now + slot * 300), [1])
+
+    def test_older_items_are_spread_over_their_interval(self):
+        for item_id in range(1, 25):
+            self.write(item_id, age=5 * 3600)
+
+        runs = [self.refresher.get_due_ids(self.now + slot * 300) for slot in range(12)]
+
+        self.assertEqual(sorted(sum(runs, [])), list(range(1, 25)))
+        self.assertEqual({len(due) for due in runs}, {2})
+
+    def sample(self, scores, hours_ago=1):
+        """ Refresh the items once hours_ago and once now """
+        self.refresher.record_scores(
+            [{"id": item_id, "score": 0} for item_id in scores], self.now - hours_ago * 3600)
+        self.refresher.record_scores(
+            [{"id": item_id, "score": score} for item_id, score in scores.items()], self.now)
+
+    def test_rising_items_are_refreshed_like_young_ones(self):
+        self.write(1, age=5 * 3600, score=500)
+        self.write(2, age=5 * 3600, score=5)
+        self.sample({1: 60, 2: 5})
+
+        due = [self.refresher.get_due_ids(self.now + slot * 300) for slot in range(12)]
+
+        self.assertEqual(sum(1 in ids for ids in due), 12)
+        self.assertEqual(sum(2 in ids for ids in due), 1)
+
+    def test_items_that_stopped_rising_are_not_hot(self):
+        # 500 points in 20 hours, but none in the last hour
+        self.write(1, age=20 * 3600, score=500)
+        self.refresher.record_scores([{"id": 1, "score": 500}], self.now - 3600)
+        self.refresher.record_scores([{"id": 1, "score": 500}], self.now)
+
+        due = [self.refresher.get_due_ids(self.now + slot * 300) for slot in range(12)]
+
+        self.assertEqual(sum(1 in ids for ids in due), 1)
+        self.assertEqual(ScoreSample.objects.get(id=1).velocity, 0)
+
+    def test_fastest_tiers_come_first_within_the_budget(self):
+        self.refresher.max_items = 2
+        self.write(1, age=5 * 3600, score=500)
+        self.sample({1: 500})
+        self.write(2, age=600)
+        self.write(3, age=60)
+
+        self.assertEqual(self.refresher.get_due_ids(self.now), [3, 2])
+
+    def test_refreshed_items_are_upserted(self):
+        self.write(1, age=600)
+        fetcher = ThreadFetcher([{"id": 1, "by": "pg", "type": "story", "title": "Title",
+                                  "score": 42, "descendants": 3, "kids": [7]}])
+
+        with mock.patch("hnservice.refresh.time.time", return_value=self.now):
+            refreshed = async_to_sync(ScoreRefresher(interval=300).run)(fetcher)
+
+        self.assertEqual(refreshed, 1)
+        self.assertEqual(fetcher.requested, [1])
+        self.assertEqual(Story.objects.get(id=1).score, 42)
+        self.assertEqual(FeedEntry.objects.get(id=1).score, 42)
+        self.assertEqual(ScoreSample.objects.get(id=1).score, 42)
+
+
+class TestSyncLease(TestCase):
+
+    def test_only_one_holder_at_a_time(self):
+        self.assertTrue(SyncLease.acquire("feeds", "a", 60))
+        self.assertFalse(SyncLease.acquire("feeds", "b", 60))
+        self.assertTrue(SyncLease.acquire("feeds", "a", 60))
+        self.assertTrue(SyncLease.acquire("scores", "b", 60))
+
+    def test_expired_lease_is_taken_over(self):
+        SyncLease.acquire("feeds", "a", 60)
+        SyncLease.objects.filter(name="feeds").update(
+            expires=timezone.now() - timedelta(seconds=1))
+
+        self.assertTrue(SyncLease.acquire("feeds", "b", 60))
+        self.assertEqual(SyncLease.objects.get(name="feeds").holder, "b")
+
+    def test_released_lease_is_free(self):
+        SyncLease.acquire("feeds", "a", 60)
+
+        self.assertFalse(SyncLease.release("feeds", "b"))
+        self.assertTrue(SyncLease.release("feeds", "a"))
+        self.assertTrue(SyncLease.acquire("feeds", "b", 60))
+
+
+class TestSyncWorkerLease(TransactionTestCase):
+    """ The worker reaches the DB from its own thread, which has to see
+    the lease committed by the test """
+
+    def test_worker_skips_jobs_held_elsewhere(self):
+        runs = []
+
+        def job(name):
+            async def run(fetcher, writer, profiles):
+                runs.append(name)
+            return PeriodicJob(name, 60, run)
+
+        SyncLease.acquire("feeds", "other-process", 60)
+        worker = SyncWorker(jobs=[job("feeds"), job("scores")],
+                            writer=FakeWriter(), fetcher=FakeFetcher())
+
+        async_to_sync(worker.run)(once=True)
+
+        self.assertEqual(runs, ["scores"])
+        self.assertFalse(SyncLease.acquire("feeds", worker.holder, 60))
+        self.assertTrue(SyncLease.acquire("scores", "other-process", 60))
+
+    def test_job_is_cancelled_when_its_lease_is_taken_over(self):
+        runs = []
+
+        async def run(fetcher, writer, profiles):
+            runs.append("started")
+            # Another process takes over, e.g. after this one stalled
+            await sync_to_async(SyncLease.objects.filter(name="feeds").update)(
+                holder="other-process", expires=timezone.now() + timedelta(seconds=60))
+            await asyncio.sleep(5)
+            runs.append("finished")
+
+        worker = SyncWorker(jobs=[PeriodicJob("feeds", 60, run)],
+                            writer=FakeWriter(), fetcher=FakeFetcher())
+        worker.lease_duration = 0.3
+
+        started = time.monotonic()
+        async_to_sync(worker.run)(once=True)
+
+        self.assertEqual(runs, ["started"])
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(SyncLease.objects.get(name="feeds").holder, "other-process")
+
+
+class UpdatesFetcher(ThreadFetcher):
+    """ Serves a fixed /updates.json besides the items """
+
+    def __init__(self, items: list, updates: dict) -> None:
+        super().__init__(items)
+        self.updates = updates
+
+    async def get_updates(self):
+        return self.updates
+
+
+class FakeProfiles():
+
+    def __init__(self) -> None:
+        self.queued = []
+
+    def enqueue(self, user_ids):
+        self.queued.extend(user_ids)
+
+
+class TestUpdateConsumer(TestCase):
+
+    def setUp(self) -> None:
+        User.objects.create(id="pg", created=1160418092, karma=155111)
+        DBWriter().write_items_to_db([
+            {"id": 1, "by": "pg", "type": "story", "title": "Story", "score": 1},
+            {"id": 2, "by": "pg", "type": "comment", "parent": 1, "text": "Reply"},
+        ])
+        self.consumer = UpdateConsumer()
+        self.profiles = FakeProfiles()
+
+    def poll(self, updates, items):
+        fetcher = UpdatesFetcher(items, updates)
+        stats = async_to_sync(self.consumer.run)(fetcher, self.profiles)
+        return stats, fetcher.requested
+
+    def test_stored_changes_are_fetched_and_written(self):
+        stats, requested = self.poll(
+            {"items": [1, 99], "profiles": ["pg", "unknown"]},
+            [{"id": 1, "by": "pg", "type": "story", "title": "Story", "score": 7, "kids": [2]}])
+
+        self.assertEqual(requested, [1])
+        self.assertEqual(self.profiles.queued, ["pg"])
+        self.assertEqual(stats, {"items": 1, "deleted": 0, "profiles": 1})
+        self.assertEqual(Story.objects.get(id=1).score, 7)
+        self.assertEqual(FeedEntry.objects.get(id=1).score, 7)
+
+    def test_only_ids_new_since_the_last_poll_are_fetched(self):
+        story = {"id": 1, "by": "pg", "type": "story", "title": "Story"}
+        self.poll({"items": [1], "profiles": []}, [story])
+
+        stats, requested = self.poll({"items": [1], "profiles": []}, [story])
+        self.assertEqual(requested, [])
+
+        stats, requested = self.poll({"items": [2, 1], "profiles": []},
+                                     [story, {"id": 2, "by": "pg", "type": "comment",
+                                              "parent": 1, "text": "Edited"}])
+        self.assertEqual(requested, [2])
+        self.assertEqual(Comment.objects.get(id=2).text, "Edited")
+
+    def test_deleted_items_are_marked_deleted(self):
+        stats, requested = self.poll(
+            {"items": [2], "profiles": []},
+            [{"id": 2, "type": "comment", "parent": 1, "deleted": True, "time": 1}])
+
+        self.assertEqual(stats["deleted"], 1)
+        comment = Comment.objects.get(id=2)
+        self.assertTrue(comment.deleted)
+        self.assertEqual(comment.text, "")
+        self.assertFalse(FeedEntry.objects.filter(id=2).exists())
+
+    def test_failed_poll_is_not_remembered(self):
+        self.poll(None, [])
+
+        self.assertFalse(UpdatesPoll.objects.exists())
+
+
+class TestFeedRanks(TestCase):
+
+    def test_snapshot_is_one_bulk_insert(self):
+        writer = DBWriter()
+
+        with CaptureQueriesContext(connection) as queries:
+            stored = writer.write_feed_ranks(
+                {"topstories": [3, 1, 2], "askstories": [2], "jobstories": []}, taken_at=100)
+
+        self.assertEqual(stored, 4)
+        inserts = [query for query in queries.captured_queries
+                   if query["sql"].startswith('INSERT INTO "news_feedrank"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(list(FeedRank.objects.filter(feed="topstories").values_list(
+            "rank", "item_id")), [(1, 3), (2, 1), (3, 2)])
+
+    def test_expired_snapshots_are_pruned(self):
+        writer = DBWriter()
+        writer.write_feed_ranks({"topstories": [1], "askstories": [1]}, taken_at=100)
+        writer.write_feed_ranks({"topstories": [2], "askstories": [2]}, taken_at=200)
+
+        with self.settings(HN_FEED_RANK_RETENTION=150):
+            writer.write_feed_ranks({"topstories": [3], "askstories": []}, taken_at=300)
+
+        self.assertEqual(sorted(FeedRank.objects.filter(feed="topstories").values_list(
+            "taken_at", flat=True)), [200, 300])
+        # A feed that could not be read keeps its snapshots
+        self.assertEqual(FeedRank.objects.filter(feed="askstories").count(), 2)
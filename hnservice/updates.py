@@ -0,0 +1,106 @@
+# Change feed consumer: HackNews lists the items and profiles changed
+# lately in /updates.json, only those are fetched again
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+# Initialize logging
+import logging
+file_logger = logging.getLogger(__name__)
+
+from news.lookups import filter_in
+from news.models import FeedEntry, User
+from .api_service import HNFetcher
+from .db_service import DBWriter
+from .models import UpdatesPoll
+from .profiles import ProfileQueue
+
+
+class UpdateConsumer():
+    """
+    Polls /updates.json and compares it with the previous poll, stored in
+    UpdatesPoll. Ids that were not listed last time are new changes: the
+    stored ones among them are fetched again and upserted with the
+    DBWriter, deleted items are marked deleted, and stored users are
+    handed to the ProfileQueue. Items that are not stored yet are left to
+    the catch-up sync.
+
+    Methods
+    -------
+    run(fetcher: HNFetcher, profiles: ProfileQueue)
+        Poll the updates once and apply the new changes
+    get_changes(updates: dict)
+        The stored item ids and usernames not listed by the last poll
+    """
+
+    def __init__(self, writer: DBWriter = None) -> None:
+        self.writer = writer or DBWriter()
+
+    async def run(self, fetcher: HNFetcher, profiles: ProfileQueue) -> dict:
+        """ Poll the updates and apply the new changes
+
+        Returns
+        -------
+        {'items': int, 'deleted': int, 'profiles': int}
+            How many changed items were written or deleted and how many
+            profiles were queued
+        """
+        stats = {'items': 0, 'deleted': 0, 'profiles': 0}
+
+        updates = await fetcher.get_updates()
+        if not isinstance(updates, dict):
+            file_logger.error("Could not get the updates, skipping the poll")
+            return stats
+
+        item_ids, usernames = await sync_to_async(self.get_changes)(updates)
+
+        items = [item for item in await fetcher.get_items(item_ids) if item]
+        deleted = [item for item in items if item.get('deleted')]
+        changed = [item for item in items if not item.get('deleted')]
+        await sync_to_async(self.writer.write_items_to_db)(changed)
+        stats['deleted'] = await sync_to_async(self.writer.delete_items)(deleted)
+        stats['items'] = len(changed)
+
+        profiles.enqueue(usernames)
+        stats['profiles'] = len(usernames)
+
+        # Only remembered once applied, a failed poll is repeated in full
+        await sync_to_async(self.save_poll)(updates)
+
+        return stats
+
+    def get_changes(self, updates: dict):
+        """ Compare the updates with the last poll
+
+        Returns
+        -------
+        (list, list)
+            The ids of the stored items and the names of the stored users
+            that changed since the last poll
+        """
+        previous = {poll.name: set(json.loads(poll.ids))
+                    for poll in UpdatesPoll.objects.all()}
+
+        item_ids = self.__new(updates, UpdatesPoll.ITEMS, previous)
+        usernames = self.__new(updates, UpdatesPoll.PROFILES, previous)
+
+        return (sorted(self.__stored(FeedEntry, item_ids)),
+                sorted(self.__stored(User, usernames)))
+
+    def save_poll(self, updates: dict):
+        with transaction.atomic():
+            for name in (UpdatesPoll.ITEMS, UpdatesPoll.PROFILES):
+                UpdatesPoll.objects.update_or_create(
+                    name=name, defaults={'ids': json.dumps(updates.get(name) or [])})
+
+    def __new(self, updates: dict, name: str, previous: dict) -> list:
+        return [key for key in updates.get(name) or []
+                if key not in previous.get(name, ())]
+
+    def __stored(self, model, keys: list) -> set:
+        stored = set()
+        for chunk in filter_in(model.objects, 'pk', keys):
+            stored.update(chunk.values_list('pk', flat=True))
+
+        return stored
@@ -0,0 +1,202 @@
+# Long running sync process: the periodic jobs of hnservice.tasks share
+# one event loop, one HTTP session and one DB connection
+import asyncio
+import os
+import signal
+import socket
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+# Initialize logging
+import logging
+file_logger = logging.getLogger(__name__)
+
+from . import tasks
+from .api_service import HNFetcher
+from .db_service import DBWriter
+from .models import SyncLease
+from .profiles import ProfileQueue
+
+
+class PeriodicJob():
+    """
+    A job of the sync worker
+
+    Attributes
+    ----------
+    name : str
+        The name the job is selected and logged with
+    interval : float
+        Seconds between the start of two runs
+    run : coroutine function
+        Called with the worker's fetcher, writer and profile queue
+    """
+
+    def __init__(self, name: str, interval: float, run) -> None:
+        self.name = name
+        self.interval = interval
+        self.run = run
+
+    def __str__(self) -> str:
+        return f"{self.name} every {self.interval}s"
+
+
+def get_default_jobs() -> list:
+    """ The feed refresh, the new item catch-up, the score refresh and
+    the change feed, with the intervals of the settings """
+    return [
+        PeriodicJob('feeds', getattr(settings, 'HN_SYNC_FEED_INTERVAL', 300),
+                    tasks.refresh_feeds),
+        PeriodicJob('catch-up', getattr(settings, 'HN_SYNC_CATCHUP_INTERVAL', 60),
+                    tasks.catch_up),
+        PeriodicJob('scores', getattr(settings, 'HN_SYNC_SCORE_INTERVAL', 300),
+                    tasks.refresh_scores),
+        PeriodicJob('updates', getattr(settings, 'HN_SYNC_UPDATES_INTERVAL', 30),
+                    tasks.consume_updates),
+    ]
+
+
+class SyncWorker():
+    """
+    Runs every job on its own schedule until stopped. The jobs share the
+    worker's HNFetcher, so its connection pool stays warm between runs,
+    and its ProfileQueue. A failing job is logged and run again at its
+    next interval, it does not stop the other jobs.
+
+    A job only runs while the worker holds its SyncLease, renewed every
+    third of HN_SYNC_LEASE_DURATION, so across processes a job runs once
+    at a time and another process takes over within one lease period if
+    the holder dies. A run whose lease was taken over, e.g. after the
+    worker stalled past its lease, is cancelled. A run due while the job
+    runs elsewhere is skipped, and a run overrunning its interval is
+    followed by a single next run, so late cycles coalesce instead of
+    piling up.
+
+    Methods
+    -------
+    run(once: bool = False)
+        Run the jobs until stop() is called, or every job once
+    stop()
+        Let the running jobs finish and return from run()
+    """
+
+    def __init__(self, jobs: list = None, writer: DBWriter = None,
+                 fetcher: HNFetcher = None) -> None:
+        self.jobs = jobs if jobs is not None else get_default_jobs()
+        self.writer = writer or DBWriter()
+        self.fetcher = fetcher
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_duration = getattr(settings, 'HN_SYNC_LEASE_DURATION', 90)
+        self.__stopping = None
+
+    async def run(self, once: bool = False):
+        """ Run the jobs
+
+        Parameters
+        ----------
+        once : bool
+            Run every job a single time and return, instead of repeating
+            them until stop() is called
+        """
+        if self.fetcher is None:
+            async with HNFetcher() as fetcher:
+                self.fetcher = fetcher
+                try:
+                    return await self.run(once)
+                finally:
+                    self.fetcher = None
+
+        self.__stopping = asyncio.Event()
+        profiles = ProfileQueue(self.fetcher, writer=self.writer)
+        profiles.start()
+        file_logger.info(f"Sync worker started: {', '.join(map(str, self.jobs))}")
+
+        try:
+            await asyncio.gather(*(self.__schedule(job, profiles, once)
+                                   for job in self.jobs))
+        finally:
+            await profiles.join()
+            await profiles.stop()
+            file_logger.info("Sync worker stopped")
+
+    def stop(self):
+        if self.__stopping is not None:
+            self.__stopping.set()
+
+    def handle_signals(self):
+        """ Stop on SIGINT and SIGTERM, from within the running loop """
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+
+    async def __schedule(self, job: PeriodicJob, profiles: ProfileQueue, once: bool):
+        while not self.__stopping.is_set():
+            started = time.monotonic()
+            await self.__run_job(job, profiles)
+            if once:
+                return
+
+            delay = max(job.interval - (time.monotonic() - started), 0)
+            try:
+                await asyncio.wait_for(self.__stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def __run_job(self, job: PeriodicJob, profiles: ProfileQueue):
+        # The connection is kept between runs, unless it broke or outlived
+        # CONN_MAX_AGE
+        await sync_to_async(close_old_connections)()
+        started = time.monotonic()
+
+        try:
+            if not await self.__acquire(job):
+                file_logger.info(f"Sync job {job.name} is running elsewhere, skipping")
+                return
+
+            # The job runs as its own task, so the heartbeat can cancel it
+            # when another process took the lease over
+            run = asyncio.ensure_future(job.run(self.fetcher, self.writer, profiles))
+            heartbeat = asyncio.ensure_future(self.__renew(job, run))
+            try:
+                result = await run
+                # Profiles fetched during the run are not held until the
+                # worker stops
+                await profiles.flush()
+            except asyncio.CancelledError:
+                if not heartbeat.done() or heartbeat.cancelled():
+                    raise
+                file_logger.error(f"Sync job {job.name} cancelled, "
+                                  "its lease was lost to another process")
+                return
+            finally:
+                heartbeat.cancel()
+                await sync_to_async(SyncLease.release)(job.name, self.holder)
+        except Exception:
+            file_logger.exception(f"Sync job {job.name} failed")
+        else:
+            file_logger.info(f"Sync job {job.name} finished in "
+                             f"{time.monotonic() - started:.2f}s: {result}")
+
+    async def __acquire(self, job: PeriodicJob) -> bool:
+        return await sync_to_async(SyncLease.acquire)(
+            job.name, self.holder, self.lease_duration)
+
+    async def __renew(self, job: PeriodicJob, run: asyncio.Future):
+        """ Renew the lease until the job ends, and cancel the job as soon
+        as the lease belongs to another process, which may run it already """
+        while True:
+            await asyncio.sleep(self.lease_duration / 3)
+            try:
+                acquired = await self.__acquire(job)
+            except Exception:
+                # The lease still runs until it expires, try again then
+                file_logger.exception(f"Could not renew the lease of sync job {job.name}")
+                continue
+
+            if not acquired:
+                run.cancel()
+                return
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+
+from hnservice.models import SyncState
+
+
+def item_version(item) -> str:
+    """ A short digest of the fields HackNews changes after an item was
+    published, so a cached fragment of the item is replaced once the
+    sync updates any of them """
+    state = '|'.join(str(getattr(item, field, '')) for field in
+                     ('score', 'descendants', 'title', 'snippet'))
+
+    return hashlib.md5(state.encode()).hexdigest()[:12]
+
+
+class LRUFileBasedCache(FileBasedCache):
+    """
+    A FileBasedCache that culls the least recently used entries rather
+    than a random sample: every hit touches its file, and a full cache
+    drops the files touched longest ago.
+    """
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, self, version)
+        if value is self:
+            return default
+
+        try:
+            os.utime(self._key_to_file(key, version))
+        except OSError:
+            # Removed by another process meanwhile
+            pass
+
+        return value
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+
+        def last_used(fname):
+            try:
+                return os.path.getmtime(fname)
+            except OSError:
+                return 0
+
+        filelist.sort(key=last_used)
+        for fname in filelist[:int(num_entries / self._cull_frequency)]:
+            self._delete(fname)
+
+
+class GenerationalCache():
+    """
+    Base of the caches whose entries are all dropped at once when new
+    items are written: every key holds the version of the stored items,
+    SyncState.ITEMS, which every committed batch advances. The version is
+    kept in the database, where no eviction of the cache can lose it and
+    revive the entries of an old one. Entries of old versions are left to
+    expire with the backend's TTL and eviction.
+
+    Methods
+    -------
+    generation()
+        Get the current generation
+    invalidate()
+        Start a new generation, e.g. after new items were written
+    """
+
+    # Setting naming the cache alias to use
+    ALIAS_SETTING = ''
+
+    def __init__(self) -> None:
+        self.__generation = None
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, self.ALIAS_SETTING, 'default')]
+
+    def generation(self) -> int:
+        # Read once per instance, e.g. per request, so a page rendered
+        # while a batch commits is stored under the version it was read at
+        if self.__generation is None:
+            self.__generation = SyncState.objects.filter(
+                name=SyncState.ITEMS).values_list('value', flat=True).first() or 0
+
+        return self.__generation
+
+    def invalidate(self):
+        SyncState.advance(SyncState.ITEMS)
+        self.__generation = None
+
+
+class SearchCache(GenerationalCache):
+    """
+    Caches the ids of a page of search results, keyed on the normalized
+    query, the type filter and the page number. The HN service starts a
+    new generation whenever it commits a batch, so cached results are
+    never older than the last sync. The cache alias is named by
+    SEARCH_CACHE_ALIAS.
+
+    Methods
+    -------
+    get_or_search(query: str, item_type: str, page: int, search: callable)
+        Get the cached ids of a page or compute them with search()
+    """
+
+    ALIAS_SETTING = 'SEARCH_CACHE_ALIAS'
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """ Reduce a query to what the index matches on: its lowercase
+        words, in order """
+        return ' '.join(re.findall(r"\w+", (query or '').lower()))
+
+    def key(self, query: str, item_type: str, page: int) -> str:
+        digest = hashlib.md5(
+            f"{self.normalize(query)}|{item_type or ''}|{page}".encode()).hexdigest()
+        return f"search:{self.generation()}:{digest}"
+
+    def get_or_search(self, query: str, item_type: str, page: int, search) -> list:
+        """ Get the cached ids of a page of results
+
+        Parameters
+        ----------
+        query, item_type, page
+            What identifies the page
+        search : callable
+            Computes the ids of the page on a cache miss
+
+        Returns
+        -------
+        list
+            The ids of the page
+        """
+        key = self.key(query, item_type, page)
+        ids = self.cache.get(key)
+
+        if ids is None:
+            ids = search()
+            self.cache.set(key, ids)
+
+        return ids
+
+
+class PageCache(GenerationalCache):
+    """
+    Caches rendered list pages by their full path, so a hot page costs
+    one lookup of the generation and no template work until the HN
+    service commits a batch and so starts a new generation. The items' "news-info" fragments
+    are cached in the same alias, named by FRAGMENT_CACHE_ALIAS, by item
+    id and item_version(), and outlive the generations.
+
+    Methods
+    -------
+    get(path: str)
+        Get the cached content of a page
+    set(path: str, content: bytes)
+        Cache the content of a page
+    """
+
+    ALIAS_SETTING = 'FRAGMENT_CACHE_ALIAS'
+
+    def key(self, path: str) -> str:
+        digest = hashlib.md5(path.encode()).hexdigest()
+        return f"page:{self.generation()}:{digest}"
+
+    def get(self, path: str):
+        return self.cache.get(self.key(path))
+
+    def set(self, path: str, content: bytes):
+        self.cache.set(self.key(path), content)
@@ -0,0 +1,47 @@
+# Chunked id lookups shared by the pages, the API and the HN service
+
+# Ids per query and rows per statement, kept below SQLite's limit on query
+# parameters (999 before SQLite 3.32)
+BATCH_SIZE = 500
+
+
+def chunks(values, size: int = BATCH_SIZE):
+    """ Split the values into lists of at most size values, one per query
+
+    Parameters
+    ----------
+    values : Iterable
+        The ids, or rows, to split
+    size : int
+        The most values per list
+
+    Yields
+    ------
+    list
+        The next chunk of values
+    """
+    values = list(values)
+    for offset in range(0, len(values), size):
+        yield values[offset:offset + size]
+
+
+def filter_in(queryset, field: str, ids):
+    """ Filter the queryset on field__in with one query per chunk of ids,
+    e.g. `for chunk in filter_in(Comment.objects, 'id', ids)`
+
+    Parameters
+    ----------
+    queryset : QuerySet or Manager
+        What to filter, with any other filters applied already
+    field : str
+        The field to look the ids up in
+    ids : Iterable
+        The ids to look up
+
+    Yields
+    ------
+    QuerySet
+        The queryset filtered on the next chunk of ids
+    """
+    for chunk in chunks(ids):
+        yield queryset.filter(**{f'{field}__in': chunk})
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.db import connection
+
+# Initialize logging
+import logging
+file_logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """ A request ran more queries than its view allows """
+
+
+class QueryBudgetMiddleware():
+    """
+    Counts the queries run while a request is handled and raises
+    QueryBudgetExceeded when a view goes over its budget, so an N+1
+    pattern fails loudly instead of slowing pages down unnoticed.
+    A view declares its budget in a `query_budget` attribute; other views
+    get HN_QUERY_BUDGET and None means no limit. The check only runs when
+    HN_QUERY_BUDGET_CHECK is on, i.e. in debug and test runs.
+    """
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'HN_QUERY_BUDGET_CHECK', settings.DEBUG):
+            return self.get_response(request)
+
+        request.query_count = 0
+
+        def count_query(execute, sql, params, many, context):
+            request.query_count += 1
+            return execute(sql, params, many, context)
+
+        # Template responses are rendered within get_response(), their
+        # lazy querysets are counted too
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None and request.query_count > budget:
+            message = (f"{request.path} ran {request.query_count} queries, "
+                       f"its budget is {budget}")
+            file_logger.error(message)
+            raise QueryBudgetExceeded(message)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', view_func)
+        request.query_budget = getattr(
+            view_class, 'query_budget', getattr(settings, 'HN_QUERY_BUDGET', None))
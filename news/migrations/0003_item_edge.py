@@ -0,0 +1,65 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:28
+
+from django.db import migrations, models
+import json
+
+
+def parse_ids(text):
+    """ Read an id list stored as text, e.g. "[8952, 8876]" """
+    try:
+        ids = json.loads(text) if text else []
+    except ValueError:
+        return []
+    return ids if isinstance(ids, list) else []
+
+
+def backfill_edges(apps, schema_editor):
+    ItemEdge = apps.get_model('news', 'ItemEdge')
+    sources = [(model_name, 'kids', 'comment')
+               for model_name in ('Comment', 'Job', 'Poll', 'PollOption', 'Story')]
+    sources.append(('Poll', 'parts', 'pollopt'))
+
+    for model_name, field, child_type in sources:
+        model = apps.get_model('news', model_name)
+        edges = [ItemEdge(parent_id=parent_id, child_id=child_id,
+                          position=position, child_type=child_type)
+                 for parent_id, ids in model.objects.exclude(**{f'{field}__isnull': True})
+                 .values_list('id', field).iterator()
+                 for position, child_id in enumerate(parse_ids(ids))]
+        ItemEdge.objects.bulk_create(edges, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0002_auto_20211115_2215'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemEdge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('parent_id', models.PositiveIntegerField()),
+                ('child_id', models.PositiveIntegerField()),
+                ('position', models.PositiveIntegerField()),
+                ('child_type', models.CharField(choices=[('comment', 'Comment'), ('story', 'Story'), ('job', 'Job'), ('poll', 'Poll'), ('pollopt', 'Poll Option')], default='comment', max_length=15)),
+            ],
+            options={
+                'ordering': ['parent_id', 'position'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='itemedge',
+            index=models.Index(fields=['parent_id', 'position'], name='news_itemed_parent__1bdb77_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='itemedge',
+            index=models.Index(fields=['child_id'], name='news_itemed_child_i_d38b03_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='itemedge',
+            constraint=models.UniqueConstraint(fields=('parent_id', 'child_id'), name='unique_item_edge'),
+        ),
+        migrations.RunPython(backfill_edges, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:29
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def backfill_feed(apps, schema_editor):
+    FeedEntry = apps.get_model('news', 'FeedEntry')
+
+    for model_name in ('Comment', 'Job', 'Poll', 'PollOption', 'Story'):
+        model = apps.get_model('news', model_name)
+        field_names = {field.name for field in model._meta.get_fields()}
+        entries = [FeedEntry(id=item.id, type=item.type, by=item.by_id,
+                             time=item.time,
+                             score=getattr(item, 'score', None),
+                             title=getattr(item, 'title', ''),
+                             text=Truncator(item.text or '').words(20, html=True))
+                   for item in model.objects.only(
+                       *({'id', 'type', 'by', 'time', 'score', 'title', 'text'} & field_names)
+                   ).iterator()]
+        FeedEntry.objects.bulk_create(entries, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0003_item_edge'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.PositiveIntegerField(editable=False, primary_key=True, serialize=False)),
+                ('type', models.CharField(choices=[('comment', 'Comment'), ('story', 'Story'), ('job', 'Job'), ('poll', 'Poll'), ('pollopt', 'Poll Option')], max_length=15)),
+                ('by', models.CharField(max_length=100)),
+                ('time', models.PositiveIntegerField(blank=True, null=True)),
+                ('score', models.PositiveIntegerField(blank=True, null=True)),
+                ('title', models.CharField(blank=True, max_length=100)),
+                ('text', models.CharField(blank=True, max_length=1000)),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['type', '-id'], name='news_feeden_type_ffd5b5_idx'),
+        ),
+        migrations.RunPython(backfill_feed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+from django.db import migrations
+from django.utils.html import strip_tags
+
+
+# Frozen copy of the index as news.search created it at this migration,
+# later changes to that module must not change what this migration does
+TABLE = 'news_searchindex'
+
+# Documents per statement, kept below SQLite's limit on query parameters
+BATCH_SIZE = 200
+
+
+def create_search_index(apps, schema_editor):
+    """ Create the full-text index of the database in use, an FTS5 table
+    on SQLite or a tsvector column with a GIN index on PostgreSQL, and
+    index every stored item """
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            "title, text, type UNINDEXED, tokenize = 'porter unicode61')")
+        insert = f"INSERT INTO {TABLE} (rowid, type, title, text) VALUES (%s, %s, %s, %s)"
+
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+            "item_id integer PRIMARY KEY, type varchar(15) NOT NULL, "
+            "document tsvector NOT NULL)")
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TABLE}_document ON {TABLE} USING GIN (document)")
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TABLE}_type ON {TABLE} (type)")
+        insert = (f"INSERT INTO {TABLE} (item_id, type, document) VALUES (%s, %s, "
+                  "setweight(to_tsvector('english', %s), 'A') || "
+                  "setweight(to_tsvector('english', %s), 'B')) "
+                  "ON CONFLICT (item_id) DO NOTHING")
+
+    else:
+        # Other databases are searched by scanning the tables
+        return
+
+    documents = []
+    for model_name in ('Comment', 'Job', 'Poll', 'PollOption', 'Story'):
+        model = apps.get_model('news', model_name)
+        has_title = 'title' in {field.name for field in model._meta.fields}
+        fields = ['id', 'type', 'title', 'text'] if has_title else ['id', 'type', 'text']
+
+        for row in model.objects.values_list(*fields).iterator():
+            item_id, item_type, *content = row
+            title, text = content if has_title else ('', content[0])
+            documents.append((item_id, item_type, title or '', strip_tags(text or '')))
+
+    with schema_editor.connection.cursor() as cursor:
+        for offset in range(0, len(documents), BATCH_SIZE):
+            cursor.executemany(insert, documents[offset:offset + BATCH_SIZE])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0004_feed_entry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,164 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:36
+
+from html import unescape
+from html.parser import HTMLParser
+
+from django.db import migrations, models
+from django.utils.html import escape, strip_tags
+from django.utils.text import Truncator
+
+
+# Frozen copy of news.snippets as it was at this migration, later changes
+# to that module must not change what this migration backfills
+SNIPPET_WORDS = 20
+
+EXCERPT_LENGTH = 200
+
+ALLOWED_TAGS = {'a', 'b', 'code', 'em', 'i', 'p', 'pre', 'strong'}
+
+DROPPED_TAGS = {'script', 'style'}
+
+
+class Sanitizer(HTMLParser):
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+        if tag not in ALLOWED_TAGS or self.dropping:
+            return
+
+        if tag == 'a':
+            href = dict(attrs).get('href') or ''
+            if href.startswith(('http://', 'https://')):
+                self.parts.append(f'<a href="{escape(href)}" rel="nofollow">')
+            else:
+                self.parts.append('<a>')
+        else:
+            self.parts.append(f'<{tag}>')
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+        elif tag in ALLOWED_TAGS and not self.dropping:
+            self.parts.append(f'</{tag}>')
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(escape(data))
+
+
+def sanitize_html(text: str) -> str:
+    sanitizer = Sanitizer()
+    sanitizer.feed(text or '')
+    sanitizer.close()
+
+    return ''.join(sanitizer.parts)
+
+
+def make_snippet(text: str) -> str:
+    return Truncator(sanitize_html(text)).words(SNIPPET_WORDS, html=True)
+
+
+def make_excerpt(text: str) -> str:
+    plain = unescape(strip_tags((text or '').replace('<p>', ' <p>')))
+
+    return Truncator(' '.join(plain.split())).chars(EXCERPT_LENGTH)
+
+
+def backfill_snippets(apps, schema_editor):
+    FeedEntry = apps.get_model('news', 'FeedEntry')
+    feed_ids = set(FeedEntry.objects.values_list('id', flat=True))
+
+    for model_name in ('Comment', 'Job', 'Poll', 'PollOption', 'Story'):
+        model = apps.get_model('news', model_name)
+        items = []
+        for item in model.objects.only('id', 'text').iterator():
+            item.snippet = make_snippet(item.text)
+            item.excerpt = make_excerpt(item.text)
+            items.append(item)
+
+        model.objects.bulk_update(items, ['snippet', 'excerpt'], batch_size=500)
+        FeedEntry.objects.bulk_update(
+            [FeedEntry(id=item.id, snippet=item.snippet, excerpt=item.excerpt)
+             for item in items if item.id in feed_ids],
+            ['snippet', 'excerpt'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0005_search_index'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='feedentry',
+            name='text',
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='excerpt',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='snippet',
+            field=models.CharField(blank=True, max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='excerpt',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='snippet',
+            field=models.CharField(blank=True, max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='excerpt',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='snippet',
+            field=models.CharField(blank=True, max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='excerpt',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='snippet',
+            field=models.CharField(blank=True, max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='polloption',
+            name='excerpt',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='polloption',
+            name='snippet',
+            field=models.CharField(blank=True, max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='excerpt',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='snippet',
+            field=models.CharField(blank=True, max_length=1000),
+        ),
+        migrations.RunPython(backfill_snippets, migrations.RunPython.noop),
+    ]
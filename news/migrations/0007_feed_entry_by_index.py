@@ -0,0 +1,17 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0006_item_snippets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['by', '-id'], name='news_feeden_by_0108e6_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_local_items(apps, schema_editor):
+    # Items posted before the field existed got ids from the local range
+    local_start = getattr(settings, 'HN_LOCAL_ID_START', 1000000000)
+
+    for model_name in ('Comment', 'Job', 'Poll', 'PollOption', 'Story'):
+        model = apps.get_model('news', model_name)
+        model.objects.filter(id__gte=local_start).update(source='local')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0007_feed_entry_by_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='source',
+            field=models.CharField(choices=[('hn', 'Hacker News'), ('local', 'Local')], db_index=True, default='hn', max_length=5),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='source',
+            field=models.CharField(choices=[('hn', 'Hacker News'), ('local', 'Local')], db_index=True, default='hn', max_length=5),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='source',
+            field=models.CharField(choices=[('hn', 'Hacker News'), ('local', 'Local')], db_index=True, default='hn', max_length=5),
+        ),
+        migrations.AddField(
+            model_name='polloption',
+            name='source',
+            field=models.CharField(choices=[('hn', 'Hacker News'), ('local', 'Local')], db_index=True, default='hn', max_length=5),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='source',
+            field=models.CharField(choices=[('hn', 'Hacker News'), ('local', 'Local')], db_index=True, default='hn', max_length=5),
+        ),
+        migrations.RunPython(mark_local_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0008_item_source'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['type', 'time'], name='news_feeden_type_df60c2_idx'),
+        ),
+    ]
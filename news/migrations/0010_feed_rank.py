@@ -0,0 +1,31 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0009_feed_entry_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedRank',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feed', models.CharField(choices=[('topstories', 'Top'), ('askstories', 'Ask HN'), ('showstories', 'Show HN'), ('jobstories', 'Hiring')], max_length=15)),
+                ('taken_at', models.PositiveIntegerField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('item', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='news.feedentry')),
+            ],
+            options={
+                'ordering': ['feed', '-taken_at', 'rank'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='feedrank',
+            constraint=models.UniqueConstraint(fields=('feed', 'taken_at', 'rank'), name='unique_feed_rank'),
+        ),
+    ]
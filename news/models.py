@@ -1,6 +1,8 @@
 from django.db import models
 from django.db.models.query_utils import Q
 from django.urls import reverse
+
+from .cache import item_version
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 
@@ -15,6 +17,9 @@ class User(models.Model):
     about = models.CharField(max_length=500, blank=True)
     submitted = models.TextField(blank=True)
 
+    def __str__(self) -> str:
+        return self.id
+
 
 class Base(models.Model):
     """ Encapsulates the core generic fields all news items share in common"""
@@ -37,16 +42,33 @@ class Base(models.Model):
     type = models.CharField(
         choices=ITEM_TYPES, max_length=15, null=False, default=COMMENT)
 
+    # Where the item comes from. Only local items, created through the
+    # API, can be changed or deleted through it.
+    HN = 'hn'
+    LOCAL = 'local'
+
+    SOURCES = ((HN, 'Hacker News'),
+               (LOCAL, 'Local'))
+    source = models.CharField(choices=SOURCES, max_length=5, default=HN, db_index=True)
+
     by = models.ForeignKey(User, on_delete=models.CASCADE)
     time = models.PositiveIntegerField(null=True, blank=True)
     dead = models.BooleanField(default=False)
     kids = models.TextField(blank=True, null=True)
     text = models.CharField(max_length=5000, blank=True)
 
+    # Derived from text when the item is written, read by the lists
+    snippet = models.CharField(max_length=1000, blank=True)
+    excerpt = models.CharField(max_length=200, blank=True)
+
     class Meta:
         abstract = True
         ordering = ['-id']
 
+    @property
+    def cache_version(self) -> str:
+        return item_version(self)
+
 
 class Comment(Base):
     """ Encapsulates a comment. It usually has a Story or Poll parent. 
@@ -124,3 +146,130 @@ class Story(Base):
 
     def get_absolute_url(self):
         return reverse("story_detail", kwargs={"pk": self.pk})
+
+
+class ItemEdge(models.Model):
+    """ Links an item to one of its kids, or a poll to one of its parts.
+    The ordered id lists HackNews sends in `kids` and `parts` are stored
+    here one row per child, so the children of any set of items are one
+    indexed query away.
+    """
+
+    parent_id = models.PositiveIntegerField()
+    child_id = models.PositiveIntegerField()
+    position = models.PositiveIntegerField()
+    child_type = models.CharField(choices=Base.ITEM_TYPES, max_length=15,
+                                  default=Base.COMMENT)
+
+    class Meta:
+        ordering = ['parent_id', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['parent_id', 'child_id'],
+                                    name='unique_item_edge'),
+        ]
+        indexes = [
+            models.Index(fields=['parent_id', 'position']),
+            models.Index(fields=['child_id']),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.parent_id} -> {self.child_id}"
+
+    @staticmethod
+    def children_of(parent_ids, child_type: str = None) -> dict:
+        """ Get the ordered children of many items in one query
+
+        Returns
+        -------
+        {int: [int]}
+            The children's ids of every parent that has any
+        """
+        edges = ItemEdge.objects.filter(parent_id__in=list(parent_ids))
+        if child_type is not None:
+            edges = edges.filter(child_type=child_type)
+
+        children = {}
+        for parent_id, child_id in edges.values_list('parent_id', 'child_id'):
+            children.setdefault(parent_id, []).append(child_id)
+
+        return children
+
+
+class FeedEntry(models.Model):
+    """ A denormalized row per news item of any type, kept in sync by the
+    HN service. The cross-type feed is read from this one table in id
+    order instead of merging the five item tables.
+    """
+
+    URL_NAMES = {
+        Base.COMMENT: 'comment_detail',
+        Base.JOB: 'job_detail',
+        Base.POLL: 'poll_detail',
+        Base.POLLOPT: 'poll_option_detail',
+        Base.STORY: 'story_detail',
+    }
+
+    id = models.PositiveIntegerField(primary_key=True, editable=False)
+    type = models.CharField(choices=Base.ITEM_TYPES, max_length=15)
+    by = models.CharField(max_length=100)
+    time = models.PositiveIntegerField(null=True, blank=True)
+    score = models.PositiveIntegerField(null=True, blank=True)
+    title = models.CharField(max_length=100, blank=True)
+    snippet = models.CharField(max_length=1000, blank=True)
+    excerpt = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['type', '-id']),
+            models.Index(fields=['by', '-id']),
+            models.Index(fields=['type', 'time']),
+        ]
+
+    def __str__(self) -> str:
+        return self.title or self.excerpt
+
+    @property
+    def cache_version(self) -> str:
+        return item_version(self)
+
+    def get_absolute_url(self):
+        return reverse(self.URL_NAMES[self.type], kwargs={"pk": self.pk})
+
+
+class FeedRank(models.Model):
+    """ The rank of an item in a HackNews feed when the feed was last
+    synced. Every sync adds a snapshot of the whole feed, taken at the
+    same Unix time, and older snapshots are pruned after a retention
+    period. Pages of a feed are read by rank from the latest snapshot,
+    joined with the feed entries of the items in the same query.
+    """
+
+    TOP = 'topstories'
+    ASK = 'askstories'
+    SHOW = 'showstories'
+    JOBS = 'jobstories'
+    FEEDS = [
+        (TOP, 'Top'),
+        (ASK, 'Ask HN'),
+        (SHOW, 'Show HN'),
+        (JOBS, 'Hiring'),
+    ]
+
+    feed = models.CharField(choices=FEEDS, max_length=15)
+    taken_at = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+    # Items that are not stored (yet) have no feed entry and are left out
+    # of the pages by the join
+    item = models.ForeignKey(FeedEntry, on_delete=models.DO_NOTHING,
+                             db_constraint=False, db_index=False, related_name='+')
+
+    class Meta:
+        ordering = ['feed', '-taken_at', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['feed', 'taken_at', 'rank'],
+                                    name='unique_feed_rank'),
+        ]
+
+    def __str__(self) -> str:
+        return f"#{self.rank} of {self.feed} at {self.taken_at}: {self.item_id}"
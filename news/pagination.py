@@ -0,0 +1,178 @@
+from django.db import models
+from django.http import Http404
+
+
+class KeysetPage():
+    """ A page of items seeked by primary key instead of counted offsets.
+    Every page costs one indexed range query, however deep it is, and no
+    COUNT(*) is needed.
+
+    Attributes
+    ----------
+    object_list : list
+        The items of the page, newest first
+    has_next : bool
+        Whether older items exist, reached with ?before=<next_cursor>
+    has_previous : bool
+        Whether newer items exist, reached with ?after=<previous_cursor>
+    """
+
+    def __init__(self, object_list: list, has_next: bool, has_previous: bool) -> None:
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+    def has_other_pages(self) -> bool:
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        return self.object_list[-1].pk if self.object_list else None
+
+    @property
+    def previous_cursor(self):
+        return self.object_list[0].pk if self.object_list else None
+
+
+def paginate_by_key(queryset: models.QuerySet, page_size: int,
+                    before=None, after=None) -> KeysetPage:
+    """ Get the page of items right before or after a primary key, newest
+    first. One row more than the page is read to know if the page has a
+    neighbour in the direction of the seek.
+
+    Parameters
+    ----------
+    queryset : QuerySet
+        The items to page through
+    page_size : int
+        The number of items per page
+    before : str
+        Get the items older than this primary key
+    after : str
+        Get the items newer than this primary key
+
+    Returns
+    -------
+    KeysetPage
+        The requested page
+    """
+    try:
+        before = int(before) if before else None
+        after = int(after) if after else None
+    except ValueError:
+        raise Http404("Invalid page cursor")
+
+    if after is not None:
+        rows = list(queryset.filter(pk__gt=after).order_by('pk')[:page_size + 1])
+        has_previous = len(rows) > page_size
+        return KeysetPage(rows[:page_size][::-1], has_next=True,
+                          has_previous=has_previous)
+
+    if before is not None:
+        queryset = queryset.filter(pk__lt=before)
+
+    rows = list(queryset.order_by('-pk')[:page_size + 1])
+
+    return KeysetPage(rows[:page_size], has_next=len(rows) > page_size,
+                      has_previous=before is not None)
+
+
+class RankedPage(KeysetPage):
+    """ A page of a ranked feed, seeked by rank instead of primary key.
+    Every item of object_list has the `rank` it is listed at.
+    """
+
+    @property
+    def next_cursor(self):
+        return self.object_list[-1].rank if self.object_list else None
+
+    @property
+    def previous_cursor(self):
+        return self.object_list[0].rank if self.object_list else None
+
+
+def paginate_by_rank(queryset: models.QuerySet, page_size: int,
+                     before=None, after=None) -> RankedPage:
+    """ Get the page of ranked items right before or after a rank, top
+    first. The ranks are seeked on their index, however deep the page,
+    and their items come joined in the same query.
+
+    Parameters
+    ----------
+    queryset : QuerySet
+        The FeedRank rows of one snapshot
+    page_size : int
+        The number of items per page
+    before : str
+        Get the items ranked higher than this rank
+    after : str
+        Get the items ranked lower than this rank
+
+    Returns
+    -------
+    RankedPage
+        The items of the requested page
+    """
+    try:
+        before = int(before) if before else None
+        after = int(after) if after else None
+    except ValueError:
+        raise Http404("Invalid page cursor")
+
+    queryset = queryset.select_related('item')
+
+    if before is not None:
+        rows = list(queryset.filter(rank__lt=before).order_by('-rank')[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if after is not None:
+            queryset = queryset.filter(rank__gt=after)
+        rows = list(queryset.order_by('rank')[:page_size + 1])
+        has_previous = after is not None
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+
+    items = []
+    for row in rows:
+        row.item.rank = row.rank
+        items.append(row.item)
+
+    return RankedPage(items, has_next=has_next, has_previous=has_previous)
+
+
+class NumberedPage(KeysetPage):
+    """ A numbered page of results whose total is not counted, e.g. the
+    ranked matches of a search. One result more than the page is read to
+    know if a next page exists.
+    """
+
+    def __init__(self, object_list: list, number: int, has_next: bool) -> None:
+        super().__init__(object_list, has_next=has_next, has_previous=number > 1)
+        self.number = number
+
+    def next_page_number(self) -> int:
+        return self.number + 1
+
+    def previous_page_number(self) -> int:
+        return self.number - 1
+
+
+def get_page_number(page) -> int:
+    """ Read a ?page= parameter, the first page if it is missing """
+    try:
+        number = int(page or 1)
+    except ValueError:
+        raise Http404("Invalid page number")
+
+    if number < 1:
+        raise Http404("Invalid page number")
+
+    return number
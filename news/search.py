@@ -0,0 +1,151 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import strip_tags
+
+from .lookups import chunks
+from .models import Comment, Job, Poll, PollOption, Story
+
+
+TABLE = 'news_searchindex'
+
+
+class SearchIndex():
+    """
+    Full-text index over the title and text of every news item, ranked
+    by relevance. The index is kept in sync by the HN service whenever it
+    writes items.
+
+    Methods
+    -------
+    update(documents: Iterable[(int, str, str, str)])
+        Index or re-index (id, type, title, text) documents
+    remove(item_ids: list)
+        Drop the documents of items
+    search(query: str, item_type: str = None, limit: int, offset: int)
+        Get the ids of the best matches, most relevant first
+    """
+
+    SEARCH_MODELS = (Comment, Job, Poll, PollOption, Story)
+
+    @property
+    def vendor(self) -> str:
+        return connection.vendor
+
+    @property
+    def is_indexed(self) -> bool:
+        return self.vendor in ('sqlite', 'postgresql')
+
+    def update(self, documents):
+        """ Index the documents, replacing their previous version
+
+        Parameters
+        ----------
+        documents : Iterable[(int, str, str, str)]
+            The id, type, title and text of every item to index
+        """
+        if not self.is_indexed:
+            return
+
+        documents = [(item_id, item_type, title or '', strip_tags(text or ''))
+                     for item_id, item_type, title, text in documents]
+
+        with connection.cursor() as cursor:
+            for batch in chunks(documents):
+                if self.vendor == 'sqlite':
+                    ids = [document[0] for document in batch]
+                    cursor.execute(
+                        f"DELETE FROM {TABLE} WHERE rowid IN ({', '.join(['%s'] * len(ids))})",
+                        ids)
+                    cursor.executemany(
+                        f"INSERT INTO {TABLE} (rowid, type, title, text) VALUES (%s, %s, %s, %s)",
+                        batch)
+                else:
+                    cursor.executemany(
+                        f"INSERT INTO {TABLE} (item_id, type, document) VALUES (%s, %s, "
+                        "setweight(to_tsvector('english', %s), 'A') || "
+                        "setweight(to_tsvector('english', %s), 'B')) "
+                        "ON CONFLICT (item_id) DO UPDATE SET "
+                        "type = EXCLUDED.type, document = EXCLUDED.document",
+                        batch)
+
+    def remove(self, item_ids: list):
+        """ Drop the documents of the items from the index """
+        if not self.is_indexed:
+            return
+
+        key = 'rowid' if self.vendor == 'sqlite' else 'item_id'
+        with connection.cursor() as cursor:
+            for batch in chunks(item_ids):
+                cursor.execute(
+                    f"DELETE FROM {TABLE} WHERE {key} IN ({', '.join(['%s'] * len(batch))})",
+                    batch)
+
+    def search(self, query: str, item_type: str = None,
+               limit: int = 20, offset: int = 0) -> list:
+        """ Get the ids of the items matching every word of the query
+
+        Parameters
+        ----------
+        query : str
+            The words to look for
+        item_type : str
+            Only match items of this type
+        limit : int
+            The number of ids to return
+        offset : int
+            The number of best matches to skip
+
+        Returns
+        -------
+        list
+            The matching ids, most relevant first
+        """
+        terms = re.findall(r"\w+", query or '')
+        if not terms:
+            return []
+
+        if not self.is_indexed:
+            return self.__scan(terms, item_type)[offset:offset + limit]
+
+        type_filter = "AND type = %s" if item_type else ""
+        type_params = [item_type] if item_type else []
+
+        if self.vendor == 'sqlite':
+            # Quoted terms are matched literally and all of them must match
+            match = ' '.join(f'"{term}"' for term in terms)
+            sql = (f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s {type_filter} "
+                   f"ORDER BY bm25({TABLE}, 10.0, 1.0), rowid DESC LIMIT %s OFFSET %s")
+        else:
+            match = ' '.join(terms)
+            sql = (f"SELECT item_id FROM {TABLE} "
+                   f"WHERE document @@ plainto_tsquery('english', %s) {type_filter} "
+                   f"ORDER BY ts_rank_cd(document, plainto_tsquery('english', %s)) DESC, "
+                   f"item_id DESC LIMIT %s OFFSET %s")
+            type_params += [match]
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match] + type_params + [limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    def __scan(self, terms: list, item_type: str = None) -> list:
+        """ Search the item tables directly, for databases without an
+        index. Newest matches come first. """
+        ids = []
+        for model in self.SEARCH_MODELS:
+            fields = [name for name in ('title', 'text')
+                      if name in {field.name for field in model._meta.fields}]
+
+            matches = model.objects.all()
+            if item_type:
+                matches = matches.filter(type=item_type)
+            for term in terms:
+                condition = Q()
+                for name in fields:
+                    condition |= Q(**{f"{name}__icontains": term})
+                matches = matches.filter(condition)
+
+            ids.extend(matches.values_list('id', flat=True))
+
+        return sorted(ids, reverse=True)
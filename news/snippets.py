@@ -0,0 +1,79 @@
+from html import unescape
+from html.parser import HTMLParser
+
+from django.utils.html import escape, strip_tags
+from django.utils.text import Truncator
+
+
+# Words of an item's text shown in lists
+SNIPPET_WORDS = 20
+
+# Characters of the plain-text excerpt
+EXCERPT_LENGTH = 200
+
+# The markup HackNews allows in comments and story texts
+ALLOWED_TAGS = {'a', 'b', 'code', 'em', 'i', 'p', 'pre', 'strong'}
+
+# Tags whose content is dropped along with them
+DROPPED_TAGS = {'script', 'style'}
+
+
+class Sanitizer(HTMLParser):
+    """ Rebuilds HTML keeping only ALLOWED_TAGS and the http(s) href of
+    links. Every other tag is dropped, text and attributes are escaped.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+        if tag not in ALLOWED_TAGS or self.dropping:
+            return
+
+        if tag == 'a':
+            href = dict(attrs).get('href') or ''
+            if href.startswith(('http://', 'https://')):
+                self.parts.append(f'<a href="{escape(href)}" rel="nofollow">')
+            else:
+                self.parts.append('<a>')
+        else:
+            self.parts.append(f'<{tag}>')
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+        elif tag in ALLOWED_TAGS and not self.dropping:
+            self.parts.append(f'</{tag}>')
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(escape(data))
+
+
+def sanitize_html(text: str) -> str:
+    """ Strip an item's text down to the markup HackNews allows """
+    sanitizer = Sanitizer()
+    sanitizer.feed(text or '')
+    sanitizer.close()
+
+    return ''.join(sanitizer.parts)
+
+
+def make_snippet(text: str) -> str:
+    """ The sanitized first SNIPPET_WORDS words of an item's text, with
+    every tag left open by the cut closed again. Safe to render unescaped.
+    """
+    return Truncator(sanitize_html(text)).words(SNIPPET_WORDS, html=True)
+
+
+def make_excerpt(text: str) -> str:
+    """ The start of an item's text as plain text, e.g. for titles and
+    link previews """
+    # HackNews separates paragraphs with a bare <p>
+    plain = unescape(strip_tags((text or '').replace('<p>', ' <p>')))
+
+    return Truncator(' '.join(plain.split())).chars(EXCERPT_LENGTH)
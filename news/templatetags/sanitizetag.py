@@ -0,0 +1,11 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from news.snippets import sanitize_html
+
+register = template.Library()
+
+@register.filter
+def sanitize(text):
+    """ Render an item's text with only the markup HackNews allows """
+    return mark_safe(sanitize_html(text))
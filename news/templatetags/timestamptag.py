@@ -7,5 +7,5 @@ register = template.Library()
 def to_date(timestamp):
     try:
         return datetime.fromtimestamp(timestamp)
-    except AttributeError as error:
+    except (AttributeError, TypeError) as error:
         pass
\ No newline at end of file
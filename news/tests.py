@@ -1,7 +1,24 @@
-from django.db import models
-from django.test import TestCase
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, models
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls.base import reverse
-from .models import Comment, Job, Poll, PollOption, Story, User
+from .models import (
+    Comment, FeedEntry, FeedRank, ItemEdge, Job, Poll, PollOption, Story, User
+)
+from hnservice.models import SyncState
+from .cache import LRUFileBasedCache, PageCache, SearchCache
+from .lookups import BATCH_SIZE, chunks, filter_in
+from .middleware import QueryBudgetExceeded
+from .search import SearchIndex
+from .snippets import make_excerpt, make_snippet
+from .views import StoryListView
 
 
 class HomePageTests(TestCase):
@@ -127,6 +144,7 @@ class ModelsTests(TestCase):
 class CommentListViewTests(TestCase):
 
     def setUp(self) -> None:
+        PageCache().cache.clear()
         self.comment = Comment.objects.create(id=1, parent=0, by='Gunax',
                                               text="This is required concept", time=1633544861, type='comment')
 
@@ -147,3 +165,466 @@ class CommentListViewTests(TestCase):
         Comment.objects.order_by('-id')
 
         self.assertEqual(Comment.objects.first().id, 2)
+
+
+class NewsListViewTests(TestCase):
+
+    def setUp(self) -> None:
+        PageCache().cache.clear()
+        FeedEntry.objects.bulk_create([
+            FeedEntry(id=1, type="story", by="jl", title="First story"),
+            FeedEntry(id=2, type="comment", by="jl", snippet="A comment"),
+            FeedEntry(id=3, type="job", by="jl", title="A job"),
+        ])
+
+    def test_all_news_lists_every_type_newest_first(self):
+        response = self.client.get(reverse('all_news'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item.id for item in response.context['page_obj']], [3, 2, 1])
+        self.assertContains(response, reverse('comment_detail', kwargs={"pk": 2}))
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self) -> None:
+        PageCache().cache.clear()
+        self.user = User.objects.create(id="jl", created=1173923446, karma=2937)
+        Story.objects.bulk_create([Story(id=item_id, by=self.user, title=f"Story {item_id}")
+                                   for item_id in range(1, 13)])
+
+    def page_ids(self, response):
+        return [item.id for item in response.context['page_obj']]
+
+    def test_first_page_has_newest_items_and_no_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('stories'))
+
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries.captured_queries))
+
+        self.assertEqual(self.page_ids(response), [12, 11, 10, 9, 8])
+        self.assertContains(response, "?before=8")
+        self.assertNotContains(response, "?after=")
+
+    def test_seek_before_and_after(self):
+        response = self.client.get(reverse('stories'), {"before": 8})
+        self.assertEqual(self.page_ids(response), [7, 6, 5, 4, 3])
+        self.assertContains(response, "?after=7")
+
+        response = self.client.get(reverse('stories'), {"after": 7})
+        self.assertEqual(self.page_ids(response), [12, 11, 10, 9, 8])
+        self.assertFalse(response.context['page_obj'].has_previous)
+
+    def test_last_page_has_no_next(self):
+        response = self.client.get(reverse('stories'), {"before": 3})
+
+        self.assertEqual(self.page_ids(response), [2, 1])
+        self.assertFalse(response.context['page_obj'].has_next)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('stories'), {"before": "abc"})
+
+        self.assertEqual(response.status_code, 404)
+
+
+class FeedRankListViewTests(TestCase):
+
+    def setUp(self) -> None:
+        PageCache().cache.clear()
+        FeedEntry.objects.bulk_create([
+            FeedEntry(id=item_id, type="story", by="pg", title=f"Story {item_id}")
+            for item_id in range(1, 10)])
+        # An older snapshot, and the latest one where item 99 is not stored
+        self.snapshot(FeedRank.TOP, 100, [1, 2, 3])
+        self.snapshot(FeedRank.TOP, 200, [9, 99, 8, 7, 6, 5, 4, 3])
+        self.snapshot(FeedRank.ASK, 200, [2, 1])
+
+    def snapshot(self, feed, taken_at, ids):
+        FeedRank.objects.bulk_create([
+            FeedRank(feed=feed, taken_at=taken_at, rank=rank, item_id=item_id)
+            for rank, item_id in enumerate(ids, 1)])
+
+    def page_ids(self, response):
+        return [item.id for item in response.context['page_obj']]
+
+    def test_latest_snapshot_is_listed_by_rank_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('top_stories'))
+
+        # The lookup of the cache generation, then the page
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(self.page_ids(response), [9, 8, 7, 6, 5])
+        self.assertEqual([item.rank for item in response.context['page_obj']],
+                         [1, 3, 4, 5, 6])
+        self.assertContains(response, "?after=6")
+        self.assertEqual(self.page_ids(self.client.get(reverse('ask_stories'))), [2, 1])
+
+    def test_seek_after_and_before_a_rank(self):
+        response = self.client.get(reverse('top_stories'), {"after": 6})
+        self.assertEqual(self.page_ids(response), [4, 3])
+        self.assertFalse(response.context['page_obj'].has_next)
+        self.assertContains(response, "?before=7")
+
+        response = self.client.get(reverse('top_stories'), {"before": 7})
+        self.assertEqual(self.page_ids(response), [9, 8, 7, 6, 5])
+        self.assertFalse(response.context['page_obj'].has_previous)
+
+    def test_feed_without_snapshot_is_empty(self):
+        response = self.client.get(reverse('show_stories'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.page_ids(response), [])
+
+
+class QueryBudgetTests(TestCase):
+
+    def setUp(self) -> None:
+        PageCache().cache.clear()
+        users = User.objects.bulk_create(
+            [User(id=f"user{index}", created=0, karma=0) for index in range(5)])
+        Story.objects.bulk_create([Story(id=index + 1, by=user, title=f"Story {index}")
+                                   for index, user in enumerate(users)])
+
+    def test_list_page_reads_items_and_authors_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('stories'))
+
+        self.assertContains(response, "user4")
+        # The lookup of the cache generation, then the page
+        self.assertEqual(len(queries), 2)
+        self.assertIn('"news_user"', queries[1]["sql"])
+        self.assertNotIn('"news_story"."text"', queries[1]["sql"])
+
+    def test_all_news_context_has_no_unused_querysets(self):
+        response = self.client.get(reverse('all_news'))
+
+        for name in ('comments', 'jobs', 'polls', 'polloptions', 'stories'):
+            self.assertNotIn(name, response.context)
+
+    def test_going_over_the_budget_fails_loudly(self):
+        with mock.patch.object(StoryListView, 'query_budget', 0):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('stories'))
+
+    @override_settings(HN_QUERY_BUDGET_CHECK=False)
+    def test_budget_is_not_checked_when_turned_off(self):
+        with mock.patch.object(StoryListView, 'query_budget', 0):
+            self.assertEqual(self.client.get(reverse('stories')).status_code, 200)
+
+
+class SnippetTests(TestCase):
+
+    def setUp(self) -> None:
+        PageCache().cache.clear()
+        self.user = User.objects.create(id="jl", created=1173923446, karma=2937)
+
+    def test_lists_render_the_stored_snippet_without_reading_text(self):
+        Story.objects.create(id=1, by=self.user, title="Story",
+                             text="The full text", snippet="The <i>snippet</i>")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('stories'))
+
+        self.assertContains(response, "The <i>snippet</i>", html=True)
+        self.assertNotContains(response, "The full text")
+        self.assertFalse(any('"news_story"."text"' in query["sql"]
+                             for query in queries.captured_queries))
+
+    def test_snippet_keeps_only_allowed_markup(self):
+        snippet = make_snippet('<p onclick="x()">Hi <a href="javascript:x()">there</a> '
+                               '<a href="https://example.com">link</a><img src=x></p>')
+
+        self.assertEqual(snippet, '<p>Hi <a>there</a> <a href="https://example.com" '
+                                  'rel="nofollow">link</a></p>')
+
+    def test_excerpt_is_plain_text(self):
+        self.assertEqual(make_excerpt("One &amp; <b>two</b><p>three"), "One & two three")
+
+
+class PageCacheTests(TestCase):
+
+    def setUp(self) -> None:
+        PageCache().cache.clear()
+        FeedEntry.objects.bulk_create([
+            FeedEntry(id=1, type="story", by="jl", title="First story", score=1),
+            FeedEntry(id=2, type="story", by="jl", title="Second story", score=1),
+        ])
+
+    def test_hot_page_is_served_with_one_query(self):
+        first = self.client.get(reverse('all_news'))
+
+        # The lookup of the generation
+        with self.assertNumQueries(1):
+            second = self.client.get(reverse('all_news'))
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+
+    def test_pages_are_cached_by_full_path(self):
+        self.client.get(reverse('all_news'))
+        response = self.client.get(reverse('all_news'), {"before": 2})
+
+        self.assertContains(response, "First story")
+        self.assertNotContains(response, "Second story")
+
+    def test_invalidate_renders_changed_items(self):
+        self.client.get(reverse('all_news'))
+        FeedEntry.objects.filter(id=2).update(title="Renamed story")
+
+        self.assertContains(self.client.get(reverse('all_news')), "Second story")
+
+        PageCache().invalidate()
+        response = self.client.get(reverse('all_news'))
+
+        self.assertContains(response, "Renamed story")
+        self.assertNotContains(response, "Second story")
+
+    def test_invalidation_in_another_process_renders_changed_items(self):
+        self.client.get(reverse('all_news'))
+        FeedEntry.objects.filter(id=2).update(title="Renamed story")
+
+        # As the sync worker does when it commits a batch
+        SyncState.advance(SyncState.ITEMS)
+
+        self.assertContains(self.client.get(reverse('all_news')), "Renamed story")
+
+    def test_generation_outlives_the_cached_entries(self):
+        PageCache().invalidate()
+        generation = PageCache().generation()
+
+        PageCache().cache.clear()
+
+        self.assertEqual(PageCache().generation(), generation)
+        self.assertEqual(SearchCache().generation(), generation)
+
+    def test_culling_never_serves_an_invalidated_page(self):
+        with tempfile.TemporaryDirectory() as location:
+            small = {**settings.CACHES, settings.FRAGMENT_CACHE_ALIAS: {
+                'BACKEND': 'news.cache.LRUFileBasedCache', 'LOCATION': location,
+                'OPTIONS': {'MAX_ENTRIES': 4, 'CULL_FREQUENCY': 2}}}
+
+            with override_settings(CACHES=small):
+                for trial in range(10):
+                    title = f"Story {trial}"
+                    FeedEntry.objects.filter(id=2).update(title=title)
+                    PageCache().invalidate()
+                    self.assertContains(self.client.get(reverse('all_news')), title)
+
+                    # Fragments fill the alias up and force culls
+                    for fragment in range(5):
+                        PageCache().cache.set(f"fragment:{trial}:{fragment}", "x")
+
+    def test_fragment_version_follows_mutable_fields(self):
+        item = FeedEntry(id=1, type="story", title="First story", score=1)
+        version = item.cache_version
+
+        item.score = 2
+        self.assertNotEqual(item.cache_version, version)
+
+
+class LookupsTests(TestCase):
+
+    def test_chunks_split_into_batches(self):
+        chunked = list(chunks(range(2 * BATCH_SIZE + 1)))
+
+        self.assertEqual([len(chunk) for chunk in chunked], [BATCH_SIZE, BATCH_SIZE, 1])
+        self.assertEqual(chunked[2], [2 * BATCH_SIZE])
+        self.assertEqual(list(chunks([])), [])
+
+    def test_filter_in_runs_one_query_per_chunk(self):
+        user = User.objects.create(id="pg", created=0, karma=0)
+        Story.objects.create(id=1, by=user, time=0, title="one")
+        Story.objects.create(id=BATCH_SIZE + 2, by=user, time=0, title="two")
+
+        with self.assertNumQueries(2):
+            found = [story.id for chunk in filter_in(Story.objects, 'id', range(1, BATCH_SIZE + 3))
+                     for story in chunk]
+
+        self.assertEqual(found, [1, BATCH_SIZE + 2])
+
+
+class LRUFileBasedCacheTests(SimpleTestCase):
+
+    def test_least_recently_used_entries_are_culled(self):
+        with tempfile.TemporaryDirectory() as location:
+            cache = LRUFileBasedCache(location, {
+                'OPTIONS': {'MAX_ENTRIES': 3, 'CULL_FREQUENCY': 3}})
+            for age, key in enumerate(("old", "used", "new")):
+                cache.set(key, key)
+                # File times are coarse, spread the writes apart
+                past = time.time() - 100 + age
+                os.utime(cache._key_to_file(key), (past, past))
+
+            self.assertEqual(cache.get("old"), "old")
+            cache.set("newest", "newest")
+
+            self.assertEqual(cache.get("old"), "old")
+            self.assertIsNone(cache.get("used"))
+            self.assertEqual(cache.get("new"), "new")
+            self.assertEqual(cache.get("missing", "default"), "default")
+
+
+class ThreadDetailTests(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(id="jl", created=1173923446, karma=2937)
+        self.story = Story.objects.create(id=1, by=self.user, title="Story", kids="[3, 2]")
+        self.edges(1, [3, 2])
+        self.story_type = ContentType.objects.get_for_model(Story)
+        self.comment_type = ContentType.objects.get_for_model(Comment)
+
+    def edges(self, parent_id, child_ids, child_type="comment"):
+        """ The adjacency rows the DBWriter stores for kids and parts """
+        ItemEdge.objects.bulk_create(
+            [ItemEdge(parent_id=parent_id, child_id=child_id, position=position,
+                      child_type=child_type)
+             for position, child_id in enumerate(child_ids)])
+
+    def comment(self, item_id, parent_id, content_type, kids="[]"):
+        return Comment(id=item_id, by=self.user, text=f"Comment {item_id}", kids=kids,
+                       content_type=content_type, object_id=parent_id)
+
+    def test_replies_are_ordered_by_their_edges_not_the_kids_text(self):
+        Comment.objects.bulk_create(
+            [self.comment(item_id, 1, self.story_type) for item_id in (2, 3, 4)])
+        Story.objects.filter(id=1).update(kids="not json")
+
+        response = self.client.get(reverse('story_detail', kwargs={"pk": 1}))
+
+        self.assertEqual([comment.id for comment in response.context['thread']], [3, 2, 4])
+
+    def test_thread_is_loaded_in_a_query_per_level(self):
+        Comment.objects.bulk_create(
+            [self.comment(2, 1, self.story_type, kids="[5, 4]"),
+             self.comment(3, 1, self.story_type)]
+            + [self.comment(item_id, 2, self.comment_type) for item_id in (4, 5)]
+            + [self.comment(6, 4, self.comment_type)])
+        self.edges(2, [5, 4])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('story_detail', kwargs={"pk": 1}))
+
+        thread = response.context['thread']
+        self.assertEqual([comment.id for comment in thread], [3, 2, 5, 4, 6])
+        self.assertEqual([comment.depth for comment in thread], [0, 0, 1, 1, 2])
+        self.assertContains(response, "Comment 6")
+        comment_queries = [query for query in queries.captured_queries
+                           if 'FROM "news_comment"' in query["sql"]]
+        # One per level, and the empty level below the deepest reply
+        self.assertEqual(len(comment_queries), 4)
+        self.assertFalse(any('FROM "news_user"' in query["sql"]
+                             for query in queries.captured_queries))
+
+    def test_query_count_does_not_grow_with_the_thread(self):
+        Comment.objects.bulk_create(
+            [self.comment(item_id, 1, self.story_type) for item_id in range(10, 60)])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('story_detail', kwargs={"pk": 1}))
+
+        self.assertEqual(len(response.context['thread']), 50)
+        self.assertLessEqual(len(queries), 6)
+
+    def test_comment_and_option_markup_is_sanitized(self):
+        comment = self.comment(2, 1, self.story_type)
+        comment.text = '<i>Fine</i><script>alert(1)</script><img src=x onerror=alert(2)>'
+        comment.save()
+        poll = Poll.objects.create(id=7, by=self.user, title="Poll", parts="[8]")
+        PollOption.objects.create(id=8, by=self.user, parent=poll,
+                                  text='<b onclick="alert(3)">Yes</b>')
+
+        story = self.client.get(reverse('story_detail', kwargs={"pk": 1}))
+        self.assertContains(story, "<i>Fine</i>")
+        self.assertNotContains(story, "alert(")
+
+        poll_page = self.client.get(reverse('poll_detail', kwargs={"pk": 7}))
+        self.assertContains(poll_page, "<b>Yes</b>")
+        self.assertNotContains(poll_page, "alert(")
+
+    def test_poll_lists_its_options_in_order(self):
+        poll = Poll.objects.create(id=7, by=self.user, title="Poll", parts="[9, 8]")
+        self.edges(7, [9, 8], "pollopt")
+        PollOption.objects.bulk_create(
+            [PollOption(id=item_id, by=self.user, parent=poll, text=f"Option {item_id}")
+             for item_id in (8, 9)])
+
+        response = self.client.get(reverse('poll_detail', kwargs={"pk": 7}))
+
+        self.assertEqual([option.id for option in response.context['poll_options']], [9, 8])
+        self.assertContains(response, "Option 8")
+
+
+class SearchListViewTests(TestCase):
+
+    def setUp(self) -> None:
+        SearchCache().cache.clear()
+        documents = [
+            (1, "story", "Rust in production", "How we moved to rust"),
+            (2, "comment", "", "I tried <i>rust</i> last year"),
+            (3, "story", "Python packaging", "Nothing about crabs"),
+            (4, "job", "Rust engineer", "Join us to write Rust"),
+        ]
+        FeedEntry.objects.bulk_create([
+            FeedEntry(id=item_id, type=item_type, by="jl", title=title, snippet=text)
+            for item_id, item_type, title, text in documents])
+        SearchIndex().update(documents)
+
+    def result_ids(self, **params):
+        response = self.client.get(reverse('search_results'), params)
+        self.assertEqual(response.status_code, 200)
+        return [item.id for item in response.context['page_obj']]
+
+    def test_results_are_ranked_by_relevance(self):
+        ids = self.result_ids(search="rust")
+
+        self.assertEqual(sorted(ids), [1, 2, 4])
+        self.assertEqual(ids[-1], 2)
+
+    def test_results_can_be_filtered_by_type(self):
+        self.assertEqual(self.result_ids(search="rust", type="story"), [1])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.result_ids(search="rust engineer"), [4])
+        self.assertEqual(self.result_ids(search=""), [])
+
+    def test_results_are_paginated(self):
+        SearchIndex().update([(item_id, "comment", "", "rust")
+                              for item_id in range(10, 20)])
+        FeedEntry.objects.bulk_create([FeedEntry(id=item_id, type="comment", by="jl", snippet="rust")
+                                       for item_id in range(10, 20)])
+
+        response = self.client.get(reverse('search_results'), {"search": "rust", "page": 3})
+
+        self.assertEqual(len(response.context['page_obj']), 3)
+        self.assertFalse(response.context['page_obj'].has_next)
+        self.assertContains(response, "search=rust&type=&page=2")
+
+    def test_repeated_search_is_served_from_cache(self):
+        self.result_ids(search="Rust")
+
+        with CaptureQueriesContext(connection) as queries:
+            ids = self.result_ids(search="  rust ")
+
+        self.assertEqual(sorted(ids), [1, 2, 4])
+        self.assertFalse(any("news_searchindex" in query["sql"]
+                             for query in queries.captured_queries))
+
+    def test_invalidation_reaches_cached_searches(self):
+        self.assertEqual(self.result_ids(search="crabs"), [3])
+
+        SearchIndex().update([(5, "comment", "", "crabs everywhere")])
+        FeedEntry.objects.create(id=5, type="comment", by="jl", snippet="crabs everywhere")
+        self.assertEqual(self.result_ids(search="crabs"), [3])
+
+        SearchCache().invalidate()
+        self.assertEqual(sorted(self.result_ids(search="crabs")), [3, 5])
+
+    def test_invalidation_in_another_process_reaches_cached_searches(self):
+        self.assertEqual(self.result_ids(search="crabs"), [3])
+        SearchIndex().update([(5, "comment", "", "crabs everywhere")])
+        FeedEntry.objects.create(id=5, type="comment", by="jl", snippet="crabs everywhere")
+
+        # As the sync worker does when it commits a batch
+        SyncState.advance(SyncState.ITEMS)
+
+        self.assertEqual(sorted(self.result_ids(search="crabs")), [3, 5])
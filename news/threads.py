@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import F, OuterRef, Subquery
+
+from .lookups import filter_in
+from .models import Comment, ItemEdge, Poll, PollOption
+
+
+def in_child_order(children, parent_field: str):
+    """ Order a queryset of children as their parents list them in
+    `kids` or `parts`, by the position of their ItemEdge, found through
+    its unique (parent_id, child_id) index. Children their parent does
+    not list come last. """
+    position = ItemEdge.objects.filter(
+        parent_id=OuterRef(parent_field), child_id=OuterRef('id')).values('position')[:1]
+
+    return children.annotate(position=Subquery(position)).order_by(
+        F('position').asc(nulls_last=True), 'id')
+
+
+def load_thread(root, max_depth: int = None) -> list:
+    """ Load every comment below an item, one query per level of the
+    thread (and per news.lookups.BATCH_SIZE parents) whatever its size, each with its
+    author joined in. The tree is assembled in memory.
+
+    Parameters
+    ----------
+    root : Story, Poll or Comment
+        The item whose replies are loaded
+    max_depth : int
+        The number of levels to load, HN_THREAD_MAX_DEPTH by default
+
+    Returns
+    -------
+    list
+        The comments in reading order, depth first. Every comment has its
+        `depth` below the root, starting at 0, and its loaded `replies`.
+    """
+    if max_depth is None:
+        max_depth = getattr(settings, 'HN_THREAD_MAX_DEPTH', 20)
+
+    root.replies = []
+    parents = {root.id: root}
+    content_type = ContentType.objects.get_for_model(type(root))
+
+    for depth in range(max_depth):
+        children = {}
+        replies = Comment.objects.filter(content_type=content_type).select_related(
+            'by').defer('snippet', 'excerpt')
+
+        # In the order of their parents' kids, so appending them keeps
+        # every parent's replies in order
+        for chunk in filter_in(replies, 'object_id', parents):
+            children.update(
+                (comment.id, comment) for comment in in_child_order(chunk, 'object_id'))
+
+        for comment in children.values():
+            comment.depth = depth
+            comment.replies = []
+            parents[comment.object_id].replies.append(comment)
+
+        if not children:
+            break
+
+        parents = children
+        content_type = ContentType.objects.get_for_model(Comment)
+
+    return list(walk(root.replies))
+
+
+def walk(comments: list):
+    """ Yield the comments and their replies depth first """
+    stack = list(reversed(comments))
+
+    while stack:
+        comment = stack.pop()
+        yield comment
+        stack.extend(reversed(comment.replies))
+
+
+def load_poll_options(poll: Poll) -> list:
+    """ Load the options of a poll in one query, in the order of its
+    parts, each with its author joined in """
+    options = PollOption.objects.filter(parent=poll).select_related('by').defer(
+        'snippet', 'excerpt')
+
+    return list(in_child_order(options, 'parent_id'))
@@ -1,8 +1,9 @@
 from django.urls import path
+from .models import FeedRank
 from .views import (
-    HomePageView, CommentListView, CommentDetailView, JobListView, JobDetailView,
-    NewsListView, PollDetailView, PollListView, StoryDetailView, StoryListView,
-    SearchListView
+    HomePageView, CommentListView, CommentDetailView, FeedRankListView, JobListView,
+    JobDetailView, NewsListView, PollDetailView, PollListView, PollOptionDetailView,
+    StoryDetailView, StoryListView, SearchListView
 )
 
 urlpatterns = [
@@ -10,11 +11,21 @@ urlpatterns = [
     path('comment/<int:pk>', CommentDetailView.as_view(), name='comment_detail'),
     path('job/<int:pk>', JobDetailView.as_view(), name='job_detail'),
     path('poll/<int:pk>', PollDetailView.as_view(), name='poll_detail'),
+    path('polloption/<int:pk>', PollOptionDetailView.as_view(), name='poll_option_detail'),
     path('story/<int:pk>', StoryDetailView.as_view(), name='story_detail'),
 
     path('stories/', StoryListView.as_view(), name='stories'),
     path('jobs/', JobListView.as_view(), name='jobs'),
     path('polls/', PollListView.as_view(), name='polls'),
     path('search/', SearchListView.as_view(), name='search_results'),
-    path('', NewsListView.as_view(), name='all_news'),
+    path('news/', NewsListView.as_view(), name='all_news'),
+
+    path('top/', FeedRankListView.as_view(feed=FeedRank.TOP, heading_type='Top'),
+         name='top_stories'),
+    path('ask/', FeedRankListView.as_view(feed=FeedRank.ASK, heading_type='Ask HN'),
+         name='ask_stories'),
+    path('show/', FeedRankListView.as_view(feed=FeedRank.SHOW, heading_type='Show HN'),
+         name='show_stories'),
+    path('hiring/', FeedRankListView.as_view(feed=FeedRank.JOBS, heading_type='Hiring'),
+         name='job_stories'),
 ]
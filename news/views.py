@@ -1,8 +1,12 @@
+from django.conf import settings
+from django.db.models import Subquery
+from django.http import HttpResponse
 from django.views.generic import TemplateView, ListView, DetailView
-from django.db.models import Q
-from .models import Comment, Job, Poll, PollOption, Story
-
-from itertools import chain
+from .models import Comment, FeedEntry, FeedRank, Job, Poll, PollOption, Story
+from .cache import PageCache, SearchCache
+from .pagination import NumberedPage, get_page_number, paginate_by_key, paginate_by_rank
+from .search import SearchIndex
+from .threads import load_poll_options, load_thread
 
 
 class HomePageView(TemplateView):
@@ -16,16 +20,71 @@ class HomePageView(TemplateView):
 
 
 class BaseListView(ListView):
+    """ Lists news items newest first. Pages are seeked by id with
+    ?before=<id> and ?after=<id> rather than numbered, unless keyset is
+    turned off. Rendered pages are cached until the next sync, unless
+    cache_pages is turned off. Only the columns in list_fields are read
+    and the author is joined in the same query.
+    """
     paginate_by = 5
     template_name = 'list.html'
     ordering = '-id'
     heading_type = ''
+    keyset = True
+    cache_pages = True
+
+    # The lookup of the cache generation and the page query
+    query_budget = 2
+
+    # Columns the list renders, or its fragment cache versions depend on.
+    # The text is never read, its stored snippet is shown instead.
+    list_fields = ('id', 'type', 'by', 'time', 'score', 'descendants',
+                   'title', 'snippet')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.model is not None:
+            names = {field.name for field in self.model._meta.concrete_fields}
+            queryset = queryset.select_related('by').only(
+                *(name for name in self.list_fields if name in names), 'by__id')
+
+        return queryset
+
+    def get(self, request, *args, **kwargs):
+        if not self.cache_pages:
+            return super().get(request, *args, **kwargs)
+
+        page_cache = PageCache()
+        content = page_cache.get(request.get_full_path())
+        if content is not None:
+            return HttpResponse(content)
+
+        response = super().get(request, *args, **kwargs)
+        response.render()
+        if response.status_code == 200:
+            page_cache.set(request.get_full_path(), response.content)
+
+        return response
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.keyset:
+            return super().paginate_queryset(queryset, page_size)
+
+        page = paginate_by_key(queryset, page_size,
+                               before=self.request.GET.get('before'),
+                               after=self.request.GET.get('after'))
+
+        return (None, page, page.object_list, page.has_other_pages())
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['news_heading'] = self.heading_type
+        context['fragment_cache'] = getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'default')
+        context['fragment_timeout'] = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 86400)
         context['news_types'] = {
-            'all_news': "All News", 'jobs': "Jobs", 'polls': "Polls", 'stories': "Stories"}
+            'all_news': "All News", 'jobs': "Jobs", 'polls': "Polls", 'stories': "Stories",
+            'top_stories': "Top", 'ask_stories': "Ask HN", 'show_stories': "Show HN",
+            'job_stories': "Hiring"}
 
         return context
 
@@ -33,43 +92,74 @@ class BaseListView(ListView):
 class NewsListView(BaseListView):
     heading_type = 'All News'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['comments'] = Comment.objects.all()
-        context['jobs'] = Job.objects.all()
-        context['polls'] = Poll.objects.all()
-        context['polloptions'] = PollOption.objects.all()
-        context['stories'] = Story.objects.all()
+    def get_queryset(self):
+        # One indexed table holds every item type, newest first
+        return FeedEntry.objects.all()
 
-        return context
+
+class FeedRankListView(BaseListView):
+    """ Lists the items of a HackNews feed in the feed's order, as of its
+    latest snapshot. Pages are seeked by rank with ?after=<rank> and
+    ?before=<rank>, in one query that finds the snapshot, seeks the ranks
+    and joins their items.
+    """
+    template_name = 'ranked.html'
+    feed = FeedRank.TOP
 
     def get_queryset(self):
-        comments = Comment.objects.all()
-        jobs = Job.objects.all()
-        polls = Poll.objects.all()
-        polloptions = PollOption.objects.all()
-        stories = Story.objects.all()
+        latest = FeedRank.objects.filter(feed=self.feed).order_by(
+            '-taken_at').values('taken_at')[:1]
+
+        return FeedRank.objects.filter(feed=self.feed, taken_at=Subquery(latest))
 
-        return sorted(chain(comments, jobs, polls, polloptions, stories), key=lambda item: item.id, reverse=True)
+    def paginate_queryset(self, queryset, page_size):
+        page = paginate_by_rank(queryset, page_size,
+                                before=self.request.GET.get('before'),
+                                after=self.request.GET.get('after'))
+
+        return (None, page, page.object_list, page.has_other_pages())
 
 
 class SearchListView(BaseListView):
+    """ Lists the items matching the ?search= words, most relevant first,
+    optionally of one ?type=. Results are paged straight from the
+    full-text index.
+    """
     heading_type = "Search Results"
     template_name = "search.html"
+    cache_pages = False
+
+    # The lookup of the cache generation, the index query on a cache miss
+    # and the page query
+    query_budget = 3
 
     def get_queryset(self):
-        query = self.request.GET.get('search')
+        query = self.request.GET.get('search', '')
+        item_type = self.request.GET.get('type') or None
+        self.page_number = get_page_number(self.request.GET.get('page'))
+
+        # One result more than the page tells whether a next page exists
+        ids = SearchCache().get_or_search(
+            query, item_type, self.page_number,
+            lambda: SearchIndex().search(
+                query, item_type, limit=self.paginate_by + 1,
+                offset=(self.page_number - 1) * self.paginate_by))
+        entries = FeedEntry.objects.in_bulk(ids)
 
-        comments = Comment.objects.filter(text__icontains=query)
-        jobs = Job.objects.filter(
-            Q(title__icontains=query) | Q(text__icontains=query))
-        polls = Poll.objects.filter(
-            Q(title__icontains=query) | Q(text__icontains=query))
-        polloptions = PollOption.objects.filter(text__icontains=query)
-        stories = Story.objects.filter(
-            Q(title__icontains=query) | Q(text__icontains=query))
+        return [entries[item_id] for item_id in ids if item_id in entries]
 
-        return sorted(chain(comments, jobs, polls, polloptions, stories), key=lambda item: item.id)
+    def paginate_queryset(self, queryset, page_size):
+        page = NumberedPage(queryset[:page_size], self.page_number,
+                            has_next=len(queryset) > page_size)
+
+        return (None, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['search_query'] = self.request.GET.get('search', '')
+        context['search_type'] = self.request.GET.get('type', '')
+
+        return context
 
 
 class CommentListView(BaseListView):
@@ -77,18 +167,37 @@ class CommentListView(BaseListView):
     heading_type = 'Comments'
 
 
-class CommentDetailView(DetailView):
-    model = Comment
+class ItemDetailView(DetailView):
+    """ Shows an item, its author joined in the same query """
     template_name = 'detail.html'
 
+    def get_queryset(self):
+        return super().get_queryset().select_related('by')
+
+
+class ThreadDetailView(ItemDetailView):
+    """ Shows an item with the whole thread of comments below it. The
+    thread is loaded level by level, in a query per level rather than per
+    comment.
+    """
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['thread'] = load_thread(self.object)
+
+        return context
+
+
+class CommentDetailView(ThreadDetailView):
+    model = Comment
+
 
 class JobListView(BaseListView):
     model = Job
     heading_type = 'Jobs'
 
 
-class JobDetailView(DetailView):
-    template_name = 'detail.html'
+class JobDetailView(ItemDetailView):
     model = Job
 
 
@@ -97,16 +206,24 @@ class PollListView(BaseListView):
     heading_type = 'Polls'
 
 
-class PollDetailView(DetailView):
-    template_name = 'detail.html'
+class PollDetailView(ThreadDetailView):
     model = Poll
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['poll_options'] = load_poll_options(self.object)
+
+        return context
+
+
+class PollOptionDetailView(ItemDetailView):
+    model = PollOption
+
 
 class StoryListView(BaseListView):
     model = Story
     heading_type = 'Stories'
 
 
-class StoryDetailView(DetailView):
-    template_name = 'detail.html'
+class StoryDetailView(ThreadDetailView):
     model = Story